@@ -0,0 +1,6 @@
+"""
+An offline load testing harness for the bot.
+
+Signed interactions are fired straight at the ASGI app with Discord and
+the Crunchy API replaced by local stubs, run it with `python -m bench`.
+"""
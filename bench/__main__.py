@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from bench.payloads import APPLICATION_ID, PUBLIC_KEY
+from bench.simulator import Simulator, add_fault_arguments, faults_from_args
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m bench",
+        description="Fires signed interactions at the bot with every upstream stubbed.",
+    )
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--catalogue-size", type=int, default=500)
+    parser.add_argument(
+        "--only",
+        action="append",
+        help="Only run the given handler, can be given more than once.",
+    )
+    parser.add_argument(
+        "--redis",
+        action="store_true",
+        help="Keep component state in Redis like production rather than sqlite.",
+    )
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    # The app reads its config on import so this has to be set up first.
+    os.environ.update(
+        APPLICATION_ID=str(APPLICATION_ID),
+        PUBLIC_KEY=PUBLIC_KEY,
+        BOT_TOKEN="bench",
+        CRUNCHY_API_KEY="bench",
+        STATE_STORAGE="redis" if args.redis else "sqlite",
+    )
+
+    from bench.runner import format_results, run
+    from bench.stubs import CrunchyApiStub, DiscordStub
+    from crunchy.tools import metrics
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    crunchy_api = Simulator(CrunchyApiStub(args.catalogue_size), faults_from_args(args))
+    discord = Simulator(DiscordStub(), faults_from_args(args, seed_offset=1))
+
+    results = asyncio.run(
+        run(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            catalogue_size=args.catalogue_size,
+            only=args.only,
+            crunchy_api=crunchy_api,
+            discord=discord,
+        )
+    )
+    print(format_results(results))
+    print()
+    print(f"crunchy api responses: {dict(crunchy_api.outcomes)}")
+    print(f"discord responses: {dict(discord.outcomes)}")
+    print(
+        f"superseded autocompletes: {metrics.AUTOCOMPLETE_SUPERSEDED.total():.0f}, "
+        f"abandoned upstream requests: {metrics.UPSTREAM_ABANDONED.total():.0f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Delivers an event to thousands of stubbed webhooks through the webhook
+dispatcher, reporting how long it took and what happened to each webhook.
+
+    python -m bench.fanout -n 10000 -c 256 --dead-rate 0.01 --latency-ms 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+from bench.payloads import APPLICATION_ID, PUBLIC_KEY
+from bench.simulator import Simulator, add_fault_arguments, faults_from_args
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.fanout",
+        description="Fans an event out to stubbed webhooks with the dispatcher.",
+    )
+    parser.add_argument("-n", "--webhooks", type=int, default=10_000)
+    parser.add_argument("-c", "--concurrency", type=int, default=256)
+    parser.add_argument(
+        "--dead-rate",
+        type=float,
+        default=0.01,
+        help="The proportion of webhooks which have been deleted.",
+    )
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=60.0,
+        help="Exits with an error if delivery takes longer than this many seconds.",
+    )
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    # The app reads its config on import so this has to be set up first.
+    os.environ.update(
+        APPLICATION_ID=str(APPLICATION_ID),
+        PUBLIC_KEY=PUBLIC_KEY,
+        BOT_TOKEN="bench",
+        CRUNCHY_API_KEY="bench",
+        # Unlike sqlite this doesn't start a thread which keeps us running.
+        STATE_STORAGE="redis",
+    )
+
+    from bench.stubs import DiscordStub
+    from crunchy.config import DISCORD_API
+    from crunchy.tools.fanout import WebhookDispatcher
+    from crunchy.tools.http import HttpHandler
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    discord = Simulator(DiscordStub(), faults_from_args(args))
+    dead_every = round(1 / args.dead_rate) if args.dead_rate > 0 else 0
+    webhooks = [
+        f"{DISCORD_API}/webhooks/{600000000000000000 + i}/"
+        f"{'dead' if dead_every and i % dead_every == 0 else 'live'}-{i}"
+        for i in range(args.webhooks)
+    ]
+
+    async def run():
+        http = HttpHandler("bench", transport=discord.transport())
+        dispatcher = WebhookDispatcher(
+            http,
+            concurrency=args.concurrency,
+            max_attempts=5,
+            progress_interval=5,
+        )
+        payload = {
+            "content": "A new episode is out!",
+            "embeds": [{"title": "Bench Anime 1", "description": "Episode 12"}],
+        }
+        try:
+            return await dispatcher.dispatch("releases", payload, webhooks)
+        finally:
+            await http.shutdown()
+
+    progress = asyncio.run(run())
+
+    for name, value in progress.stats().items():
+        print(
+            f"{name:<10} {value:.2f}"
+            if isinstance(value, float)
+            else f"{name:<10} {value}"
+        )
+    print(f"discord responses: {dict(discord.outcomes)}")
+
+    if progress.elapsed > args.target:
+        print(f"took longer than the {args.target:.0f}s target")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
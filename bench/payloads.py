@@ -0,0 +1,144 @@
+import time
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from nacl.signing import SigningKey
+
+# A fixed key so the app can be configured with it before it's imported.
+SIGNING_KEY = SigningKey(b"crunchy-bench-signing-key-seed!!")
+PUBLIC_KEY = SIGNING_KEY.verify_key.encode().hex()
+
+APPLICATION_ID = 100000000000000000
+GUILD_ID = 200000000000000000
+CHANNEL_ID = 300000000000000000
+
+APPLICATION_COMMAND = 2
+MESSAGE_COMPONENT = 3
+APPLICATION_COMMAND_AUTOCOMPLETE = 4
+
+CHAT_INPUT = 1
+MESSAGE = 3
+
+STRING_OPTION = 3
+
+
+class PayloadFactory:
+    """Makes signed interaction payloads as Discord would send them."""
+
+    def __init__(self, signing_key: SigningKey = SIGNING_KEY):
+        self.signing_key = signing_key
+        self._ids = count(400000000000000000)
+
+    def sign(self, payload: dict) -> Tuple[bytes, Dict[str, str]]:
+        """Encodes the payload and produces the headers Discord would sign it with."""
+        body = orjson.dumps(payload)
+        timestamp = str(int(time.time()))
+        signature = self.signing_key.sign(timestamp.encode() + body).signature
+
+        headers = {
+            "Content-Type": "application/json",
+            "X-Signature-Ed25519": signature.hex(),
+            "X-Signature-Timestamp": timestamp,
+        }
+        return body, headers
+
+    def user(self, user_id: int) -> dict:
+        return {
+            "id": str(user_id),
+            "username": f"bench-{user_id}",
+            "discriminator": "0001",
+            "avatar": None,
+        }
+
+    def interaction(self, type_: int, data: dict, user_id: int) -> dict:
+        id_ = next(self._ids)
+        return {
+            "id": str(id_),
+            "application_id": str(APPLICATION_ID),
+            "type": type_,
+            "data": data,
+            "channel_id": str(CHANNEL_ID),
+            "user": self.user(user_id),
+            "token": f"bench-token-{id_}",
+            "version": 1,
+        }
+
+    def slash_command(self, name: str, options: Dict[str, str], user_id: int) -> dict:
+        return self.interaction(
+            APPLICATION_COMMAND,
+            {
+                "id": str(next(self._ids)),
+                "name": name,
+                "type": CHAT_INPUT,
+                "options": [
+                    {"name": key, "type": STRING_OPTION, "value": value}
+                    for key, value in options.items()
+                ],
+            },
+            user_id,
+        )
+
+    def autocomplete(self, name: str, option: str, value: str, user_id: int) -> dict:
+        return self.interaction(
+            APPLICATION_COMMAND_AUTOCOMPLETE,
+            {
+                "id": str(next(self._ids)),
+                "name": name,
+                "type": CHAT_INPUT,
+                "options": [
+                    {
+                        "name": option,
+                        "type": STRING_OPTION,
+                        "value": value,
+                        "focused": True,
+                    }
+                ],
+            },
+            user_id,
+        )
+
+    def message_command(self, name: str, content: str, user_id: int) -> dict:
+        message_id = next(self._ids)
+        return self.interaction(
+            APPLICATION_COMMAND,
+            {
+                "id": str(next(self._ids)),
+                "name": name,
+                "type": MESSAGE,
+                "target_id": str(message_id),
+                "resolved": {
+                    "messages": {
+                        str(message_id): {
+                            "id": str(message_id),
+                            "channel_id": str(CHANNEL_ID),
+                            "author": self.user(user_id),
+                            "content": content,
+                            "timestamp": "2021-10-01T00:00:00+00:00",
+                            "edited_timestamp": None,
+                            "tts": False,
+                            "mention_everyone": False,
+                            "mentions": [],
+                            "mention_roles": [],
+                            "attachments": [],
+                            "embeds": [],
+                            "pinned": False,
+                            "type": 0,
+                        }
+                    }
+                },
+            },
+            user_id,
+        )
+
+    def component(
+        self,
+        custom_id: str,
+        component_type: int,
+        user_id: int,
+        values: Optional[List[str]] = None,
+    ) -> dict:
+        data = {"custom_id": custom_id, "component_type": component_type}
+        if values is not None:
+            data["values"] = values
+        return self.interaction(MESSAGE_COMPONENT, data, user_id)
@@ -0,0 +1,264 @@
+import asyncio
+import random
+import time
+from itertools import count
+from typing import List, Optional
+
+import httpx
+from roid.state import SqliteBackend
+from roid.state.storage import _SqliteOp  # noqa
+
+from bench.payloads import APPLICATION_ID, PayloadFactory
+from bench.simulator import Simulator
+from bench.stubs import CrunchyApiStub, DiscordStub
+
+SELECT_MENU = 3
+DEFERRED_TYPES = (5, 6)
+
+
+class Result:
+    """The latencies and failures recorded for a single scenario."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.deferred = 0
+        self.elapsed = 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+
+class Scenario:
+    """A kind of interaction to fire at the app."""
+
+    name = ""
+
+    async def setup(self, client: httpx.AsyncClient, factory: PayloadFactory):
+        """Prepares anything the payloads depend on, e.g. a message to click."""
+
+    def payload(self, factory: PayloadFactory, i: int) -> dict:
+        raise NotImplementedError()
+
+
+class SlashCommand(Scenario):
+    def __init__(self, command: str, option: str, values: List[str]):
+        self.name = f"/{command}"
+        self.command = command
+        self.option = option
+        self.values = values
+
+    def payload(self, factory: PayloadFactory, i: int) -> dict:
+        value = self.values[i % len(self.values)]
+        return factory.slash_command(self.command, {self.option: value}, user_id=i)
+
+
+class AutocompleteBurst(Scenario):
+    """Every keystroke of typing out each of the given words."""
+
+    def __init__(self, command: str, option: str, words: List[str]):
+        self.name = f"/{command} autocomplete"
+        self.command = command
+        self.option = option
+        self.keystrokes = [
+            (user, word[:length])
+            for user, word in enumerate(words)
+            for length in range(1, len(word) + 1)
+        ]
+
+    def payload(self, factory: PayloadFactory, i: int) -> dict:
+        user, typed = self.keystrokes[i % len(self.keystrokes)]
+        return factory.autocomplete(self.command, self.option, typed, user_id=user)
+
+
+class MessageCommand(Scenario):
+    def __init__(self, command: str, contents: List[str]):
+        self.name = command
+        self.command = command
+        self.contents = contents
+
+    def payload(self, factory: PayloadFactory, i: int) -> dict:
+        content = self.contents[i % len(self.contents)]
+        return factory.message_command(self.command, content, user_id=i)
+
+
+class SelectOtherResult(Scenario):
+    """Picks from the other results of a message command's response."""
+
+    def __init__(self, command: str, content: str):
+        self.name = f"{command} select"
+        self.command = command
+        self.content = content
+        self.custom_id: Optional[str] = None
+        self.values: List[str] = []
+
+    async def setup(self, client: httpx.AsyncClient, factory: PayloadFactory):
+        payload = factory.message_command(self.command, self.content, user_id=0)
+        data = (await send(client, factory, payload)).json()["data"]
+
+        select = data["components"][0]["components"][0]
+        self.custom_id = select["custom_id"]
+        self.values = [option["value"] for option in select["options"]]
+
+    def payload(self, factory: PayloadFactory, i: int) -> dict:
+        value = random.choice(self.values)
+        return factory.component(self.custom_id, SELECT_MENU, user_id=0, values=[value])
+
+
+def default_scenarios(catalogue_size: int) -> List[Scenario]:
+    anime_ids = [f"anime-{i}" for i in range(catalogue_size)]
+    titles = [f"bench anime {i}" for i in range(50)]
+
+    return [
+        SlashCommand("anime", "query", anime_ids),
+        AutocompleteBurst("anime", "query", titles),
+        MessageCommand("Search Anime", titles),
+        SelectOtherResult("Search Anime", "bench anime 1"),
+        SlashCommand("my-list", "group", ["watchlist"]),
+        AutocompleteBurst("my-list", "group", ["watchlist", "favourites"]),
+    ]
+
+
+async def send(
+    client: httpx.AsyncClient,
+    factory: PayloadFactory,
+    payload: dict,
+) -> httpx.Response:
+    body, headers = factory.sign(payload)
+    return await client.post("/", content=body, headers=headers)
+
+
+def handled_errors() -> int:
+    from crunchy.tools.metrics import HANDLED_ERRORS
+
+    return int(HANDLED_ERRORS.total())
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    factory: PayloadFactory,
+    scenario: Scenario,
+    requests: int,
+    concurrency: int,
+) -> Result:
+    """Fires `requests` interactions of the scenario with `concurrency` in flight."""
+    result = Result(scenario.name)
+    await scenario.setup(client, factory)
+
+    # Signed up front so only the app is measured.
+    payloads = [factory.sign(scenario.payload(factory, i)) for i in range(requests)]
+    counter = count()
+
+    async def worker():
+        for i in iter(counter.__next__, None):
+            if i >= requests:
+                return
+
+            body, headers = payloads[i]
+            started_at = time.perf_counter()
+            try:
+                r = await client.post("/", content=body, headers=headers)
+            except Exception:
+                result.errors += 1
+                continue
+
+            result.latencies.append(time.perf_counter() - started_at)
+            if r.status_code != 200:
+                result.errors += 1
+            elif r.json().get("type") in DEFERRED_TYPES:
+                result.deferred += 1
+
+    handled_before = handled_errors()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started_at
+
+    # Errors turned into a message for the user still respond with a 200.
+    result.errors += handled_errors() - handled_before
+
+    return result
+
+
+async def run(
+    requests: int,
+    concurrency: int,
+    catalogue_size: int,
+    only: Optional[List[str]] = None,
+    crunchy_api: Optional[Simulator] = None,
+    discord: Optional[Simulator] = None,
+) -> List[Result]:
+    """
+    Starts the app with Discord and the Crunchy API simulated and runs
+    each scenario against it in turn.
+    """
+    from crunchy import app
+
+    if crunchy_api is None:
+        crunchy_api = Simulator(CrunchyApiStub(catalogue_size))
+    if discord is None:
+        discord = Simulator(DiscordStub())
+
+    app.crunchy_api_transport = crunchy_api.transport()
+    app.discord_transport = discord.transport()
+    assert app.application_id == APPLICATION_ID
+
+    factory = PayloadFactory()
+    results = []
+
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            for scenario in default_scenarios(catalogue_size):
+                if only and scenario.name not in only:
+                    continue
+
+                results.append(
+                    await run_scenario(client, factory, scenario, requests, concurrency)
+                )
+    finally:
+        await shutdown(app)
+
+    return results
+
+
+async def shutdown(app):
+    """
+    Shuts the app down, waking roid's sqlite state thread first as it only
+    checks whether it should stop after it has handled an operation.
+    """
+    from crunchy.config import STATE_BACKEND
+
+    if isinstance(STATE_BACKEND, SqliteBackend):
+        runner = STATE_BACKEND._runner  # noqa
+        runner._running = False  # noqa
+        runner.submit(_SqliteOp("GET", {"key": ""}))
+
+    await app.router.shutdown()
+
+
+def format_results(results: List[Result]) -> str:
+    rows = [("handler", "reqs", "errors", "deferred", "req/s", "p50", "p95", "p99")]
+    for result in results:
+        rows.append(
+            (
+                result.name,
+                str(len(result.latencies)),
+                str(result.errors),
+                str(result.deferred),
+                f"{result.throughput:.0f}",
+                *(f"{result.percentile(q) * 1000:.2f}ms" for q in (0.5, 0.95, 0.99)),
+            )
+        )
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows
+    )
@@ -0,0 +1,372 @@
+"""
+A local stand-in for the Crunchy API and Discord which injects faults.
+
+The stubs from `bench.stubs` are wrapped with configurable latency,
+rate limits which answer with 429s and the same headers the real services
+send, bursts of server errors and connection resets. Every fault is drawn
+from a seeded generator so a run can be reproduced exactly.
+
+The simulator can be used in process as a httpx transport, or served on
+its own and pointed at with `CRUNCHY_API_URL` / `DISCORD_API_URL`:
+
+    python -m bench.simulator crunchy --port 8100 --error-rate 0.01
+    CRUNCHY_API_URL=http://127.0.0.1:8100/v0 poetry run start
+"""
+
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+import orjson
+
+Handler = Callable[[httpx.Request], httpx.Response]
+Latency = Callable[[random.Random], float]
+
+# Like Discord, the rate limits are per route and top level resource, which
+# for webhooks is the id and token.
+MAJOR_PARAMETER = re.compile(r"/(?:channels|guilds)/(\d+)|/webhooks/(\d+/[^/]+)")
+ID = re.compile(r"/(?!v\d+/)[^/]*\d[^/]*")
+
+
+def bucket_key(request: httpx.Request) -> Tuple[str, str]:
+    """The route with its ids removed and the major parameter of a request."""
+    path = request.url.path
+    match = MAJOR_PARAMETER.search(path)
+    major = (match.group(1) or match.group(2)) if match is not None else ""
+    return f"{request.method} {ID.sub('/{id}', path)}", major
+
+
+def fixed(seconds: float) -> Latency:
+    """Always takes the same time to respond."""
+    return lambda rng: seconds
+
+
+def uniform(low: float, high: float) -> Latency:
+    """Takes anywhere between `low` and `high` seconds to respond."""
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median: float, p99: float) -> Latency:
+    """A long tail like most real services, given the median and 99th percentile."""
+    mu = math.log(median)
+    sigma = math.log(p99 / median) / 2.326  # the z-score of the 99th percentile
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class Faults:
+    """
+    The faults to inject into a simulated upstream.
+
+    Args:
+        latency:
+            The distribution the time taken to respond is drawn from.
+        rate_limit:
+            The requests allowed per bucket (route and major parameter)
+            every `rate_limit_window` seconds or None for no limit.
+        rate_limit_window:
+            The seconds until a bucket resets.
+        global_rate_limit:
+            The requests allowed across every route per second before
+            global 429s are returned or None for no limit.
+        error_rate:
+            The chance of any request starting a burst of server errors.
+        error_burst:
+            The amount of requests in a row which fail once a burst starts.
+        error_status:
+            The status code the failed requests respond with.
+        reset_rate:
+            The chance of the connection being reset rather than answered.
+        seed:
+            Seeds every random choice so a run can be repeated.
+    """
+
+    def __init__(
+        self,
+        latency: Latency = fixed(0),
+        rate_limit: Optional[int] = None,
+        rate_limit_window: float = 1.0,
+        global_rate_limit: Optional[int] = None,
+        error_rate: float = 0.0,
+        error_burst: int = 1,
+        error_status: int = 503,
+        reset_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.global_rate_limit = global_rate_limit
+        self.error_rate = error_rate
+        self.error_burst = error_burst
+        self.error_status = error_status
+        self.reset_rate = reset_rate
+        self.seed = seed
+
+
+class _Window:
+    """A fixed window rate limit bucket."""
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.started_at = 0.0
+        self.used = 0
+
+    def hit(self, now: float) -> Tuple[int, float]:
+        """Counts a request returning the requests remaining and the reset delay."""
+        if now - self.started_at >= self.period:
+            self.started_at = now
+            self.used = 0
+
+        self.used += 1
+        return self.limit - self.used, self.started_at + self.period - now
+
+
+class Simulator:
+    """
+    Answers requests with the given handler, injecting the configured faults.
+
+    Use `transport()` to hand it to a httpx client or serve the instance
+    itself as an ASGI app.
+    """
+
+    def __init__(self, handler: Handler, faults: Optional[Faults] = None):
+        self.handler = handler
+        self.faults = faults or Faults()
+        self.outcomes = Counter()
+
+        self._rng = random.Random(self.faults.seed)
+        self._buckets: Dict[Tuple[str, str], _Window] = {}
+        self._global: Optional[_Window] = None
+        if self.faults.global_rate_limit is not None:
+            self._global = _Window(self.faults.global_rate_limit, 1.0)
+        self._burst_left = 0
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """
+        Answers a single request, this raises `httpx.ReadError` when the
+        connection is reset.
+        """
+        faults = self.faults
+
+        # Everything is drawn up front so the outcome of a request doesn't
+        # depend on how long the ones before it were held up.
+        delay = faults.latency(self._rng)
+        reset = self._rng.random() < faults.reset_rate
+        starts_burst = self._rng.random() < faults.error_rate
+
+        await asyncio.sleep(delay)
+
+        if reset:
+            self.outcomes["reset"] += 1
+            raise httpx.ReadError("connection reset by peer", request=request)
+
+        now = time.monotonic()
+        if self._global is not None:
+            remaining, reset_after = self._global.hit(now)
+            if remaining < 0:
+                self.outcomes["429 global"] += 1
+                return self._rate_limited(reset_after, {"X-RateLimit-Global": "true"})
+
+        headers = {}
+        if faults.rate_limit is not None:
+            route, major = bucket_key(request)
+            bucket = self._buckets.get((route, major))
+            if bucket is None:
+                bucket = _Window(faults.rate_limit, faults.rate_limit_window)
+                self._buckets[(route, major)] = bucket
+
+            remaining, reset_after = bucket.hit(now)
+            headers = {
+                "X-RateLimit-Limit": str(bucket.limit),
+                "X-RateLimit-Remaining": str(max(remaining, 0)),
+                "X-RateLimit-Reset": f"{time.time() + reset_after:.3f}",
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+                "X-RateLimit-Bucket": hashlib.md5(route.encode()).hexdigest(),
+            }
+
+            if remaining < 0:
+                self.outcomes["429"] += 1
+                return self._rate_limited(reset_after, headers)
+
+        if starts_burst and self._burst_left == 0:
+            self._burst_left = faults.error_burst
+
+        if self._burst_left > 0:
+            self._burst_left -= 1
+            self.outcomes[str(faults.error_status)] += 1
+            return httpx.Response(
+                faults.error_status,
+                content=b"upstream unavailable",
+                headers={"Via": "1.1 simulator"},
+            )
+
+        response = self.handler(request)
+        response.headers.update(headers)
+
+        self.outcomes[str(response.status_code)] += 1
+        return response
+
+    @staticmethod
+    def _rate_limited(retry_after: float, headers: dict) -> httpx.Response:
+        is_global = "X-RateLimit-Global" in headers
+        body = {
+            "message": "You are being rate limited.",
+            "retry_after": round(retry_after, 3),
+            "global": is_global,
+        }
+        return httpx.Response(
+            429,
+            content=orjson.dumps(body),
+            headers={
+                **headers,
+                "Content-Type": "application/json",
+                "Retry-After": str(math.ceil(retry_after)),
+                "Via": "1.1 simulator",
+            },
+        )
+
+    async def __call__(
+        self,
+        scope: dict,
+        receive: Callable[[], Awaitable[dict]],
+        send: Callable[[dict], Awaitable[None]],
+    ):
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        host = dict(scope["headers"]).get(b"host", b"localhost").decode()
+        url = f"{scope['scheme']}://{host}{scope['path']}"
+        if scope["query_string"]:
+            url = f"{url}?{scope['query_string'].decode()}"
+
+        request = httpx.Request(
+            scope["method"], url, headers=scope["headers"], content=body
+        )
+
+        try:
+            response = await self.handle(request)
+        except httpx.ReadError:
+            # The server drops the connection when the app fails part way
+            # through a response, which the client sees as it being reset.
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(b"content-length", b"1024")],
+                }
+            )
+            raise ConnectionResetError("simulated connection reset")
+
+        content = response.read()
+        headers = [
+            (name, value)
+            for name, value in response.headers.raw
+            if name.lower() != b"content-length"
+        ]
+        headers.append((b"content-length", str(len(content)).encode()))
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers,
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    """Adds the options for `faults_from_args` to the given parser."""
+    group = parser.add_argument_group("faults")
+    group.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="The median upstream latency.",
+    )
+    group.add_argument(
+        "--latency-p99-ms",
+        type=float,
+        help="The 99th percentile upstream latency, gives the latency a long tail.",
+    )
+    group.add_argument(
+        "--rate-limit",
+        type=int,
+        help="The requests allowed per route bucket every second.",
+    )
+    group.add_argument(
+        "--global-rate-limit",
+        type=int,
+        help="The requests allowed across every route every second.",
+    )
+    group.add_argument("--error-rate", type=float, default=0.0)
+    group.add_argument("--error-burst", type=int, default=1)
+    group.add_argument("--error-status", type=int, default=503)
+    group.add_argument("--reset-rate", type=float, default=0.0)
+    group.add_argument("--seed", type=int, default=0)
+
+
+def faults_from_args(args: argparse.Namespace, seed_offset: int = 0) -> Faults:
+    median = args.latency_ms / 1000
+    if args.latency_p99_ms is not None and median > 0:
+        latency = lognormal(median, args.latency_p99_ms / 1000)
+    else:
+        latency = fixed(median)
+
+    return Faults(
+        latency=latency,
+        rate_limit=args.rate_limit,
+        global_rate_limit=args.global_rate_limit,
+        error_rate=args.error_rate,
+        error_burst=args.error_burst,
+        error_status=args.error_status,
+        reset_rate=args.reset_rate,
+        seed=args.seed + seed_offset,
+    )
+
+
+def main():
+    import uvicorn
+
+    from bench.stubs import CrunchyApiStub, DiscordStub
+
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.simulator",
+        description="Serves a fault injecting stand-in for an upstream.",
+    )
+    parser.add_argument("upstream", choices=("crunchy", "discord"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--catalogue-size", type=int, default=500)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    if args.upstream == "crunchy":
+        handler = CrunchyApiStub(args.catalogue_size)
+    else:
+        handler = DiscordStub()
+
+    simulator = Simulator(handler, faults_from_args(args))
+    uvicorn.run(simulator, host=args.host, port=args.port, lifespan="off")
+
+
+if __name__ == "__main__":
+    main()
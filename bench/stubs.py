@@ -0,0 +1,118 @@
+import re
+from typing import Dict, List
+
+import httpx
+import orjson
+
+# Executing a webhook, which includes sending an interaction follow up.
+WEBHOOK = re.compile(r"/webhooks/\d+/[^/]+$")
+
+DESCRIPTION = " ".join(["A long synopsis which needs shortening for the embed."] * 40)
+
+
+def make_entities(kind: str, amount: int) -> List[dict]:
+    """Makes a catalogue of fake entities shaped like the api's."""
+    return [
+        {
+            "id": f"{kind}-{i}",
+            "title": f"Bench {kind.title()} {i}",
+            "title_english": f"Bench {kind.title()} {i} (English)",
+            "title_japanese": f"ベンチ {i}",
+            "description": DESCRIPTION,
+            "genres": ["Action", "Comedy", "Drama"],
+            "rating": i % 10 + 1,
+            "img_url": f"https://img.example.com/{kind}/{i}.png",
+        }
+        for i in range(amount)
+    ]
+
+
+def _json(status: int, data) -> httpx.Response:
+    return httpx.Response(
+        status,
+        content=orjson.dumps(data),
+        headers={"Content-Type": "application/json", "Via": "1.1 bench"},
+    )
+
+
+class CrunchyApiStub:
+    """Answers the Crunchy API requests the bot makes from an in memory catalogue."""
+
+    def __init__(self, catalogue_size: int = 500):
+        self.catalogue: Dict[str, List[dict]] = {
+            kind: make_entities(kind, catalogue_size) for kind in ("anime", "manga")
+        }
+        self.by_id = {
+            entity["id"]: entity
+            for entities in self.catalogue.values()
+            for entity in entities
+        }
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        parts = request.url.path.strip("/").split("/")[1:]  # drops the version
+
+        if parts[:1] == ["data"] and len(parts) == 3:
+            kind, target = parts[1], parts[2]
+            if target == "search":
+                return self.search(kind, request.url.params)
+
+            entity = self.by_id.get(target)
+            if entity is None:
+                return _json(404, {"detail": "not found"})
+            return _json(200, {"data": entity})
+
+        if parts[:1] == ["tracking"] and len(parts) == 3:
+            if parts[2] == "tags":
+                tags = [
+                    {"tag_name": name, "tag_id": name.lower()}
+                    for name in ("Watchlist", "Favourites", "Completed", "Dropped")
+                ]
+                return _json(200, {"data": tags})
+
+            # The api has no paging for tracking lists, the whole list is
+            # always returned.
+            return _json(200, {"data": self.catalogue["anime"]})
+
+        if parts[:1] == ["events"]:
+            return _json(200, {"data": None})
+
+        return _json(404, {"detail": "not found"})
+
+    def search(self, kind: str, params) -> httpx.Response:
+        query = params.get("query", "").lower()
+        limit = int(params.get("limit", 5))
+
+        hits = [
+            entity
+            for entity in self.catalogue[kind]
+            if query in entity["title_english"].lower()
+        ]
+        if not hits:
+            hits = self.catalogue[kind]
+
+        return _json(200, {"data": {"hits": hits[:limit]}})
+
+
+class DiscordStub:
+    """
+    Accepts any request to Discord, e.g. follow ups, webhook creation
+    and webhook execution.
+
+    Webhooks whose token starts with `dead` have been deleted.
+    """
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+
+        if request.method == "POST" and path.endswith("/webhooks"):
+            return _json(200, {"id": "500000000000000000", "token": "bench-webhook"})
+
+        if request.method == "POST" and WEBHOOK.search(path):
+            if path.rsplit("/", 1)[-1].startswith("dead"):
+                return _json(404, {"message": "Unknown Webhook", "code": 10015})
+            return _json(200, {"id": "500000000000000001", "channel_id": "1"})
+
+        if request.method == "DELETE":
+            return httpx.Response(204)
+
+        return _json(200, {})
@@ -1,8 +1,35 @@
-from typing import Optional
+import asyncio
+import hmac
+import logging
+import time
+from typing import Awaitable, Dict, List, Optional, Set, Tuple
 
+import aioredis
+import httpx
+from fastapi import Header
+from fastapi.responses import PlainTextResponse
 from roid import SlashCommands
+from roid.http import HttpHandler as RoidHttpHandler
+from roid.interactions import Interaction, InteractionType, OptionData
+from roid.objects import ResponseFlags, ResponseType
+from roid.response import ResponseData, ResponsePayload
 
-from crunchy.tools import http, api
+from crunchy import config, global_error_handlers
+from crunchy.tools import (
+    http,
+    api,
+    cache,
+    index,
+    distributed,
+    manifest,
+    entities,
+    deadline,
+    fanout,
+    metrics,
+    scheduler,
+)
+
+_log = logging.getLogger("crunchy-app")
 
 
 class CommandHandler(SlashCommands):
@@ -19,14 +46,464 @@ class CommandHandler(SlashCommands):
         self.__token = token
         self.__crunchy_api_key = crunchy_api_key
 
+        # Replaces the network for the upstream clients e.g. with stubs.
+        self.crunchy_api_transport: Optional[httpx.AsyncBaseTransport] = None
+        self.discord_transport: Optional[httpx.AsyncBaseTransport] = None
+
+        self.redis: Optional[aioredis.Redis] = None
+        self.limiter: Optional[distributed.SharedRateLimiter] = None
         self.http: Optional[http.HttpHandler] = None
         self.client: Optional[api.CrunchyApi] = None
+        self.search_cache: Optional[cache.TTLCache] = None
+        self.entities: Optional[entities.EntityCache] = None
+        self.embed_cache: Optional[cache.TTLCache] = None
+        self.tracking_tags: Optional[cache.TTLCache] = None
+        self.tracking_pages: Optional[cache.TTLCache] = None
+        self.catalogue: Optional[index.CatalogueIndexer] = None
+        self.webhooks: Optional[fanout.WebhookDispatcher] = None
+
+        # Webhooks found to be deleted, left out of any later event deliveries.
+        self.dead_webhooks: Set[str] = set()
+
+        self._follow_ups: Set[asyncio.Task] = set()
+        self._background: Set[asyncio.Future] = set()
+
+        # The in flight autocomplete for each user, command and option.
+        self._autocompletes: Dict[Tuple[int, str, Optional[str]], asyncio.Task] = {}
 
         self.on_event("startup")(self.startup)
+        if config.METRICS_TOKEN:
+            self.get("/metrics", include_in_schema=False)(self.render_metrics)
 
     async def startup(self):
-        self.http = http.HttpHandler(self.__token)
-        self.client = api.CrunchyApi(self.__crunchy_api_key)
+        if config.SHARED_RATE_LIMITS or config.ENTITY_CACHE_REDIS:
+            self.redis = aioredis.Redis(
+                host=config.REDIS_HOST,
+                port=config.REDIS_PORT,
+                db=config.REDIS_DB,
+            )
+            self.on_event("shutdown")(self.redis.close)
 
+        if config.SHARED_RATE_LIMITS:
+            self.limiter = distributed.SharedRateLimiter(
+                self.redis,
+                lease_size=config.SHARED_RATE_LIMIT_LEASE,
+            )
+
+        self.http = http.HttpHandler(
+            self.__token,
+            limiter=self.limiter,
+            transport=self.discord_transport,
+        )
+        self.client = api.CrunchyApi(
+            self.__crunchy_api_key,
+            limiter=self.limiter,
+            transport=self.crunchy_api_transport,
+        )
+        self.webhooks = fanout.WebhookDispatcher(
+            self.http,
+            concurrency=config.WEBHOOK_FANOUT_CONCURRENCY,
+            max_attempts=config.WEBHOOK_FANOUT_MAX_ATTEMPTS,
+            progress_interval=config.WEBHOOK_FANOUT_PROGRESS_INTERVAL,
+        )
+        self.search_cache = cache.TTLCache(
+            maxsize=config.SEARCH_CACHE_SIZE,
+            ttl=config.SEARCH_CACHE_TTL,
+        )
+        self.entities = entities.EntityCache(
+            self.client,
+            maxsize=config.ENTITY_CACHE_SIZE,
+            ttls=config.ENTITY_CACHE_TTLS,
+            stale_ttl=config.ENTITY_CACHE_STALE_TTL,
+            negative_ttl=config.ENTITY_CACHE_NEGATIVE_TTL,
+            redis=self.redis if config.ENTITY_CACHE_REDIS else None,
+            spawn=self.run_in_background,
+        )
+        self.embed_cache = cache.TTLCache(
+            maxsize=config.EMBED_CACHE_SIZE,
+            ttl=config.EMBED_CACHE_TTL,
+        )
+        self.tracking_pages = cache.TTLCache(
+            maxsize=config.TRACKING_PAGE_CACHE_SIZE,
+            ttl=config.TRACKING_PAGE_CACHE_TTL,
+        )
+        self.tracking_tags = cache.TTLCache(
+            maxsize=config.TRACKING_TAG_CACHE_SIZE,
+            ttl=config.TRACKING_TAG_CACHE_TTL,
+        )
+        self.client.write_listeners.append(self._on_api_write)
+
+        self.on_event("shutdown")(self.cancel_background)
         self.on_event("shutdown")(self.http.shutdown)
         self.on_event("shutdown")(self.client.shutdown)
+
+        # Done before we report ready so the first interactions after a
+        # deploy don't pay for the connection handshakes.
+        await asyncio.gather(self.http.warm(), self.client.warm())
+
+        if config.CATALOGUE_SNAPSHOT_DIR is not None:
+            self.catalogue = index.CatalogueIndexer(
+                config.CATALOGUE_SNAPSHOT_DIR,
+                kinds=("anime", "manga"),
+                interval=config.CATALOGUE_REFRESH_INTERVAL,
+            )
+            await self.catalogue.start()
+            self.on_event("shutdown")(self.catalogue.shutdown)
+
+    def run_in_background(self, coro: Awaitable) -> asyncio.Future:
+        """
+        Runs work which isn't part of any response e.g. refreshing a cache,
+        keeping hold of it until it's done so it isn't garbage collected.
+        """
+        with deadline.cleared(), scheduler.priority(scheduler.BACKGROUND):
+            task = asyncio.ensure_future(coro)
+
+        self._background.add(task)
+        task.add_done_callback(self._on_background_done)
+        return task
+
+    def _on_background_done(self, task: asyncio.Future):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            _log.error("background task failed", exc_info=task.exception())
+
+    async def cancel_background(self):
+        for task in list(self._background):
+            task.cancel()
+
+    def invalidate_tracking(self, user_id: int):
+        """Drops everything cached about the user's tracking lists."""
+        user_id = str(user_id)
+        self.tracking_tags.invalidate(user_id)
+        self.tracking_pages.invalidate_if(lambda key: str(key[0]) == user_id)
+
+    def _on_api_write(self, section: str):
+        parts = section.strip("/").split("/")
+        if len(parts) >= 2 and parts[0] == "tracking":
+            self.invalidate_tracking(parts[1])
+
+    async def sync_commands(self):
+        """
+        Registers any commands which have changed with Discord.
+
+        Unlike `register_commands_on_start` this is intended to be ran once
+        by the main process before any workers are started, rather than by
+        every worker as it starts up.
+
+        The compiled commands are hashed and compared with the manifest of
+        the last sync so only new or changed commands are sent to Discord.
+        The sync holds a lock so when several replicas start at once the
+        first registers the commands and the rest find nothing to do.
+        """
+        if config.COMMAND_MANIFEST_PATH is not None:
+            store = manifest.FileManifestStore(config.COMMAND_MANIFEST_PATH)
+        else:
+            store = manifest.RedisManifestStore(
+                aioredis.Redis(
+                    host=config.REDIS_HOST,
+                    port=config.REDIS_PORT,
+                    db=config.REDIS_DB,
+                ),
+                lock_ttl=config.COMMAND_SYNC_LOCK_TTL,
+            )
+
+        self._http = RoidHttpHandler(self.application_id, self.__token)
+
+        try:
+            async with store.lock():
+                previous = {} if config.FORCE_COMMAND_SYNC else await store.load()
+                compiled = manifest.compile_commands(self._commands.values())
+                current = manifest.make_manifest(compiled)
+
+                changes = manifest.diff(previous, current)
+                if not changes:
+                    _log.info("commands are up to date, skipping registration")
+
+                for scope, scope_changes in changes.items():
+                    await self._sync_scope(
+                        scope, scope_changes, compiled.get(scope, {})
+                    )
+
+                await store.save(current)
+        finally:
+            await self._http.shutdown()
+            self._http = None
+            await store.shutdown()
+
+    async def _sync_scope(
+        self,
+        scope: str,
+        changes: manifest.ScopeChanges,
+        commands: dict,
+    ):
+        if scope == manifest.GLOBAL:
+            route = "/commands"
+        else:
+            route = f"/guilds/{scope}/commands"
+
+        # Commands can't be deleted by name, so the scope is overwritten instead
+        # which also removes anything left over from before the manifest.
+        if changes.removed or changes.unknown:
+            _log.info(
+                "overwriting the %s commands, removing %s", scope, changes.removed
+            )
+            await self._http.request("PUT", route, json=list(commands.values()))
+            return
+
+        for name in changes.changed:
+            _log.info("registering the changed %s command %r", scope, name)
+            await self._http.request("POST", route, json=commands[name])
+
+    async def render_metrics(
+        self, authorization: Optional[str] = Header(None)
+    ) -> PlainTextResponse:
+        """
+        Renders every metric in the Prometheus text format, for scrapers
+        with the `METRICS_TOKEN` as their bearer token.
+
+        Metrics are kept per process so each worker must be scraped separately.
+        """
+        if not bearer_token_matches(authorization, config.METRICS_TOKEN):
+            return unauthorized()
+
+        return PlainTextResponse(
+            metrics.REGISTRY.render(),
+            media_type="text/plain; version=0.0.4",
+        )
+
+    async def _invoke_with_handlers(
+        self,
+        callback,
+        interaction: Interaction,
+        default_response_type: ResponseType,
+        pass_parent: bool = False,
+    ) -> ResponsePayload:
+        """
+        Invokes the command or component, deferring the response if it hasn't
+        finished within `INTERACTION_DEFER_AFTER` seconds.
+
+        Once deferred the work carries on in the background and the original
+        response is edited with the result when it's done. Any retries which
+        would take the work past the point Discord accepts the response
+        are abandoned with a `DeadlineExceeded` error.
+        """
+        is_autocomplete = (
+            interaction.type == InteractionType.APPLICATION_COMMAND_AUTOCOMPLETE
+        )
+
+        # Turned away straight away rather than queueing behind work which
+        # would likely be abandoned by the time it's reached.
+        if self.client.scheduler.overloaded():
+            if is_autocomplete:
+                metrics.INTERACTIONS_SHED.labels("autocomplete").inc()
+                return _no_choices()
+
+            metrics.INTERACTIONS_SHED.labels(
+                _interaction_labels(callback, interaction)[0]
+            ).inc()
+            return global_error_handlers.busy_response()
+
+        if is_autocomplete:
+            callback = _no_choices_on_error(callback)
+
+        started_at = time.perf_counter()
+        invoke = super()._invoke_with_handlers(
+            callback, interaction, default_response_type, pass_parent
+        )
+
+        if is_autocomplete:
+            latency = metrics.INTERACTION_LATENCY.labels(
+                "autocomplete", interaction.data.name
+            )
+
+            # Autocomplete can't be deferred, anything late is thrown away.
+            with deadline.deadline(config.INTERACTION_TIMEOUT), scheduler.priority(
+                scheduler.AUTOCOMPLETE
+            ):
+                task = asyncio.ensure_future(invoke)
+
+            # Only the answer to the latest request for an option is shown,
+            # so the older ones are cancelled to free up their upstream slots.
+            key = _autocomplete_key(interaction)
+            previous = self._autocompletes.get(key)
+            if previous is not None:
+                previous.cancel()
+                metrics.AUTOCOMPLETE_SUPERSEDED.labels(interaction.data.name).inc()
+            self._autocompletes[key] = task
+
+            try:
+                return await asyncio.wait_for(task, config.INTERACTION_TIMEOUT)
+            except asyncio.TimeoutError:
+                return _no_choices()
+            except asyncio.CancelledError:
+                if self._autocompletes.get(key) is task:
+                    raise
+                return _no_choices()
+            finally:
+                if self._autocompletes.get(key) is task:
+                    del self._autocompletes[key]
+                latency.observe(time.perf_counter() - started_at)
+
+        labels = _interaction_labels(callback, interaction)
+        latency = metrics.INTERACTION_LATENCY.labels(*labels)
+
+        with deadline.deadline(config.FOLLOWUP_TIMEOUT), scheduler.priority(
+            scheduler.INTERACTION
+        ):
+            task = asyncio.ensure_future(invoke)
+
+        # Covers the whole of the work, even once it's been deferred.
+        task.add_done_callback(
+            lambda _: latency.observe(time.perf_counter() - started_at)
+        )
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(task),
+                config.INTERACTION_DEFER_AFTER,
+            )
+        except asyncio.TimeoutError:
+            pass
+
+        metrics.INTERACTIONS_DEFERRED.labels(*labels).inc()
+
+        is_component = interaction.type == InteractionType.MESSAGE_COMPONENT
+        follow_up = asyncio.ensure_future(
+            self._follow_up(interaction, task, is_component)
+        )
+        self._follow_ups.add(follow_up)
+        follow_up.add_done_callback(self._follow_ups.discard)
+
+        if is_component:
+            return ResponsePayload(type=ResponseType.DEFERRED_UPDATE_MESSAGE)
+        return ResponsePayload(type=ResponseType.DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE)
+
+    async def _follow_up(
+        self,
+        interaction: Interaction,
+        task: asyncio.Future,
+        is_component: bool,
+    ):
+        """Delivers the result of a deferred interaction once it's done."""
+        try:
+            resp: ResponsePayload = await task
+        except Exception as e:
+            # Errors with a registered handler are normally handled by roid
+            # before we get here, anything else gets the generic message.
+            handler = self._global_error_handlers.get(type(e))  # noqa
+            if handler is None:
+                handler = global_error_handlers.on_unhandled_error
+            resp = await self.process_response(
+                ResponseType.CHANNEL_MESSAGE_WITH_SOURCE, handler(e)
+            )
+
+        webhook = f"/webhooks/{self.application_id}/{interaction.token}"
+        original = f"{webhook}/messages/@original"
+
+        try:
+            if resp.data is None:
+                if not is_component:
+                    # Removes the "thinking..." message as there's nothing to say.
+                    await self.http.request("DELETE", original)
+                return
+
+            data = resp.data.dict(
+                exclude_none=True,
+                exclude={"choices", "component_context"},
+            )
+
+            if is_component and resp.type == ResponseType.UPDATE_MESSAGE:
+                await self.http.request("PATCH", original, json=data)
+                return
+
+            if is_component:
+                await self.http.request("POST", webhook, json=data)
+                return
+
+            # The deferred message is public so ephemeral responses have to be
+            # sent as a new message instead.
+            if (resp.data.flags or 0) & ResponseFlags.EPHEMERAL:
+                await self.http.request("DELETE", original)
+                await self.http.request("POST", webhook, json=data)
+                return
+
+            await self.http.request("PATCH", original, json=data)
+        except Exception as e:
+            _log.warning("failed to deliver deferred response: %r", e)
+
+
+def _interaction_labels(callback, interaction: Interaction) -> Tuple[str, str]:
+    """The type and name labels to record metrics for an interaction under."""
+    if interaction.type == InteractionType.MESSAGE_COMPONENT:
+        func = getattr(callback, "_callback", None)
+        return "component", getattr(func, "__name__", "unknown")
+    return "command", interaction.data.name
+
+
+def bearer_token_matches(authorization: Optional[str], token: Optional[str]) -> bool:
+    """Checks the Authorization header carries the token, in constant time."""
+    if not token:
+        return False
+    return hmac.compare_digest(
+        (authorization or "").encode(), f"Bearer {token}".encode()
+    )
+
+
+def unauthorized() -> PlainTextResponse:
+    return PlainTextResponse(
+        "Unauthorized",
+        status_code=401,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def _no_choices() -> ResponsePayload:
+    return ResponsePayload(
+        type=ResponseType.APPLICATION_COMMAND_AUTOCOMPLETE_RESULT,
+        data=ResponseData(choices=[]),
+    )
+
+
+def _no_choices_on_error(callback):
+    """
+    Wraps an autocomplete callback so errors which the global error handlers
+    would answer with a message are answered with no choices instead, as
+    Discord only accepts choices in response to autocomplete.
+
+    The handler is still called so the error is logged and counted.
+    """
+
+    async def invoke(app: "CommandHandler", interaction: Interaction):
+        try:
+            return await callback(app, interaction)
+        except Exception as e:
+            handler = app._global_error_handlers.get(type(e))  # noqa
+            if handler is None:
+                raise
+            handler(e)
+            return _no_choices()
+
+    return invoke
+
+
+def _autocomplete_key(interaction: Interaction) -> Tuple[int, str, Optional[str]]:
+    """The user, command and option an autocomplete interaction is for."""
+    if interaction.member is not None:
+        user_id = interaction.member.user.id
+    else:
+        user_id = interaction.user.id
+    return user_id, interaction.data.name, _focused_option(interaction.data.options)
+
+
+def _focused_option(options: Optional[List[OptionData]]) -> Optional[str]:
+    for option in options or ():
+        if option.focused:
+            return option.name
+
+        # Options of sub commands are nested within them.
+        nested = option.options
+        if nested is not None:
+            name = _focused_option(nested if isinstance(nested, list) else [nested])
+            if name is not None:
+                return name
+    return None
@@ -1,20 +1,25 @@
 from enum import Enum
+from typing import Awaitable, Callable, List, Optional, Sequence
 
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 from roid import (
     CommandsBlueprint,
     Response,
     ResponseFlags,
     Interaction,
     ButtonStyle,
-    InvokeContext, Option,
+    InvokeContext,
+    Option,
 )
 from roid.objects import Channel, ChannelType, MemberPermissions as MemberPerms
 from roid.helpers import check, require_user_permissions
 from roid.exceptions import AbortInvoke, Forbidden, NotFound, DiscordServerError
 
-from crunchy.app import CommandHandler
+from crunchy.app import CommandHandler, bearer_token_matches, unauthorized
 from crunchy.tools import assetloader
-from crunchy.config import DISCORD_API, SUPPORT_SERVER_URL
+from crunchy.config import DISCORD_API, EVENTS_TOKEN, SUPPORT_SERVER_URL
+from crunchy.tools.fanout import FanOutProgress
 
 REQUIRED_PERMISSIONS = MemberPerms.MANAGE_GUILD | MemberPerms.MANAGE_WEBHOOKS
 NOT_ENOUGH_DATA = AbortInvoke(
@@ -30,6 +35,13 @@ class EventType(Enum):
     Releases = "releases"
 
 
+class EventDelivery(BaseModel):
+    """An event pushed to us to deliver to every registered webhook."""
+
+    payload: dict
+    webhooks: List[str]
+
+
 events_blueprint = CommandsBlueprint()
 
 
@@ -104,6 +116,85 @@ async def submit_webhook(
     await app.client.request("POST", f"/events/{sub_type.value}/update", json=payload)
 
 
+async def deliver_event(
+    app: CommandHandler,
+    sub_type: EventType,
+    payload: dict,
+    webhook_urls: Sequence[str],
+    on_dead: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> FanOutProgress:
+    """
+    Pushes an event out to every webhook registered for it.
+
+    Webhooks found to be deleted are added to the app's `dead_webhooks`
+    and left out of every later delivery.
+
+    Args:
+        app:
+            The slash commands app with the webhooks attribute linking to the
+            WebhookDispatcher.
+
+        sub_type:
+            Which event type is being delivered (news or releases).
+
+        payload:
+            The webhook execution payload e.g. the content and embeds.
+
+        webhook_urls:
+            The urls of every webhook registered for the event type.
+
+        on_dead:
+            Also called with the url of each webhook which has been deleted.
+
+    Returns:
+        The outcome of the delivery, including the dead webhooks.
+    """
+
+    async def prune(url: str):
+        app.dead_webhooks.add(url)
+        if on_dead is not None:
+            await on_dead(url)
+
+    live = [url for url in webhook_urls if url not in app.dead_webhooks]
+    return await app.webhooks.dispatch(
+        sub_type.value,
+        payload,
+        live,
+        on_dead=prune,
+    )
+
+
+async def receive_event(
+    app: CommandHandler,
+    sub_type: EventType,
+    delivery: EventDelivery,
+    authorization: Optional[str],
+) -> JSONResponse:
+    """
+    Accepts an event from the service holding the registered webhooks and
+    delivers it in the background.
+
+    The response lists the given webhooks we already know to be deleted,
+    which are skipped, so the service can unregister them.
+    """
+    if not bearer_token_matches(authorization, EVENTS_TOKEN):
+        return unauthorized()
+
+    dead = [url for url in delivery.webhooks if url in app.dead_webhooks]
+    app.run_in_background(
+        deliver_event(app, sub_type, delivery.payload, delivery.webhooks)
+    )
+
+    return JSONResponse(
+        {
+            "event": sub_type.value,
+            "webhooks": len(delivery.webhooks) - len(dead),
+            "dead": dead,
+        },
+        status_code=202,
+    )
+
+
 @require_user_permissions(REQUIRED_PERMISSIONS)
 @events_blueprint.command(
     "add-news-channel",
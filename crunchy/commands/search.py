@@ -1,3 +1,4 @@
+import asyncio
 import random
 import textwrap
 from datetime import timedelta
@@ -12,15 +13,25 @@ from roid import (
 )
 from roid.components import SelectOption
 from roid.exceptions import AbortInvoke
-from roid.objects import CompletedOption, PartialMessage, ResponseFlags, ResponseType
+from roid.objects import (
+    CompletedOption,
+    EmbedFooter,
+    EmbedImage,
+    PartialMessage,
+    ResponseFlags,
+    ResponseType,
+)
 from roid.interactions import OptionData, Interaction, CommandType
 
 from crunchy.app import CommandHandler
 from crunchy.config import EMBED_COLOUR, RANDOM_THUMBNAILS
-from crunchy.tools.api import CrunchyApiHTTPException
+from crunchy.tools.index import display_title, normalise
 
 search_blueprint = CommandsBlueprint()
 
+FOOTER_TEXT = "Part of Crunchy, the Crunchyroll Discord bot. Powered by CF8"
+THUMBNAILS = [EmbedImage(url=url) for url in RANDOM_THUMBNAILS]
+
 
 EntityAndEmbed = Tuple[str, Embed]
 
@@ -37,34 +48,21 @@ async def search_anime(
         autocomplete=True,
     ),
 ):
-    try:
-        data = await app.client.request(
-            "GET",
-            f"/data/anime/{query}",
-        )
-    except CrunchyApiHTTPException as e:
-        if e.status_code == 404:
-            return Response(content="Oops! I couldn't find anything for that query!")
-        raise e
+    data = await app.entities.get("anime", query)
+    if data is None:
+        return Response(content="Oops! I couldn't find anything for that query!")
 
-    _, embed = make_manga_embed(interaction, data['data'])
+    _, embed = make_anime_embed(app, interaction, data)
     return Response(embed=embed)
 
 
 @search_anime.autocomplete
 async def run_anime_query(app: CommandHandler, query: OptionData = None):
-    """Searches our api to fill the autocomplete select boxes."""
-    results = await app.client.request(
-        "GET",
-        "data/anime/search",
-        params={"query": query.value, "limit": 5},
-    )
-
-    hits = results["data"]["hits"]
-    return [
-        CompletedOption(name=hit.get("title_english") or hit["title"], value=hit["id"])
-        for hit in hits
-    ]
+    """
+    Fills the autocomplete select boxes from the local title index,
+    falling back to searching our api if the index has nothing.
+    """
+    return await complete_entities(app, "anime", query.value)
 
 
 @search_blueprint.command(
@@ -79,34 +77,21 @@ async def search_manga(
         autocomplete=True,
     ),
 ):
-    try:
-        data = await app.client.request(
-            "GET",
-            f"/data/manga/{query}",
-        )
-    except CrunchyApiHTTPException as e:
-        if e.status_code == 404:
-            return Response(content="Oops! I couldn't find anything for that query!")
-        raise e
+    data = await app.entities.get("manga", query)
+    if data is None:
+        return Response(content="Oops! I couldn't find anything for that query!")
 
-    _, embed = make_manga_embed(interaction, data['data'])
+    _, embed = make_manga_embed(app, interaction, data)
     return Response(embed=embed)
 
 
 @search_manga.autocomplete
 async def run_manga_query(app: CommandHandler, query: OptionData = None):
-    """Searches our api to fill the autocomplete select boxes."""
-    results = await app.client.request(
-        "GET",
-        "data/manga/search",
-        params={"query": query.value, "limit": 5},
-    )
-
-    hits = results["data"]["hits"]
-    return [
-        CompletedOption(name=hit.get("title_english") or hit["title"], value=hit["id"])
-        for hit in hits
-    ]
+    """
+    Fills the autocomplete select boxes from the local title index,
+    falling back to searching our api if the index has nothing.
+    """
+    return await complete_entities(app, "manga", query.value)
 
 
 @search_blueprint.command(
@@ -118,82 +103,111 @@ async def search_anime_from_message(
     interaction: Interaction,
     message: PartialMessage,
 ):
-    embeds = await get_best_anime_results(
-        app=app, interaction=interaction, query=message.content
-    )
-
-    select_options = [
-        SelectOption(label=title, value=str(i), default=i == 0)
-        for i, (title, _) in enumerate(embeds)
-    ]
-
-    return Response(
-        embed=embeds[0][1],
-        components=[
-            select_other_results.with_options(select_options),
-        ],
-        component_context={
-            "embeds": embeds,
-            "select_options": select_options,
-            "ttl": timedelta(minutes=2),
-        },
-    )
+    hits = await get_best_anime_results(app=app, query=message.content)
+    return make_results_response(app, interaction, "anime", hits)
 
 
 @search_blueprint.command(
     "Search Manga",
     type=CommandType.MESSAGE,
 )
-async def search_anime_from_message(
+async def search_manga_from_message(
     app: CommandHandler,
     interaction: Interaction,
     message: PartialMessage,
 ):
-    embeds = await get_best_manga_results(
-        app=app, interaction=interaction, query=message.content
-    )
+    hits = await get_best_manga_results(app=app, query=message.content)
+    return make_results_response(app, interaction, "manga", hits)
 
-    select_options = [
-        SelectOption(label=title, value=str(i), default=i == 0)
-        for i, (title, _) in enumerate(embeds)
-    ]
+
+def make_results_response(
+    app: CommandHandler,
+    interaction: Interaction,
+    kind: str,
+    hits: List[dict],
+) -> Response:
+    """
+    Makes the response showing the first result with a select of the
+    other results.
+
+    Only the kind and the ordered ids of the results are kept in the
+    component context, the results themselves are kept in the entity cache
+    and the embeds are rendered from there as they're selected.
+    """
+    for hit in hits:
+        app.entities.prime(kind, hit)
+
+    _, embed = make_kind_embed(app, interaction, kind, hits[0])
 
     return Response(
-        embed=embeds[0][1],
+        embed=embed,
         components=[
-            select_other_results.with_options(select_options),
+            select_other_results.with_options(make_select_options(hits)),
         ],
         component_context={
-            "embeds": embeds,
-            "select_options": select_options,
+            "kind": kind,
+            "ids": [str(hit["id"]) for hit in hits],
             "ttl": timedelta(minutes=2),
         },
     )
 
 
+def make_select_options(entities: List[dict]) -> List[SelectOption]:
+    """Makes the options for the other results, the first being selected."""
+    return [
+        SelectOption(
+            label=result_title(entity),
+            value=str(entity["id"]),
+            default=i == 0,
+        )
+        for i, entity in enumerate(entities)
+    ]
+
+
 @search_blueprint.select(placeholder="Other Results")
-async def select_other_results(ctx: InvokeContext, index: str):
+async def select_other_results(
+    ctx: InvokeContext,
+    entity_id: str,
+    app: CommandHandler,
+    interaction: Interaction,
+):
     """
-    Allows the user to select a list of embeds and rendering that result.
+    Allows the user to select a list of results and rendering that result.
 
     Args:
         ctx:
-            The invoke context to pass the embeds and select_options from the parent.
-        index:
-            The index of the embed to render. This comes as a string but is converted
-            to a int.
+            The invoke context to pass the kind and ids of the results from the parent.
+        entity_id:
+            The id of the result to render.
+        app:
+            The slash commands app with the entity and embed caches.
+        interaction:
+            The interaction data invoking the component.
     """
-    index = int(index)
-    embeds: List[EntityAndEmbed] = ctx["embeds"]
-    select_options = ctx["select_options"]
+    kind: str = ctx["kind"]
+    ids: List[str] = ctx["ids"]
+
+    # Modified in place so the new ordering is kept in the context.
+    if entity_id in ids:
+        ids.remove(entity_id)
+    ids.insert(0, entity_id)
+
+    entities = await asyncio.gather(*(app.entities.get(kind, id_) for id_ in ids))
+    entities = [entity for entity in entities if entity is not None]
+
+    if len(entities) == 0 or str(entities[0]["id"]) != entity_id:
+        raise AbortInvoke(
+            content="Oops! That result no longer exists.",
+            flags=ResponseFlags.EPHEMERAL,
+            response_type=ResponseType.CHANNEL_MESSAGE_WITH_SOURCE,
+        )
 
-    option = select_options.pop(index)
-    select_options.insert(0, option)
+    _, embed = make_kind_embed(app, interaction, kind, entities[0])
 
     return Response(
-        embed=embeds[index][1],
+        embed=embed,
         components=[
-            select_other_results.with_options(select_options),
+            select_other_results.with_options(make_select_options(entities)),
         ],
         component_context={
             "ttl": timedelta(minutes=2),
@@ -201,15 +215,80 @@ async def select_other_results(ctx: InvokeContext, index: str):
     )
 
 
-def make_base_embed(
-    interaction: Interaction, data: dict, specific: str
-) -> EntityAndEmbed:
+async def search_entities(
+    app: CommandHandler,
+    kind: str,
+    query: str,
+    limit: int = 5,
+    hedge: bool = False,
+) -> List[dict]:
     """
-    Makes a general result embed with a specific name i.e. Manga or Anime.
+    Searches the api for the given kind of entity (anime or manga).
+
+    Results are cached per normalised query and concurrent searches for the
+    same query share a single request to the api.
+
+    Args:
+        app:
+            The slash commands app with the client and search cache.
+
+        kind:
+            The kind of entity to search for, either `anime` or `manga`.
+
+        query:
+            The raw search query.
+
+        limit:
+            The maximum number of hits to return.
+
+        hedge:
+            Whether to hedge the request if it's slow, for searches which
+            are worthless if they're late.
+
+    Returns:
+        The list of hits from the api.
+    """
+    query = normalise(query)
+
+    async def load() -> List[dict]:
+        results = await app.client.request(
+            "GET",
+            f"data/{kind}/search",
+            params={"query": query, "limit": limit},
+            hedge=hedge,
+        )
+        return results["data"]["hits"]
+
+    return await app.search_cache.get_or_load((kind, query, limit), load)
+
+
+async def complete_entities(
+    app: CommandHandler,
+    kind: str,
+    query: str,
+    limit: int = 5,
+) -> List[CompletedOption]:
+    """
+    Produces the autocomplete options for the given kind of entity.
+
+    If the catalogue is indexed locally this is answered without a round trip
+    to the api, the api is only searched when the index has no matches.
+    """
+    if app.catalogue is not None:
+        hits = app.catalogue.get(kind).search(query, limit=limit)
+        if hits:
+            return [CompletedOption(name=name, value=id_) for id_, name in hits]
+
+    hits = await search_entities(app, kind, query, limit=limit, hedge=True)
+    return [CompletedOption(name=display_title(hit), value=hit["id"]) for hit in hits]
+
+
+def make_embed_template(data: dict, specific: str) -> EntityAndEmbed:
+    """
+    Makes the parts of a result embed which only depend on the entity,
+    everything which depends on the user is filled in by `make_base_embed`.
 
     Args:
-        interaction:
-            The interaction data invoking the command.
         data:
             The data to populate the embed with.
         specific:
@@ -218,11 +297,7 @@ def make_base_embed(
     Returns:
         A discord embed object. With the original entity title.
     """
-    title = data.get("title_english") or data["title"]
-
-    if data["title_japanese"] is not None:
-        title = f"{title} ({data['title_japanese']})"
-
+    title = result_title(data)
     description = data["description"] or "No Description."
     genres = data["genres"]
     rating = int(data["rating"] / 2)
@@ -232,7 +307,6 @@ def make_base_embed(
     genres = ", ".join(genres or ["None"])
 
     embed = Embed(color=EMBED_COLOUR)
-    embed.set_thumbnail(url=random.choice(RANDOM_THUMBNAILS))
     embed.set_author(
         name=f"{textwrap.shorten(title.strip(' '), width=100)}",
         icon_url="https://cdn.discordapp.com/emojis/676087821596885013.png?v=1",
@@ -241,16 +315,6 @@ def make_base_embed(
     if img_url is not None:
         embed.set_image(url=img_url)
 
-    if interaction.member is None:
-        user = interaction.user
-    else:
-        user = interaction.member.user
-
-    embed.set_footer(
-        text="Part of Crunchy, the Crunchyroll Discord bot. Powered by CF8",
-        icon_url=user.avatar_url,
-    )
-
     embed.add_field(
         name=f"About this {specific}",
         value=f"Rating - {stars}\nGenres - *{genres}*\n",
@@ -264,73 +328,123 @@ def make_base_embed(
     return title, embed
 
 
-def make_manga_embed(interaction: Interaction, data: dict) -> EntityAndEmbed:
+def make_base_embed(
+    app: CommandHandler, interaction: Interaction, data: dict, specific: str
+) -> EntityAndEmbed:
+    """
+    Makes a general result embed with a specific name i.e. Manga or Anime.
+
+    The entity dependant parts of the embed are rendered once per entity and
+    cached, only the thumbnail and the user's footer are set per response.
+
+    Args:
+        app:
+            The slash commands app with the embed cache.
+        interaction:
+            The interaction data invoking the command.
+        data:
+            The data to populate the embed with.
+        specific:
+            The specific type of result (Anime or Manga).
+
+    Returns:
+        A discord embed object. With the original entity title.
+    """
+    key = (specific, data["id"])
+    cached = app.embed_cache.get(key)
+
+    # The entity may have changed since the template was rendered.
+    if cached is None or (cached[0] is not data and cached[0] != data):
+        cached = (data, *make_embed_template(data, specific))
+        app.embed_cache.set(key, cached)
+
+    _, title, template = cached
+
+    if interaction.member is None:
+        user = interaction.user
+    else:
+        user = interaction.member.user
+
+    # A shallow copy is enough as the template itself is never modified.
+    embed = template.copy(
+        update={
+            "thumbnail": random.choice(THUMBNAILS),
+            "footer": EmbedFooter(text=FOOTER_TEXT, icon_url=user.avatar_url),
+        }
+    )
+
+    return title, embed
+
+
+def make_manga_embed(
+    app: CommandHandler, interaction: Interaction, data: dict
+) -> EntityAndEmbed:
     """Makes a embed with Manga being the targeted sub type."""
-    return make_base_embed(interaction, data, "Manga")
+    return make_base_embed(app, interaction, data, "Manga")
 
 
-def make_anime_embed(interaction: Interaction, data: dict) -> EntityAndEmbed:
+def make_anime_embed(
+    app: CommandHandler, interaction: Interaction, data: dict
+) -> EntityAndEmbed:
     """Makes a embed with Anime being the targeted sub type."""
-    return make_base_embed(interaction, data, "Anime")
+    return make_base_embed(app, interaction, data, "Anime")
+
+
+def make_kind_embed(
+    app: CommandHandler, interaction: Interaction, kind: str, data: dict
+) -> EntityAndEmbed:
+    """Makes a embed for the given kind of entity (anime or manga)."""
+    if kind == "anime":
+        return make_anime_embed(app, interaction, data)
+    return make_manga_embed(app, interaction, data)
+
+
+def result_title(data: dict) -> str:
+    """The title of a entity as shown in the list of other results."""
+    title = display_title(data)
+
+    if data["title_japanese"] is not None:
+        title = f"{title} ({data['title_japanese']})"
+
+    return title
 
 
 async def get_best_anime_results(
     app: CommandHandler,
-    interaction: Interaction,
     query: str,
-) -> List[EntityAndEmbed]:
+) -> List[dict]:
     """
-    Gets the top 5 results from the Manga api and turns it into an Embed result.
+    Gets the top 5 results from the Anime api.
     """
 
-    results = await app.client.request(
-        "GET",
-        "data/anime/search",
-        params={"query": query, "limit": 5},
-    )
-
-    if len(results["data"]["hits"]) == 0:
-        embed = Embed(color=EMBED_COLOUR)
-        embed.set_author(
-            name="Oops! I cant find anything matching that sentence.",
-            icon_url="https://cdn.discordapp.com/emojis/676087829557936149.png?v=1",
-        )
-        raise AbortInvoke(embed=embed, flags=ResponseFlags.EPHEMERAL)
+    hits = await search_entities(app, "anime", query)
 
-    embeds = []
-    for result in results["data"]["hits"]:
-        embed = make_anime_embed(interaction, result)
-        embeds.append(embed)
+    if len(hits) == 0:
+        raise_no_results()
 
-    return embeds
+    return hits
 
 
 async def get_best_manga_results(
     app: CommandHandler,
-    interaction: Interaction,
     query: str,
-) -> List[EntityAndEmbed]:
+) -> List[dict]:
     """
-    Gets the top 5results from the Manga api and turns it into an Embed result.
+    Gets the top 5 results from the Manga api.
     """
 
-    results = await app.client.request(
-        "GET",
-        "data/manga/search",
-        params={"query": query, "limit": 5},
-    )
+    hits = await search_entities(app, "manga", query)
 
-    if len(results["data"]["hits"]) == 0:
-        embed = Embed(color=EMBED_COLOUR)
-        embed.set_author(
-            name="Oops! I cant find anything matching that sentence.",
-            icon_url="https://cdn.discordapp.com/emojis/676087829557936149.png?v=1",
-        )
-        raise AbortInvoke(embed=embed, flags=ResponseFlags.EPHEMERAL)
+    if len(hits) == 0:
+        raise_no_results()
 
-    embeds = []
-    for result in results["data"]["hits"]:
-        embed = make_manga_embed(interaction, result)
-        embeds.append(embed)
+    return hits
 
-    return embeds
+
+def raise_no_results():
+    embed = Embed(color=EMBED_COLOUR)
+    embed.set_author(
+        name="Oops! I cant find anything matching that sentence.",
+        icon_url="https://cdn.discordapp.com/emojis/676087829557936149.png?v=1",
+    )
+    raise AbortInvoke(embed=embed, flags=ResponseFlags.EPHEMERAL)
@@ -1,12 +1,22 @@
-from roid import CommandsBlueprint, Option, Response
+from datetime import timedelta
+from typing import List, Tuple
+
+from roid import ButtonStyle, CommandsBlueprint, InvokeContext, Option, Response
 from roid.interactions import OptionData, Interaction
 from roid.objects import CompletedOption, ResponseFlags, Embed
 
 from crunchy.app import CommandHandler
-from crunchy.config import EMBED_COLOUR
+from crunchy.config import EMBED_COLOUR, TRACKING_PAGE_SIZE
+from crunchy.tools.index import normalise
 
 tracking_blueprint = CommandsBlueprint()
 
+# The most autocomplete choices Discord will accept.
+MAX_CHOICES = 25
+
+# The entries on the page and whether there's a page after it.
+Page = Tuple[List[dict], bool]
+
 
 @tracking_blueprint.command(
     "my-list",
@@ -38,10 +48,7 @@ async def get_tracking(
     else:
         user_id = interaction.user.id
 
-    response = await app.client.request("GET", f"/tracking/{user_id}/{group}")
-    data = response["data"]
-
-    # todo :(
+    return await make_page_response(app, user_id, group, offset=0)
 
 
 @get_tracking.autocomplete
@@ -50,25 +57,41 @@ async def get_tracking_groups(
     interaction: Interaction,
     group: OptionData = None,
 ):
-    """Gets all the user's existing groups / tags."""
+    """
+    Gets all the user's existing groups / tags, filtered to the ones starting
+    with what they've typed so far.
+
+    The user's tags are cached so repeated keystrokes are filtered locally,
+    the cache is invalidated whenever we make a tracking write for the user.
+    """
 
     if interaction.member is not None:
         user_id = interaction.member.user.id
     else:
         user_id = interaction.user.id
 
-    response = await app.client.request(
-        "GET",
-        f"/tracking/{user_id}/tags",
-    )
+    async def load() -> List[Tuple[str, CompletedOption]]:
+        response = await app.client.request(
+            "GET",
+            f"tracking/{user_id}/tags",
+            hedge=True,
+        )
+
+        return [
+            (
+                normalise(item["tag_name"]),
+                CompletedOption(name=item["tag_name"], value=item["tag_id"]),
+            )
+            for item in response["data"]
+        ]
 
-    def alter(item):
-        return item["tag_name"], item["tag_id"]
+    tags = await app.tracking_tags.get_or_load(str(user_id), load)
 
-    results = map(alter, response["data"])
-    items = [CompletedOption(name=name, value=id_) for (name, id_) in results]
+    prefix = normalise(str(group.value or "")) if group is not None else ""
+    items = [option for name, option in tags if name.startswith(prefix)]
+    items = items[:MAX_CHOICES]
 
-    if len(items) == 0:
+    if len(tags) == 0:
         items.append(
             CompletedOption(
                 name=f"Oops! You dont have any tracking groups.",
@@ -88,3 +111,90 @@ async def get_tracking_groups(
             )
         )
     return items
+
+
+@tracking_blueprint.button("Previous", style=ButtonStyle.SECONDARY)
+async def previous_page(app: CommandHandler, ctx: InvokeContext):
+    """Shows the page before the current one."""
+    return await move_page(app, ctx, -TRACKING_PAGE_SIZE)
+
+
+@tracking_blueprint.button("Next", style=ButtonStyle.SECONDARY)
+async def next_page(app: CommandHandler, ctx: InvokeContext):
+    """Shows the page after the current one."""
+    return await move_page(app, ctx, TRACKING_PAGE_SIZE)
+
+
+async def move_page(app: CommandHandler, ctx: InvokeContext, delta: int) -> Response:
+    # Modified in place so the new cursor is kept in the context.
+    ctx["offset"] = max(ctx["offset"] + delta, 0)
+    return await make_page_response(app, ctx["user_id"], ctx["group"], ctx["offset"])
+
+
+async def make_page_response(
+    app: CommandHandler,
+    user_id: int,
+    group: str,
+    offset: int,
+) -> Response:
+    """
+    Renders the page of the tracking list starting at `offset`, with
+    buttons to move between pages.
+
+    Only the cursor is kept in the component context, the list itself is
+    cached so moving between pages doesn't fetch it again.
+    """
+    entries, has_next = await get_page(app, user_id, group, offset)
+
+    if len(entries) == 0 and offset == 0:
+        return Response(
+            content="This list is empty! Add some items to it to see them here.",
+            flags=ResponseFlags.EPHEMERAL,
+        )
+
+    lines = [
+        f"`{offset + i + 1}.` {entry_title(entry)}" for i, entry in enumerate(entries)
+    ]
+    page = offset // TRACKING_PAGE_SIZE + 1
+
+    embed = Embed(color=EMBED_COLOUR, description="\n".join(lines) or "Nothing here.")
+    embed.set_footer(text=f"Page {page}")
+
+    return Response(
+        embed=embed,
+        flags=ResponseFlags.EPHEMERAL,
+        components=[
+            [
+                previous_page.disabled() if offset == 0 else previous_page,
+                next_page if has_next else next_page.disabled(),
+            ]
+        ],
+        component_context={
+            "user_id": user_id,
+            "group": group,
+            "offset": offset,
+            "ttl": timedelta(minutes=10),
+        },
+    )
+
+
+async def get_page(app: CommandHandler, user_id: int, group: str, offset: int) -> Page:
+    """
+    Gets a page of the tracking list.
+
+    The api only returns the whole list, so it's fetched once and cached and
+    every page is sliced out of it.
+    """
+
+    async def load() -> List[dict]:
+        response = await app.client.request("GET", f"tracking/{user_id}/{group}")
+        return response["data"]
+
+    entries = await app.tracking_pages.get_or_load((user_id, group), load)
+    end = offset + TRACKING_PAGE_SIZE
+    return entries[offset:end], len(entries) > end
+
+
+def entry_title(entry: dict) -> str:
+    """The title to show for a tracked entry."""
+    return entry.get("title_english") or entry.get("title") or str(entry.get("id"))
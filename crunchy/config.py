@@ -1,20 +1,138 @@
 import os
 
-from roid.state import RedisBackend
+from roid.state import RedisBackend, SqliteBackend
 
 APPLICATION_ID = int(os.getenv("APPLICATION_ID"))
 APPLICATION_PUBLIC_KEY = os.getenv("PUBLIC_KEY")
 TOKEN = os.getenv("BOT_TOKEN")
-STATE_BACKEND = RedisBackend(
-    host=os.getenv("REDIS_HOST", "127.0.0.1"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    db=int(os.getenv("REDIS_DB", 0)),
-)
+REDIS_HOST = os.getenv("REDIS_HOST", "127.0.0.1")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+
+# Component state is shared between workers through Redis, sqlite only works
+# with a single worker but doesn't need a server e.g. when benchmarking.
+if os.getenv("STATE_STORAGE", "redis") == "sqlite":
+    STATE_BACKEND = SqliteBackend(os.getenv("STATE_DB", "managed-state"))
+else:
+    STATE_BACKEND = RedisBackend(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
 
 CRUNCHY_API_KEY = os.getenv("CRUNCHY_API_KEY")
 
-CRUNCHY_API = "https://api.crunchy.gg/v0"
-DISCORD_API = "https://discord.com/api/v8"
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", 8000))
+WORKERS = int(os.getenv("WORKERS", 1))
+
+# Logs are written as JSON by a background thread, repeats of the same line are
+# limited to a burst per interval and only a sample of debug logs are kept.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_BURST = int(os.getenv("LOG_BURST", 10))
+LOG_INTERVAL = float(os.getenv("LOG_INTERVAL", 60))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0.1))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+
+# Overridable to point the bot at a local simulator, see `bench/simulator.py`.
+CRUNCHY_API = os.getenv("CRUNCHY_API_URL", "https://api.crunchy.gg/v0").rstrip("/")
+DISCORD_API = os.getenv("DISCORD_API_URL", "https://discord.com/api/v8").rstrip("/")
+
+# Command registration is skipped for commands which haven't changed since the
+# last sync, the manifest of which is kept in Redis unless a path is given.
+COMMAND_MANIFEST_PATH = os.getenv("COMMAND_MANIFEST_PATH")
+COMMAND_SYNC_LOCK_TTL = float(os.getenv("COMMAND_SYNC_LOCK_TTL", 60))
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "false").lower() == "true"
+
+# Discord discards responses after these many seconds, before and after deferring.
+INTERACTION_TIMEOUT = 3.0
+FOLLOWUP_TIMEOUT = 15 * 60.0
+
+# Responses taking any longer than this are deferred and sent as a follow up.
+INTERACTION_DEFER_AFTER = float(os.getenv("INTERACTION_DEFER_AFTER", 2))
+
+CRUNCHY_API_MAX_CONCURRENCY = int(os.getenv("CRUNCHY_API_MAX_CONCURRENCY", 32))
+CRUNCHY_API_ROUTE_CONCURRENCY = int(os.getenv("CRUNCHY_API_ROUTE_CONCURRENCY", 8))
+
+# New interactions get a busy response once this many requests are queued (0 = off).
+CRUNCHY_API_MAX_QUEUED = int(os.getenv("CRUNCHY_API_MAX_QUEUED", 256))
+
+# A HTTP/2 connection per client is opened on startup and kept alive with a
+# request every interval.
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP_KEEPALIVE_INTERVAL = float(os.getenv("HTTP_KEEPALIVE_INTERVAL", 20))
+
+# Any call made for an interaction is also cut short by its deadline.
+CRUNCHY_API_MAX_CONNECTIONS = int(os.getenv("CRUNCHY_API_MAX_CONNECTIONS", 64))
+CRUNCHY_API_MAX_KEEPALIVE = int(os.getenv("CRUNCHY_API_MAX_KEEPALIVE", 16))
+CRUNCHY_API_CONNECT_TIMEOUT = float(os.getenv("CRUNCHY_API_CONNECT_TIMEOUT", 1))
+CRUNCHY_API_TIMEOUT = float(os.getenv("CRUNCHY_API_TIMEOUT", 2.5))
+DISCORD_MAX_CONNECTIONS = int(os.getenv("DISCORD_MAX_CONNECTIONS", 64))
+DISCORD_MAX_KEEPALIVE = int(os.getenv("DISCORD_MAX_KEEPALIVE", 16))
+DISCORD_CONNECT_TIMEOUT = float(os.getenv("DISCORD_CONNECT_TIMEOUT", 1))
+DISCORD_TIMEOUT = float(os.getenv("DISCORD_TIMEOUT", 5))
+
+# Slow autocomplete requests are raced against a second request once they take
+# longer than this percentile of recent requests, for at most this rate of requests.
+CRUNCHY_API_HEDGE_PERCENTILE = float(os.getenv("CRUNCHY_API_HEDGE_PERCENTILE", 0.95))
+CRUNCHY_API_HEDGE_MIN_DELAY = float(os.getenv("CRUNCHY_API_HEDGE_MIN_DELAY", 0.05))
+CRUNCHY_API_HEDGE_MAX_RATE = float(os.getenv("CRUNCHY_API_HEDGE_MAX_RATE", 0.05))
+
+# Shares rate limits between every process / replica via Redis when enabled.
+SHARED_RATE_LIMITS = os.getenv("SHARED_RATE_LIMITS", "false").lower() == "true"
+SHARED_RATE_LIMIT_LEASE = int(os.getenv("SHARED_RATE_LIMIT_LEASE", 5))
+DISCORD_GLOBAL_RATE_LIMIT = float(os.getenv("DISCORD_GLOBAL_RATE_LIMIT", 50))
+CRUNCHY_API_RATE_LIMIT = float(os.getenv("CRUNCHY_API_RATE_LIMIT", 50))
+
+# Stops calling a upstream once this proportion of calls fail or are slow.
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 20))
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", 10))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", 2))
+BREAKER_OPEN_FOR = float(os.getenv("BREAKER_OPEN_FOR", 5))
+BREAKER_MAX_OPEN_FOR = float(os.getenv("BREAKER_MAX_OPEN_FOR", 60))
+
+# Transport errors are retried after a jittered backoff between these bounds.
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", 0.25))
+RETRY_BACKOFF_CAP = float(os.getenv("RETRY_BACKOFF_CAP", 5))
+
+# Events are pushed to this many webhooks at once, each retried up to max attempts.
+WEBHOOK_FANOUT_CONCURRENCY = int(os.getenv("WEBHOOK_FANOUT_CONCURRENCY", 256))
+WEBHOOK_FANOUT_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_FANOUT_MAX_ATTEMPTS", 5))
+WEBHOOK_FANOUT_PROGRESS_INTERVAL = float(
+    os.getenv("WEBHOOK_FANOUT_PROGRESS_INTERVAL", 5)
+)
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 4096))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 300))
+
+# Anime / manga details by id, optionally shared between replicas via Redis.
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", 8192))
+ENTITY_CACHE_TTLS = {
+    "anime": float(os.getenv("ANIME_CACHE_TTL", 3600)),
+    "manga": float(os.getenv("MANGA_CACHE_TTL", 3600)),
+}
+ENTITY_CACHE_STALE_TTL = float(os.getenv("ENTITY_CACHE_STALE_TTL", 3600))
+ENTITY_CACHE_NEGATIVE_TTL = float(os.getenv("ENTITY_CACHE_NEGATIVE_TTL", 60))
+ENTITY_CACHE_REDIS = os.getenv("ENTITY_CACHE_REDIS", "false").lower() == "true"
+
+TRACKING_TAG_CACHE_SIZE = int(os.getenv("TRACKING_TAG_CACHE_SIZE", 4096))
+TRACKING_TAG_CACHE_TTL = float(os.getenv("TRACKING_TAG_CACHE_TTL", 120))
+
+TRACKING_PAGE_SIZE = int(os.getenv("TRACKING_PAGE_SIZE", 10))
+TRACKING_PAGE_CACHE_SIZE = int(os.getenv("TRACKING_PAGE_CACHE_SIZE", 1024))
+TRACKING_PAGE_CACHE_TTL = float(os.getenv("TRACKING_PAGE_CACHE_TTL", 60))
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 4096))
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", 3600))
+
+# Prometheus must scrape `/metrics` with this as a bearer token, the route
+# isn't served at all unless it's set.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# The service holding the registered webhooks pushes events to `/events/{type}`
+# with this as a bearer token, the route isn't served at all unless it's set.
+EVENTS_TOKEN = os.getenv("EVENTS_TOKEN")
+
+# Optional, if set autocomplete is answered from a local index of the catalogue.
+CATALOGUE_SNAPSHOT_DIR = os.getenv("CATALOGUE_SNAPSHOT_DIR")
+CATALOGUE_REFRESH_INTERVAL = float(os.getenv("CATALOGUE_REFRESH_INTERVAL", 300))
 
 SUPPORT_SERVER_URL = "https://discord.gg/MtETshQ"
 REQUIRED_PERMISSIONS = [
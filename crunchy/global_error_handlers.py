@@ -1,65 +1,107 @@
-from traceback import print_exc
+import logging
 
 from roid.response import ResponsePayload, ResponseFlags, ResponseType, ResponseData
 
 from crunchy.config import SUPPORT_SERVER_URL, REQUIRED_PERMISSIONS
+from crunchy.tools.breaker import CircuitOpen
+from crunchy.tools.http import DISCORD, DISCORD_WEBHOOKS
+from crunchy.tools.metrics import HANDLED_ERRORS
+
+_log = logging.getLogger("crunchy-errors")
 
 
 SAD = "<:HimeSad:676087829557936149>"
 
+CRUNCHY_API_ISSUES = (
+    f"{SAD} Our API seems to be having issues right now, please try again later."
+)
+BUSY = f"{SAD} We're a little overwhelmed right now, please try again in a moment."
+SOMETHING_WENT_WRONG = (
+    f"{SAD} Something's gone wrong while trying to process your command. "
+    f"Please try again later or notify the dev team @ {SUPPORT_SERVER_URL}"
+)
+DISCORD_ISSUES = (
+    f"{SAD} Discord seems to be having some issues right now, preventing us "
+    "from operating normally, please try again later."
+)
+
 
 def _plain_response(data: ResponseData) -> ResponsePayload:
     return ResponsePayload(type=ResponseType.CHANNEL_MESSAGE_WITH_SOURCE, data=data)
 
 
-def on_crunchy_api_error(_) -> ResponsePayload:
-    print_exc()
+def on_crunchy_api_error(e) -> ResponsePayload:
+    HANDLED_ERRORS.labels("on_crunchy_api_error").inc()
+    _log.error("failed to handle interaction due to a Crunchy API error", exc_info=e)
 
     return _plain_response(
-        ResponseData(
-            content=(
-                f"{SAD} Our API seems to be having issues "
-                "right now, please try again later."
-            ),
-            flags=ResponseFlags.EPHEMERAL,
-        )
+        ResponseData(content=CRUNCHY_API_ISSUES, flags=ResponseFlags.EPHEMERAL)
     )
 
 
 def on_discord_server_error(_) -> ResponsePayload:
+    HANDLED_ERRORS.labels("on_discord_server_error").inc()
     return _plain_response(
-        ResponseData(
-            content=(
-                f"{SAD} Discord seems to be having some issues"
-                " right now, preventing us from operating normally, please try again later."
-            ),
-            flags=ResponseFlags.EPHEMERAL,
-        )
+        ResponseData(content=DISCORD_ISSUES, flags=ResponseFlags.EPHEMERAL)
+    )
+
+
+def on_http_error(e) -> ResponsePayload:
+    HANDLED_ERRORS.labels("on_http_error").inc()
+    _log.error("failed to handle interaction due to a Discord error", exc_info=e)
+
+    return _plain_response(
+        ResponseData(content=SOMETHING_WENT_WRONG, flags=ResponseFlags.EPHEMERAL)
     )
 
 
-def on_http_error(_) -> ResponsePayload:
-    print_exc()
+def on_unhandled_error(e: Exception) -> ResponsePayload:
+    """Any error without a handler of it's own after the response was deferred."""
+    HANDLED_ERRORS.labels("on_unhandled_error").inc()
+    _log.error("failed to handle deferred interaction", exc_info=e)
+
+    return _plain_response(
+        ResponseData(content=SOMETHING_WENT_WRONG, flags=ResponseFlags.EPHEMERAL)
+    )
+
 
+def on_missing_permissions_error(_) -> ResponsePayload:
+    HANDLED_ERRORS.labels("on_missing_permissions_error").inc()
     return _plain_response(
         ResponseData(
             content=(
-                f"{SAD} Something's gone wrong while trying "
-                f"to process your command. Please try again later or notify the "
-                f"dev team @ {SUPPORT_SERVER_URL}"
+                f"{SAD} Oops! Looks like im missing permissions to carry"
+                f" out this command. Make sure I have all the permissions {','.join(REQUIRED_PERMISSIONS)}"
             ),
             flags=ResponseFlags.EPHEMERAL,
         )
     )
 
 
-def on_missing_permissions_error(_) -> ResponsePayload:
+def on_deadline_exceeded(_) -> ResponsePayload:
+    HANDLED_ERRORS.labels("on_deadline_exceeded").inc()
     return _plain_response(
         ResponseData(
             content=(
-                f"{SAD} Oops! Looks like im missing permissions to carry"
-                f" out this command. Make sure I have all the permissions {','.join(REQUIRED_PERMISSIONS)}"
+                f"{SAD} Oops! This is taking a lot longer than it should, "
+                "please try again in a little while."
             ),
             flags=ResponseFlags.EPHEMERAL,
         )
     )
+
+
+def on_circuit_open(e: CircuitOpen) -> ResponsePayload:
+    # Expected while the upstream recovers so there's no traceback to log.
+    HANDLED_ERRORS.labels("on_circuit_open").inc()
+
+    if e.upstream in (DISCORD, DISCORD_WEBHOOKS):
+        content = DISCORD_ISSUES
+    else:
+        content = CRUNCHY_API_ISSUES
+    return _plain_response(ResponseData(content=content, flags=ResponseFlags.EPHEMERAL))
+
+
+def busy_response() -> ResponsePayload:
+    """The response to interactions turned away as we're overloaded."""
+    return _plain_response(ResponseData(content=BUSY, flags=ResponseFlags.EPHEMERAL))
@@ -1,20 +1,35 @@
+import asyncio
+from typing import Optional
+
 import uvicorn
-import logging
+from fastapi import Header
 
 from roid.exceptions import DiscordServerError, Forbidden, HTTPException
 
 from crunchy.commands import events_blueprint, search_blueprint, tracking_blueprint
+from crunchy.commands.events import EventDelivery, EventType, receive_event
 from crunchy.app import CommandHandler
 from crunchy import config
 from crunchy.tools.api import CrunchyApiHTTPException
+from crunchy.tools.breaker import CircuitOpen
+from crunchy.tools.deadline import DeadlineExceeded
+from crunchy.tools.logs import setup_logging
 from crunchy.global_error_handlers import (
+    on_circuit_open,
     on_crunchy_api_error,
+    on_deadline_exceeded,
     on_discord_server_error,
     on_http_error,
     on_missing_permissions_error,
 )
 
-logging.basicConfig(level=logging.INFO)
+setup_logging(
+    config.LOG_LEVEL,
+    burst=config.LOG_BURST,
+    interval=config.LOG_INTERVAL,
+    debug_sample_rate=config.LOG_DEBUG_SAMPLE_RATE,
+    queue_size=config.LOG_QUEUE_SIZE,
+)
 
 app = CommandHandler(
     application_id=config.APPLICATION_ID,
@@ -28,15 +43,38 @@ app.register_error(CrunchyApiHTTPException, on_crunchy_api_error)
 app.register_error(DiscordServerError, on_discord_server_error)
 app.register_error(Forbidden, on_missing_permissions_error)
 app.register_error(HTTPException, on_http_error)
+app.register_error(DeadlineExceeded, on_deadline_exceeded)
+app.register_error(CircuitOpen, on_circuit_open)
 
 app.add_blueprint(events_blueprint)
 app.add_blueprint(search_blueprint)
 app.add_blueprint(tracking_blueprint)
 
+if config.EVENTS_TOKEN:
+
+    @app.post("/events/{sub_type}", include_in_schema=False)
+    async def on_event(
+        sub_type: EventType,
+        delivery: EventDelivery,
+        authorization: Optional[str] = Header(None),
+    ):
+        return await receive_event(app, sub_type, delivery, authorization)
+
 
 def main():
-    app.register_commands_on_start()
-    uvicorn.run("crunchy:app")
+    # Registered once up front so every worker doesn't repeat it on startup.
+    asyncio.run(app.sync_commands())
+
+    # With more than one worker uvicorn binds the socket once and shares it
+    # between the worker processes, each of which has their own http clients.
+    uvicorn.run(
+        "crunchy:app",
+        host=config.HOST,
+        port=config.PORT,
+        workers=config.WORKERS,
+        # uvicorn's loggers propagate to ours rather than writing to stderr.
+        log_config=None,
+    )
 
 
 if __name__ == "__main__":
@@ -1,30 +1,252 @@
 import asyncio
-import json
 import logging
+import time
 import httpx
 
+from typing import Callable, List, Optional, Tuple
+
 from roid.exceptions import HTTPException
 
-from crunchy.config import CRUNCHY_API
+from crunchy.config import (
+    BREAKER_FAILURE_RATE,
+    BREAKER_MAX_OPEN_FOR,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_FOR,
+    BREAKER_SLOW_CALL,
+    BREAKER_WINDOW,
+    CRUNCHY_API,
+    CRUNCHY_API_CONNECT_TIMEOUT,
+    CRUNCHY_API_HEDGE_MAX_RATE,
+    CRUNCHY_API_HEDGE_MIN_DELAY,
+    CRUNCHY_API_HEDGE_PERCENTILE,
+    CRUNCHY_API_MAX_CONCURRENCY,
+    CRUNCHY_API_MAX_QUEUED,
+    CRUNCHY_API_MAX_CONNECTIONS,
+    CRUNCHY_API_MAX_KEEPALIVE,
+    CRUNCHY_API_RATE_LIMIT,
+    CRUNCHY_API_ROUTE_CONCURRENCY,
+    CRUNCHY_API_TIMEOUT,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_KEEPALIVE_INTERVAL,
+    RETRY_BACKOFF_BASE,
+    RETRY_BACKOFF_CAP,
+)
+from crunchy.tools import deadline, metrics
+from crunchy.tools.breaker import CLOSED, Backoff, CircuitBreaker
+from crunchy.tools.codec import DEFAULT_CODEC, JsonCodec
+from crunchy.tools.distributed import SharedRateLimiter
+from crunchy.tools.hedge import HedgingPolicy
+from crunchy.tools.pool import KeepWarm, call_timeout, make_client
+from crunchy.tools.scheduler import ALL_FAMILIES, RequestScheduler, route_family
+from crunchy.tools.singleflight import SingleFlight
 
 _log = logging.getLogger("crunchy-api")
 
+# The shared bucket every call to the api takes a token from.
+GLOBAL_BUCKET = "crunchy-api:global"
+
 
 class CrunchyApiHTTPException(HTTPException):
     """Something has gone wrong with the api."""
 
 
+def make_api_client(transport: Optional[httpx.AsyncBaseTransport]) -> httpx.AsyncClient:
+    return make_client(
+        max_connections=CRUNCHY_API_MAX_CONNECTIONS,
+        max_keepalive=CRUNCHY_API_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout=CRUNCHY_API_CONNECT_TIMEOUT,
+        timeout=CRUNCHY_API_TIMEOUT,
+        transport=transport,
+    )
+
+
+def _on_abandoned(key: Tuple[str, str]):
+    # Every caller went away e.g. the autocomplete was superseded.
+    metrics.UPSTREAM_ABANDONED.labels("crunchy", key[0]).inc()
+
+
 class CrunchyApi:
-    def __init__(self, api_token: str):
-        self.lock = asyncio.Lock()
-        self.client = httpx.AsyncClient(http2=True)
+    def __init__(
+        self,
+        api_token: str,
+        max_concurrency: int = CRUNCHY_API_MAX_CONCURRENCY,
+        route_concurrency: int = CRUNCHY_API_ROUTE_CONCURRENCY,
+        max_queued: int = CRUNCHY_API_MAX_QUEUED,
+        codec: JsonCodec = DEFAULT_CODEC,
+        limiter: Optional[SharedRateLimiter] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.scheduler = RequestScheduler(
+            max_concurrency, route_concurrency, max_queued
+        )
+        self.client = make_api_client(transport)
+        self.codec = codec
+        self.flights = SingleFlight(on_abandoned=_on_abandoned)
+        self.breaker = CircuitBreaker(
+            "crunchy",
+            failure_rate=BREAKER_FAILURE_RATE,
+            min_calls=BREAKER_MIN_CALLS,
+            window=BREAKER_WINDOW,
+            slow_call=BREAKER_SLOW_CALL,
+            open_for=BREAKER_OPEN_FOR,
+            max_open_for=BREAKER_MAX_OPEN_FOR,
+        )
+
+        self.hedging: Optional[HedgingPolicy] = None
+        self.hedge_client: Optional[httpx.AsyncClient] = None
+        if CRUNCHY_API_HEDGE_MAX_RATE > 0:
+            self.hedging = HedgingPolicy(
+                percentile=CRUNCHY_API_HEDGE_PERCENTILE,
+                min_delay=CRUNCHY_API_HEDGE_MIN_DELAY,
+                max_rate=CRUNCHY_API_HEDGE_MAX_RATE,
+            )
+
+            # Hedges have their own connections so a slow one can't hold up both.
+            self.hedge_client = make_api_client(transport)
+
+        self.keep_warm = KeepWarm(
+            [client for client in (self.client, self.hedge_client) if client],
+            "HEAD",
+            f"{CRUNCHY_API}/",
+            interval=HTTP_KEEPALIVE_INTERVAL,
+        )
+
+        # Called with the section of every write made, e.g. to invalidate caches.
+        self.write_listeners: List[Callable[[str], None]] = []
+
+        # Every call takes a token from its family's bucket and the global one,
+        # a family can use the whole rate but together they can't go over it.
+        self.limiter = limiter
+        if limiter is not None:
+            limiter.configure(
+                GLOBAL_BUCKET,
+                rate=CRUNCHY_API_RATE_LIMIT,
+                capacity=int(CRUNCHY_API_RATE_LIMIT),
+            )
+            for family in ALL_FAMILIES:
+                limiter.configure(
+                    f"crunchy-api:{family}",
+                    rate=CRUNCHY_API_RATE_LIMIT,
+                    capacity=int(CRUNCHY_API_RATE_LIMIT),
+                )
 
         self.__token = api_token or ""
 
+    async def warm(self):
+        """Opens connections to the api ahead of time and keeps them alive."""
+        await self.keep_warm.warm()
+        self.keep_warm.start()
+
     async def shutdown(self):
+        await self.keep_warm.shutdown()
         await self.client.aclose()
+        if self.hedge_client is not None:
+            await self.hedge_client.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "coalesced": self.flights.stats(),
+            "breaker": self.breaker.stats(),
+            "hedging": self.hedging.stats() if self.hedging is not None else None,
+        }
+
+    async def request(
+        self,
+        method: str,
+        section: str,
+        headers: dict = None,
+        hedge: bool = False,
+        **extra,
+    ):
+        """
+        Makes a request to the api returning the decoded response.
+
+        Concurrent GET requests for the same url and parameters are merged
+        into a single upstream request, so the returned data may be shared
+        between callers and must not be modified.
+
+        If `hedge` is set, a GET which is taking longer than usual is raced
+        against a second request and the first to answer is used. This is
+        for requests where a late answer is worthless e.g. autocomplete.
+
+        Any other request is treated as a write and passed on to the
+        `write_listeners` once it's done.
+        """
+        if method.upper() != "GET":
+            try:
+                return await self._request(method, section, headers, **extra)
+            finally:
+                # Even failed writes may have been applied.
+                for listener in self.write_listeners:
+                    listener(section)
+
+        if headers is not None or extra.keys() - {"params"}:
+            return await self._request(method, section, headers, **extra)
+
+        def load():
+            if hedge and self.hedging is not None:
+                return self._hedged_request(method, section, **extra)
+            return self._request(method, section, **extra)
+
+        url = httpx.URL(f"{CRUNCHY_API}/{section}", params=extra.get("params"))
+        return await self.flights.do((route_family(section), str(url)), load)
+
+    async def _hedged_request(self, method: str, section: str, **extra):
+        """
+        Makes the request, sending a second one on another connection if it
+        takes longer than the hedging policy allows and returning whichever
+        answers first.
+        """
+        family = route_family(section)
+        delay = self.hedging.delay(family)
+
+        first = asyncio.ensure_future(self._request(method, section, **extra))
+        if delay is None:
+            return await first
+
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+
+            # Hedging an upstream which is already failing only adds to its load.
+            if self.breaker.state != CLOSED or not self.hedging.acquire():
+                metrics.HEDGED_REQUESTS.labels("crunchy", family, "throttled").inc()
+                return await first
+
+            second = asyncio.ensure_future(
+                self._request(method, section, client=self.hedge_client, **extra)
+            )
+            tasks.append(second)
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        outcome = "won" if task is second else "lost"
+                        metrics.HEDGED_REQUESTS.labels("crunchy", family, outcome).inc()
+                        return task.result()
+
+            # Both failed, the original error is the most useful.
+            metrics.HEDGED_REQUESTS.labels("crunchy", family, "failed").inc()
+            return first.result()
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    async def request(self, method: str, section: str, headers: dict = None, **extra):
+    async def _request(
+        self,
+        method: str,
+        section: str,
+        headers: dict = None,
+        client: Optional[httpx.AsyncClient] = None,
+        **extra,
+    ):
         set_headers = {
             "Authorization": self.__token,
         }
@@ -32,78 +254,127 @@ class CrunchyApi:
         if headers is not None:
             set_headers = {**headers, **set_headers}
 
+        if "json" in extra:
+            extra["content"] = self.codec.dumps(extra.pop("json"))
+            set_headers["Content-Type"] = self.codec.content_type
+
         url = f"{CRUNCHY_API}/{section}"
+        family = route_family(section)
 
-        async with self.lock:
-            r = None
-            for tries in range(5):
-                try:
-                    r = await self.client.request(
-                        method, url, headers=set_headers, **extra
-                    )
+        backoff = Backoff(RETRY_BACKOFF_BASE, RETRY_BACKOFF_CAP)
 
-                    data = await r.aread()
-                    try:
-                        data = json.loads(data)
-                    except json.JSONDecodeError:
-                        data = data.decode("utf-8")
+        r = None
+        for tries in range(5):
+            try:
+                queued_at = time.perf_counter()
+                if self.limiter is not None:
+                    # The family's token first so a drained family doesn't
+                    # hold a global token others could use.
+                    await self.limiter.acquire(f"crunchy-api:{family}")
+                    await self.limiter.acquire(GLOBAL_BUCKET)
 
-                    if r.status_code >= 500:
-                        raise CrunchyApiHTTPException(r, data)
+                # Fails fast rather than queueing behind calls which will fail.
+                self.breaker.check()
 
-                    if 300 > r.status_code >= 200:
-                        _log.debug(f"{method} {url} successful response: {data}")
-                        return data
-
-                    if r.status_code == 429:
-                        if not r.headers.get("Via") or isinstance(data, str):
-                            # Cloudflare banned, maybe.
-                            raise CrunchyApiHTTPException(r, data)
-
-                        # sleep a bit
-                        retry_after: float = data["retry_after"]  # noqa
-                        message = f"We are being rate limited. Retrying in {retry_after:.2} seconds."
-                        _log.warning(message)
-
-                        is_global = data.get("global", False)
-                        if is_global:
-                            _log.warning(
-                                "Global rate limit has been hit. Retrying in %.2f seconds.",
-                                retry_after,
-                            )
-
-                        await asyncio.sleep(retry_after)
-                        _log.debug(
-                            "Rate limit wait period has elapsed. Retrying request."
+                async with self.scheduler.slot(family):
+                    started_at = time.perf_counter()
+                    metrics.QUEUE_WAIT.labels("crunchy", family).observe(
+                        started_at - queued_at
+                    )
+
+                    with self.breaker.attempt() as attempt:
+                        r = await (client or self.client).request(
+                            method,
+                            url,
+                            headers=set_headers,
+                            timeout=call_timeout(self.client.timeout),
+                            **extra,
                         )
 
-                        continue
+                        data = self.codec.loads(await r.aread())
+                        attempt.failed = r.status_code >= 500
 
-                    if r.status_code == 403:
-                        raise CrunchyApiHTTPException(r, data)
-                    elif r.status_code == 404:
-                        raise CrunchyApiHTTPException(r, data)
-                    else:
+                elapsed = time.perf_counter() - started_at
+                metrics.UPSTREAM_LATENCY.labels("crunchy", family).observe(elapsed)
+                metrics.UPSTREAM_REQUESTS.labels("crunchy", family, r.status_code).inc()
+
+                if r.status_code >= 500:
+                    raise CrunchyApiHTTPException(r, data)
+
+                if 300 > r.status_code >= 200:
+                    if self.hedging is not None:
+                        self.hedging.observe(family, elapsed)
+
+                    if _log.isEnabledFor(logging.DEBUG):
+                        _log.debug("%s %s successful response: %s", method, url, data)
+                    return data
+
+                if r.status_code == 429:
+                    if not r.headers.get("Via") or isinstance(data, str):
+                        # Cloudflare banned, maybe.
                         raise CrunchyApiHTTPException(r, data)
 
-                # An exception has occurred at the transport layer e.g. socket interrupt.
-                except httpx.TransportError as e:
-                    if tries < 4:
+                    # sleep a bit
+                    retry_after: float = data["retry_after"]  # noqa
+                    _log.warning(
+                        "We are being rate limited. Retrying in %.2f seconds.",
+                        retry_after,
+                    )
+
+                    metrics.RATE_LIMITED.labels("crunchy", family).inc()
+                    metrics.RATE_LIMIT_SLEEP.labels("crunchy", family).inc(retry_after)
+                    metrics.UPSTREAM_RETRIES.labels("crunchy", family, "429").inc()
+
+                    is_global = data.get("global", False)
+                    if is_global:
                         _log.warning(
-                            f"failed preparing to retry connection failure due to error {e!r}"
+                            "Global rate limit has been hit. Retrying in %.2f seconds.",
+                            retry_after,
                         )
-                        await asyncio.sleep(1 + tries * 2)
-                        continue
-                    raise
-                finally:
-                    if r is not None:
-                        await r.aclose()
-
-            if r is not None:
-                # We've run out of retries, raise.
-                if r.status_code >= 500:
+                        self.scheduler.pause_all(retry_after)
+                    else:
+                        self.scheduler.pause(family, retry_after)
+
+                    if self.limiter is not None:
+                        bucket = GLOBAL_BUCKET if is_global else f"crunchy-api:{family}"
+                        await self.limiter.drain(bucket, retry_after)
+
+                    # Only the limited routes are paused, the scheduler
+                    # holds back our retry until the wait period has elapsed.
+                    deadline.check(retry_after)
+                    continue
+
+                if r.status_code == 403:
+                    raise CrunchyApiHTTPException(r, data)
+                elif r.status_code == 404:
+                    raise CrunchyApiHTTPException(r, data)
+                else:
                     raise CrunchyApiHTTPException(r, data)
 
+            # An exception has occurred at the transport layer e.g. socket interrupt.
+            except httpx.TransportError as e:
+                if tries < 4:
+                    _log.warning(
+                        "failed preparing to retry connection failure due to error %r",
+                        e,
+                    )
+                    delay = backoff.next()
+                    deadline.check(delay)
+                    metrics.UPSTREAM_RETRIES.labels(
+                        "crunchy", family, "transport"
+                    ).inc()
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+            finally:
+                if r is not None:
+                    await r.aclose()
+
+        if r is not None:
+            # We've run out of retries, raise.
+            if r.status_code >= 500:
                 raise CrunchyApiHTTPException(r, data)
 
-            raise RuntimeError("Unreachable code in HTTP handling")
+            raise CrunchyApiHTTPException(r, data)
+
+        raise RuntimeError("Unreachable code in HTTP handling")
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Tuple
+
+from crunchy.tools import metrics
+
+_log = logging.getLogger("crunchy-breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """The upstream is failing so the call was rejected without being made."""
+
+    def __init__(self, upstream: str, retry_in: float):
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+    def __str__(self):
+        return f"the {self.upstream} circuit is open, retrying in {self.retry_in:.2f}s"
+
+
+class Backoff:
+    """
+    Decorrelated jitter backoff, each delay is picked at random between
+    the base delay and three times the previous delay.
+
+    This spreads retries out over time rather than every client coming back
+    at the same moment as with a fixed or purely exponential backoff.
+    """
+
+    def __init__(self, base: float, cap: float):
+        self.base = base
+        self.cap = cap
+        self._delay = base
+
+    def next(self) -> float:
+        """The time to wait before the next attempt."""
+        self._delay = min(self.cap, random.uniform(self.base, self._delay * 3))
+        return self._delay
+
+    def reset(self):
+        self._delay = self.base
+
+
+class Attempt:
+    """The outcome of a single call, set `failed` for a failed response."""
+
+    __slots__ = ("failed",)
+
+    def __init__(self):
+        self.failed = False
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream once it's failing so callers fail fast and
+    the upstream has room to recover.
+
+    While closed every call is let through and the outcomes over the last
+    `window` seconds are tracked, calls which fail or take longer than
+    `slow_call` seconds count against the upstream. Once at least
+    `min_calls` have been made and `failure_rate` of them were bad the
+    circuit opens and every call is rejected with `CircuitOpen`.
+
+    After being open for a while the circuit is half open and a single
+    call is let through to probe the upstream, if it succeeds the circuit
+    closes otherwise it opens again for longer, backing off with jitter up
+    to `max_open_for` seconds.
+    """
+
+    def __init__(
+        self,
+        upstream: str,
+        failure_rate: float,
+        min_calls: int,
+        window: float,
+        slow_call: float,
+        open_for: float,
+        max_open_for: float,
+    ):
+        self.upstream = upstream
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call = slow_call
+
+        self.state = CLOSED
+        self.rejected = 0
+
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._bad = 0
+        self._backoff = Backoff(open_for, max_open_for)
+        self._open_until = 0.0
+        self._probing = False
+
+    def stats(self) -> dict:
+        self._expire(time.monotonic())
+        return {
+            "state": self.state,
+            "calls": len(self._outcomes),
+            "bad": self._bad,
+            "rejected": self.rejected,
+        }
+
+    def check(self):
+        """Raises `CircuitOpen` if the call would be rejected right now."""
+        if self.state == CLOSED:
+            return
+
+        now = time.monotonic()
+        if self.state == OPEN and now >= self._open_until:
+            self._transition(HALF_OPEN)
+
+        if self.state == OPEN or self._probing:
+            self.rejected += 1
+            metrics.BREAKER_REJECTED.labels(self.upstream).inc()
+            raise CircuitOpen(self.upstream, max(self._open_until - now, 0.0))
+
+    @contextmanager
+    def attempt(self):
+        """
+        Wraps a single call to the upstream, raising `CircuitOpen` if it's
+        rejected. Any exception raised within the call counts as a failure.
+
+        Cancelled calls tell us nothing about the upstream so aren't counted,
+        a cancelled probe leaves the circuit half open for the next call to
+        probe instead.
+        """
+        self.check()
+
+        probe = self.state == HALF_OPEN
+        if probe:
+            self._probing = True
+
+        attempt = Attempt()
+        cancelled = False
+        started_at = time.monotonic()
+        try:
+            yield attempt
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception:
+            attempt.failed = True
+            raise
+        finally:
+            if probe:
+                self._probing = False
+
+            if not cancelled:
+                self._record(attempt.failed, time.monotonic() - started_at, probe)
+
+    def _record(self, failed: bool, duration: float, probe: bool):
+        bad = failed or duration >= self.slow_call
+
+        if probe:
+            if bad:
+                self._open()
+            else:
+                self._close()
+            return
+
+        if self.state != CLOSED:
+            # Started before the circuit opened.
+            return
+
+        now = time.monotonic()
+        self._outcomes.append((now, bad))
+        self._bad += bad
+        self._expire(now)
+
+        calls = len(self._outcomes)
+        if calls >= self.min_calls and self._bad >= calls * self.failure_rate:
+            self._open()
+
+    def _expire(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            _, bad = self._outcomes.popleft()
+            self._bad -= bad
+
+    def _open(self):
+        open_for = self._backoff.next()
+        self._open_until = time.monotonic() + open_for
+        self._outcomes.clear()
+        self._bad = 0
+        self._transition(OPEN)
+        _log.warning(
+            "the %s circuit is open, rejecting calls for %.2f seconds",
+            self.upstream,
+            open_for,
+        )
+
+    def _close(self):
+        self._backoff.reset()
+        self._transition(CLOSED)
+        _log.info("the %s circuit has closed, calls are let through", self.upstream)
+
+    def _transition(self, state: str):
+        self.state = state
+        metrics.BREAKER_TRANSITIONS.labels(self.upstream, state).inc()
+        if state == HALF_OPEN:
+            _log.info("the %s circuit is half open, probing upstream", self.upstream)
@@ -0,0 +1,159 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from crunchy.tools.singleflight import SingleFlight
+
+
+class _Load:
+    """An in flight load, which is stale once its key has been invalidated."""
+
+    __slots__ = ("stale",)
+
+    def __init__(self):
+        self.stale = False
+
+
+class TTLCache:
+    """
+    A bounded least recently used cache where every entry expires after
+    a set time to live.
+
+    Concurrent loads of the same key are coalesced into a single call of
+    the loader with the result being shared between all the callers.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        Args:
+            maxsize:
+                The maximum number of entries to hold before evicting the
+                least recently used entry.
+
+            ttl:
+                The time in seconds an entry is valid for.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._flights = SingleFlight()
+        self._loads: Dict[Hashable, _Load] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def coalesced(self) -> int:
+        """The number of loads which waited on another load of the same key."""
+        return self._flights.saved
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Gets the value for the key if it exists and hasn't expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Sets the value for the key, evicting the oldest entries if full."""
+        if ttl is None:
+            ttl = self.ttl
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """
+        Removes the key from the cache if it exists, an in flight load of
+        the key won't be cached as it may be out of date.
+        """
+        self._entries.pop(key, None)
+
+        load = self._loads.get(key)
+        if load is not None:
+            load.stale = True
+
+    def invalidate_if(self, predicate: Callable[[Hashable], bool]):
+        """Removes every key the predicate returns True for, see `invalidate`."""
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+        for key, load in self._loads.items():
+            if predicate(key):
+                load.stale = True
+
+    def clear(self):
+        self._entries.clear()
+        for load in self._loads.values():
+            load.stale = True
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Gets the value for the key, calling the loader to produce it
+        if it isn't cached.
+
+        If the key is already being loaded the caller waits on that load
+        rather than calling the loader again. Errors are passed to every
+        caller waiting on the load and are never cached, neither are values
+        whose key was invalidated while they were loading.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+
+        if key in self._flights:
+            # Waits on the load already in flight.
+            return await self._flights.do(key, loader)
+
+        # Tracked from now rather than once the load starts running, so an
+        # invalidation in between isn't missed.
+        current = self._loads[key] = _Load()
+
+        async def load():
+            try:
+                value = await loader()
+            finally:
+                if self._loads.get(key) is current:
+                    del self._loads[key]
+
+            # Invalidated while loading, so the value may already be stale.
+            if not current.stale:
+                self.set(key, value)
+            return value
+
+        return await self._flights.do(key, load)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "inflight": len(self._flights),
+        }
@@ -0,0 +1,34 @@
+from typing import Any
+
+import orjson
+
+
+class JsonCodec:
+    """
+    Encodes request bodies and decodes response bodies for the HTTP clients.
+
+    This works directly on bytes so payloads are encoded once per request
+    rather than once per attempt and responses are decoded straight from
+    the buffer httpx has already read.
+    """
+
+    content_type = "application/json"
+
+    def dumps(self, obj: Any) -> bytes:
+        """Encodes the given object to bytes."""
+        return orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        """
+        Decodes the given response body.
+
+        If the body isn't valid JSON e.g. an empty body or a Cloudflare
+        error page, the raw body is returned as a string.
+        """
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return data.decode("utf-8")
+
+
+DEFAULT_CODEC = JsonCodec()
@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# The loop time by which the current interaction's work must be done.
+_deadline: ContextVar[Optional[float]] = ContextVar("crunchy_deadline", default=None)
+
+# Set for work done on behalf of several callers, see `SharedDeadline`.
+_shared: ContextVar[Optional["SharedDeadline"]] = ContextVar(
+    "crunchy_shared_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    """The work would finish after its response is thrown away by Discord."""
+
+
+@contextmanager
+def deadline(timeout: float):
+    """
+    Sets the deadline for any work started within the context, including
+    any tasks created within it, to `timeout` seconds from now.
+    """
+    loop = asyncio.get_running_loop()
+    token = _deadline.set(loop.time() + timeout)
+    shared_token = _shared.set(None)
+    try:
+        yield
+    finally:
+        _shared.reset(shared_token)
+        _deadline.reset(token)
+
+
+@contextmanager
+def cleared():
+    """
+    Removes the deadline for any work started within the context, for work
+    which isn't done on behalf of any one interaction.
+    """
+    token = _deadline.set(None)
+    shared_token = _shared.set(None)
+    try:
+        yield
+    finally:
+        _shared.reset(shared_token)
+        _deadline.reset(token)
+
+
+@contextmanager
+def shared() -> Iterator["SharedDeadline"]:
+    """
+    Sets the deadline for any work started within the context, including
+    any tasks created within it, to a `SharedDeadline` starting at the
+    current deadline.
+    """
+    deadline_ = SharedDeadline(current())
+    token = _shared.set(deadline_)
+    try:
+        yield deadline_
+    finally:
+        _shared.reset(token)
+
+
+class SharedDeadline:
+    """
+    The deadline of work done on behalf of several callers e.g. a coalesced
+    request, which is the latest of their deadlines.
+
+    The deadline is pushed back as callers with more time join, None means
+    one of them has no deadline at all.
+    """
+
+    def __init__(self, at: Optional[float]):
+        self.at = at
+
+    def join(self, at: Optional[float]):
+        if self.at is not None and (at is None or at > self.at):
+            self.at = at
+
+
+def current() -> Optional[float]:
+    """The loop time of the current deadline or None if there is none."""
+    shared_ = _shared.get()
+    if shared_ is not None:
+        return shared_.at
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """
+    The time in seconds left until the current deadline or None if
+    there is no deadline set.
+    """
+    at = current()
+    if at is None:
+        return None
+    return at - asyncio.get_running_loop().time()
+
+
+def check(delay: float = 0.0):
+    """
+    Raises `DeadlineExceeded` if waiting `delay` seconds would take us past
+    the current deadline, this should be called before any retry.
+    """
+    left = remaining()
+    if left is not None and left < delay:
+        raise DeadlineExceeded(
+            f"waiting {delay:.2f} seconds would exceed the deadline ({left:.2f}s left)"
+        )
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import uuid
+from typing import Dict, Optional
+
+import aioredis
+
+_log = logging.getLogger("crunchy-distributed")
+
+# Refills the bucket based on the time since it was last touched and then
+# hands out up to the requested amount of tokens in one atomic step.
+# Returns the amount of tokens granted and how long to wait in ms if none were.
+ACQUIRE_SCRIPT = """
+redis.replicate_commands()
+
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000)
+
+local granted = math.max(math.min(requested, math.floor(tokens)), 0)
+tokens = tokens - granted
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000) + 60000)
+
+local wait = 0
+if granted == 0 then
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+
+return {granted, wait}
+"""
+
+# Empties the bucket so no tokens are handed out for the given amount of ms.
+DRAIN_SCRIPT = """
+redis.replicate_commands()
+
+local rate = tonumber(ARGV[1])
+local delay = tonumber(ARGV[2])
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+redis.call("HSET", KEYS[1], "tokens", -(delay * rate / 1000), "ts", now)
+redis.call("PEXPIRE", KEYS[1], delay + 60000)
+"""
+
+# Only deletes the lock if it's still held by whoever is releasing it.
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class _Lease:
+    """Tokens taken from the shared bucket which this process can spend locally."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.expires_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+class SharedRateLimiter:
+    """
+    A set of token buckets held in Redis which are shared between every
+    process and replica of the bot.
+
+    To keep the common case to one Redis round trip or less each process
+    leases a small batch of tokens at a time and spends them locally before
+    going back to Redis for more.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        prefix: str = "crunchy:ratelimit",
+        lease_size: int = 5,
+        lease_ttl: float = 1.0,
+    ):
+        """
+        Args:
+            redis:
+                The Redis connection to hold the buckets in.
+
+            prefix:
+                The prefix to add to every bucket key.
+
+            lease_size:
+                The maximum amount of tokens to take from a bucket at once.
+
+            lease_ttl:
+                How long in seconds leased tokens can be spent for before they
+                are thrown away, this stops idle processes hoarding tokens.
+        """
+        self.prefix = prefix
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+
+        self._redis = redis
+        self._acquire = redis.register_script(ACQUIRE_SCRIPT)
+        self._drain = redis.register_script(DRAIN_SCRIPT)
+
+        self._rates: Dict[str, float] = {}
+        self._capacities: Dict[str, int] = {}
+        self._leases: Dict[str, _Lease] = {}
+
+        # Tokens spent from a lease vs the calls made to Redis for them.
+        self.local_hits = 0
+        self.redis_calls = 0
+        self.wait_time = 0.0
+
+    async def shutdown(self):
+        await self._redis.close()
+
+    def configure(self, name: str, rate: float, capacity: int):
+        """
+        Sets the refill rate (tokens per second) and the burst capacity
+        of the named bucket.
+        """
+        self._rates[name] = rate
+        self._capacities[name] = capacity
+
+    async def acquire(self, name: str):
+        """
+        Waits for a token from the named bucket.
+
+        If the bucket has not been configured or Redis cannot be reached
+        this returns straight away rather than holding up the request.
+        """
+        rate = self._rates.get(name)
+        if rate is None:
+            return
+
+        lease = self._leases.get(name)
+        if lease is None:
+            lease = self._leases[name] = _Lease()
+
+        loop = asyncio.get_running_loop()
+        if self._take(lease, loop.time()):
+            return
+
+        async with lease.lock:
+            while not self._take(lease, loop.time()):
+                try:
+                    granted, wait = await self._acquire(
+                        keys=[f"{self.prefix}:{name}"],
+                        args=[rate, self._capacities[name], self.lease_size],
+                    )
+                except (aioredis.RedisError, OSError) as e:
+                    _log.warning("failed to acquire shared rate limit %s: %r", name, e)
+                    return
+                finally:
+                    self.redis_calls += 1
+
+                if granted > 0:
+                    lease.tokens = int(granted)
+                    lease.expires_at = loop.time() + self.lease_ttl
+                    continue
+
+                self.wait_time += wait / 1000
+                await asyncio.sleep(wait / 1000)
+
+    def _take(self, lease: _Lease, now: float) -> bool:
+        if lease.tokens > 0 and lease.expires_at > now:
+            lease.tokens -= 1
+            self.local_hits += 1
+            return True
+        return False
+
+    async def drain(self, name: str, delay: float):
+        """
+        Empties the named bucket for every process for `delay` seconds,
+        this should be called when we hit a rate limit regardless.
+        """
+        rate = self._rates.get(name)
+        if rate is None:
+            return
+
+        lease = self._leases.get(name)
+        if lease is not None:
+            lease.tokens = 0
+
+        try:
+            await self._drain(
+                keys=[f"{self.prefix}:{name}"],
+                args=[rate, int(delay * 1000)],
+            )
+        except (aioredis.RedisError, OSError) as e:
+            _log.warning("failed to drain shared rate limit %s: %r", name, e)
+
+    def stats(self) -> dict:
+        return {
+            "redis_calls": self.redis_calls,
+            "local_hits": self.local_hits,
+            "wait_time": self.wait_time,
+        }
+
+
+class RedisLock:
+    """
+    A lock shared between every process and replica of the bot.
+
+    The lock expires after `ttl` seconds in case whoever holds it dies
+    without releasing it, so it must only be held for short tasks.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        key: str,
+        ttl: float,
+        poll_interval: float = 0.5,
+    ):
+        self.key = key
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+        self._redis = redis
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._token = uuid.uuid4().hex
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """
+        Waits for the lock, raising `asyncio.TimeoutError` if it's not
+        acquired within `timeout` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        give_up_at = None if timeout is None else loop.time() + timeout
+
+        while not await self._redis.set(
+            self.key, self._token, nx=True, px=int(self.ttl * 1000)
+        ):
+            if give_up_at is not None and loop.time() >= give_up_at:
+                raise asyncio.TimeoutError(f"timed out waiting for lock {self.key}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def release(self):
+        await self._release(keys=[self.key], args=[self._token])
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.release()
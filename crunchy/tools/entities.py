@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import aioredis
+
+from crunchy.tools.api import CrunchyApi, CrunchyApiHTTPException
+from crunchy.tools.cache import TTLCache
+from crunchy.tools.codec import DEFAULT_CODEC, JsonCodec
+from crunchy.tools.singleflight import SingleFlight
+
+_log = logging.getLogger("crunchy-entities")
+
+# The time the entry stops being fresh and the entity, None if it doesn't exist.
+Entry = Tuple[float, Optional[dict]]
+
+
+class EntityCache:
+    """
+    A two tier cache of anime and manga details keyed by id.
+
+    Entities are held in a local LRU and optionally in Redis so they can
+    be shared between replicas. Once an entity is no longer fresh it is still
+    served for a while longer while it is refreshed in the background, and
+    entities which don't exist are remembered for a short time so repeated
+    lookups of them don't reach the api either.
+    """
+
+    def __init__(
+        self,
+        client: CrunchyApi,
+        maxsize: int,
+        ttls: Dict[str, float],
+        stale_ttl: float,
+        negative_ttl: float,
+        redis: Optional[aioredis.Redis] = None,
+        codec: JsonCodec = DEFAULT_CODEC,
+        prefix: str = "crunchy:entity",
+        spawn: Callable[[Awaitable], asyncio.Future] = asyncio.ensure_future,
+    ):
+        """
+        Args:
+            client:
+                The api client to load entities with.
+
+            maxsize:
+                The maximum number of entities to hold locally.
+
+            ttls:
+                The time in seconds an entity is fresh for by kind.
+
+            stale_ttl:
+                The time in seconds after an entity stops being fresh that
+                it can still be served while it is refreshed.
+
+            negative_ttl:
+                The time in seconds to remember an entity doesn't exist.
+
+            redis:
+                The optional Redis connection to share entities through.
+
+            codec:
+                The codec to store entities in Redis with.
+
+            prefix:
+                The prefix to add to every Redis key.
+
+            spawn:
+                Runs the background refreshes, the app passes its own so it
+                keeps hold of them and cancels them on shutdown.
+        """
+        self.client = client
+        self.ttls = ttls
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.codec = codec
+        self.prefix = prefix
+        self.spawn = spawn
+
+        self._local = TTLCache(maxsize=maxsize, ttl=max(ttls.values()))
+        self._redis = redis
+        self._flights = SingleFlight()
+
+        self.redis_hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.loads = 0
+        self.refreshes = 0
+
+    async def get(self, kind: str, id_: str) -> Optional[dict]:
+        """
+        Gets the entity of the given kind (anime or manga) by its id.
+
+        Returns:
+            The entity or None if it doesn't exist. The entity may be shared
+            between callers and must not be modified.
+        """
+        key = (kind, str(id_))
+
+        entry = self._local.get(key)
+        if entry is None:
+            entry = await self._flights.do(key, lambda: self._fetch(kind, key[1]))
+
+        fresh_until, entity = entry
+        if fresh_until <= time.time():
+            self.stale_hits += 1
+            self._refresh_later(kind, key[1])
+
+        if entity is None:
+            self.negative_hits += 1
+
+        return entity
+
+    def prime(self, kind: str, entity: dict):
+        """
+        Adds an entity we already have e.g. from a search result to the
+        cache, if it isn't already cached locally.
+
+        The entity is written through to Redis in the background so the
+        other workers can serve it too.
+        """
+        key = (kind, str(entity["id"]))
+        if self._local.get(key) is None:
+            entry = self._make_entry(kind, entity)
+            self._store_local(kind, key[1], entry)
+            if self._redis is not None:
+                self.spawn(self._set_shared(kind, key[1], entry))
+
+    def invalidate(self, kind: str, id_: str):
+        """Removes the entity from the local cache."""
+        self._local.invalidate((kind, str(id_)))
+
+    async def _fetch(self, kind: str, id_: str) -> Entry:
+        entry = await self._get_shared(kind, id_)
+        if entry is not None:
+            self.redis_hits += 1
+            self._store_local(kind, id_, entry)
+            return entry
+
+        return await self._load(kind, id_)
+
+    async def _load(self, kind: str, id_: str) -> Entry:
+        self.loads += 1
+
+        try:
+            data = await self.client.request("GET", f"data/{kind}/{id_}")
+            entity = data["data"]
+        except CrunchyApiHTTPException as e:
+            if e.status_code != 404:
+                raise
+            entity = None
+
+        entry = self._make_entry(kind, entity)
+        self._store_local(kind, id_, entry)
+        await self._set_shared(kind, id_, entry)
+        return entry
+
+    def _refresh_later(self, kind: str, id_: str):
+        key = ("refresh", kind, id_)
+        if key in self._flights:
+            return
+
+        self.refreshes += 1
+        self.spawn(self._refresh(key, kind, id_))
+
+    async def _refresh(self, key: tuple, kind: str, id_: str):
+        try:
+            await self._flights.do(key, lambda: self._load(kind, id_))
+        except Exception as e:
+            _log.warning("failed to refresh %s %s: %r", kind, id_, e)
+
+    def _make_entry(self, kind: str, entity: Optional[dict]) -> Entry:
+        ttl = self.negative_ttl if entity is None else self.ttls[kind]
+        return time.time() + ttl, entity
+
+    def _lifetime(self, entry: Entry) -> float:
+        """The time in seconds the entry can be served for, stale or not."""
+        fresh_until, entity = entry
+        remaining = fresh_until - time.time()
+        if entity is None:
+            return remaining
+        return remaining + self.stale_ttl
+
+    def _store_local(self, kind: str, id_: str, entry: Entry):
+        lifetime = self._lifetime(entry)
+        if lifetime > 0:
+            self._local.set((kind, id_), entry, ttl=lifetime)
+
+    async def _get_shared(self, kind: str, id_: str) -> Optional[Entry]:
+        if self._redis is None:
+            return None
+
+        try:
+            raw = await self._redis.get(f"{self.prefix}:{kind}:{id_}")
+        except (aioredis.RedisError, OSError) as e:
+            _log.warning("failed to get %s %s from redis: %r", kind, id_, e)
+            return None
+
+        if raw is None:
+            return None
+
+        # Anything that isn't an entry we wrote is treated as a miss and
+        # removed so it's replaced by the next load.
+        try:
+            fresh_until, entity = self.codec.loads(raw)
+            if not isinstance(fresh_until, (int, float)):
+                raise TypeError(f"bad freshness {fresh_until!r}")
+            if entity is not None and not isinstance(entity, dict):
+                raise TypeError(f"bad entity {entity!r}")
+        except (ValueError, TypeError) as e:
+            _log.warning("dropping corrupt %s %s from redis: %r", kind, id_, e)
+            await self._delete_shared(kind, id_)
+            return None
+
+        return fresh_until, entity
+
+    async def _delete_shared(self, kind: str, id_: str):
+        try:
+            await self._redis.delete(f"{self.prefix}:{kind}:{id_}")
+        except (aioredis.RedisError, OSError) as e:
+            _log.warning("failed to delete %s %s from redis: %r", kind, id_, e)
+
+    async def _set_shared(self, kind: str, id_: str, entry: Entry):
+        if self._redis is None:
+            return
+
+        lifetime = self._lifetime(entry)
+        if lifetime <= 0:
+            return
+
+        try:
+            await self._redis.set(
+                f"{self.prefix}:{kind}:{id_}",
+                self.codec.dumps(entry),
+                px=int(lifetime * 1000),
+            )
+        except (aioredis.RedisError, OSError) as e:
+            _log.warning("failed to set %s %s in redis: %r", kind, id_, e)
+
+    def stats(self) -> dict:
+        return {
+            **self._local.stats(),
+            "redis_hits": self.redis_hits,
+            "stale_hits": self.stale_hits,
+            "negative_hits": self.negative_hits,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+        }
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterator, List, Optional, Sequence
+
+import httpx
+from roid.exceptions import DiscordServerError, HTTPException
+
+from crunchy.config import RETRY_BACKOFF_BASE, RETRY_BACKOFF_CAP
+from crunchy.tools import metrics
+from crunchy.tools.breaker import Backoff, CircuitOpen
+from crunchy.tools.http import DISCORD_WEBHOOKS, HttpHandler
+
+_log = logging.getLogger("crunchy-fanout")
+
+# Discord answers with these once a webhook or its token has been deleted.
+DEAD_STATUSES = (401, 404)
+
+DELIVERED = "delivered"
+FAILED = "failed"
+DEAD = "dead"
+
+
+class FanOutProgress:
+    """How far through delivering an event to every webhook we are."""
+
+    def __init__(self, event: str, total: int):
+        self.event = event
+        self.total = total
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.dead: List[str] = []
+
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return self.delivered + self.failed + len(self.dead)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def stats(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            "event": self.event,
+            "total": self.total,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dead": len(self.dead),
+            "retries": self.retries,
+            "elapsed": elapsed,
+            "rate": self.done / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class WebhookDispatcher:
+    """
+    Delivers an event to every webhook subscribed to it.
+
+    Every webhook is it's own Discord rate limit bucket, so deliveries go
+    through the `HttpHandler` which only holds back the webhooks which have
+    been limited while up to `concurrency` deliveries are in flight. They
+    have their own circuit breaker so a bad fan-out can't stop us from
+    responding to interactions.
+
+    Deliveries which fail due to Discord or the network are retried after
+    a jittered backoff, up to `max_attempts` times in total. These are the
+    only retries, the `HttpHandler` only retries rate limited deliveries. Webhooks which have been
+    deleted are dead, they're never retried and are passed to `on_dead` so
+    they can be unregistered.
+    """
+
+    def __init__(
+        self,
+        http: HttpHandler,
+        concurrency: int,
+        max_attempts: int,
+        progress_interval: float,
+    ):
+        self.http = http
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+
+    async def dispatch(
+        self,
+        event: str,
+        payload: dict,
+        webhooks: Sequence[str],
+        on_dead: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> FanOutProgress:
+        """
+        Executes every webhook with the payload, returning once each has
+        either been delivered to, given up on or found to be dead.
+
+        Args:
+            event:
+                The name of the event, used for logging and metrics.
+
+            payload:
+                The webhook execution payload, this is encoded once and
+                shared by every delivery.
+
+            webhooks:
+                The execution urls of the webhooks to deliver to.
+
+            on_dead:
+                Called with the url of every webhook found to be dead.
+        """
+        progress = FanOutProgress(event, len(webhooks))
+        body = self.http.codec.dumps(payload)
+
+        # Workers take the next webhook from the same iterator as they free up.
+        pending = iter(webhooks)
+        reporter = asyncio.ensure_future(self._report(progress))
+        try:
+            await asyncio.gather(
+                *(
+                    self._worker(pending, body, progress, on_dead)
+                    for _ in range(min(self.concurrency, len(webhooks)))
+                )
+            )
+        finally:
+            reporter.cancel()
+            progress.finished_at = time.perf_counter()
+
+        _log.info("finished delivering event %s: %s", event, progress.stats())
+        return progress
+
+    async def _report(self, progress: FanOutProgress):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            _log.info(
+                "delivering event %s: %d/%d done",
+                progress.event,
+                progress.done,
+                progress.total,
+            )
+
+    async def _worker(
+        self,
+        pending: Iterator[str],
+        body: bytes,
+        progress: FanOutProgress,
+        on_dead: Optional[Callable[[str], Awaitable[None]]],
+    ):
+        for url in pending:
+            outcome = await self._deliver(url, body, progress)
+            metrics.WEBHOOK_DELIVERIES.labels(progress.event, outcome).inc()
+
+            if outcome == DELIVERED:
+                progress.delivered += 1
+            elif outcome == FAILED:
+                progress.failed += 1
+            else:
+                progress.dead.append(url)
+                if on_dead is not None:
+                    try:
+                        await on_dead(url)
+                    except Exception as e:
+                        _log.warning("failed to remove dead webhook: %r", e)
+
+    async def _deliver(self, url: str, body: bytes, progress: FanOutProgress) -> str:
+        backoff = Backoff(RETRY_BACKOFF_BASE, RETRY_BACKOFF_CAP)
+        headers = {"Content-Type": self.http.codec.content_type}
+
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                progress.retries += 1
+
+            try:
+                await self.http.request(
+                    "POST",
+                    url,
+                    headers=headers,
+                    content=body,
+                    upstream=DISCORD_WEBHOOKS,
+                    retry_errors=False,
+                )
+                return DELIVERED
+            except CircuitOpen as e:
+                delay = max(e.retry_in, backoff.next())
+            except (DiscordServerError, httpx.TransportError):
+                delay = backoff.next()
+            except HTTPException as e:
+                if e.status_code in DEAD_STATUSES:
+                    return DEAD
+
+                _log.warning("failed to deliver to webhook: %s", e)
+                return FAILED
+
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(delay)
+
+        return FAILED
@@ -0,0 +1,92 @@
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class LatencyTracker:
+    """The latencies of the most recent requests to a route family."""
+
+    def __init__(self, size: int):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def observe(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class HedgingPolicy:
+    """
+    Decides when a slow request should be hedged with a second request.
+
+    A request is hedged once it has taken longer than the `percentile`
+    latency of the recent requests to the same route family, so only the
+    slowest requests are hedged. Until `min_samples` latencies have been
+    seen for a family nothing is hedged as we don't know what slow is yet.
+
+    To stop hedging doubling the load on a struggling upstream, every
+    request earns `max_rate` of a hedge and a hedge can only be sent
+    when a whole one has been earned, up to a burst of `burst` hedges.
+    """
+
+    def __init__(
+        self,
+        percentile: float,
+        min_delay: float,
+        max_rate: float,
+        burst: float = 10.0,
+        history: int = 256,
+        min_samples: int = 20,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_rate = max_rate
+        self.burst = burst
+        self.history = history
+        self.min_samples = min_samples
+
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._budget = burst
+
+    def observe(self, family: str, latency: float):
+        """Records the latency of a successful request."""
+        tracker = self._latencies.get(family)
+        if tracker is None:
+            tracker = self._latencies[family] = LatencyTracker(self.history)
+        tracker.observe(latency)
+
+    def delay(self, family: str) -> Optional[float]:
+        """
+        The time to wait before hedging a request to the given family or
+        None if it shouldn't be hedged.
+
+        This must be called once per hedgeable request as it's what earns
+        the hedging budget.
+        """
+        self._budget = min(self.burst, self._budget + self.max_rate)
+
+        tracker = self._latencies.get(family)
+        if tracker is None or len(tracker) < self.min_samples:
+            return None
+        return max(tracker.percentile(self.percentile), self.min_delay)
+
+    def acquire(self) -> bool:
+        """Takes a hedge from the budget, returning False if there's none left."""
+        if self._budget < 1:
+            return False
+        self._budget -= 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "budget": self._budget,
+            "delays": {
+                family: tracker.percentile(self.percentile)
+                for family, tracker in self._latencies.items()
+                if len(tracker) >= self.min_samples
+            },
+        }
@@ -1,22 +1,93 @@
 import asyncio
-import json
 import logging
+import time
 import httpx
 
+from typing import Optional
+
 from roid.__version__ import __version__
 from roid.exceptions import HTTPException, DiscordServerError, Forbidden, NotFound
-from roid.http import MaybeUnlock, _parse_rate_limit_header
+from roid.http import _parse_rate_limit_header
 
-from crunchy.config import DISCORD_API
+from crunchy.config import (
+    BREAKER_FAILURE_RATE,
+    BREAKER_MAX_OPEN_FOR,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_FOR,
+    BREAKER_SLOW_CALL,
+    BREAKER_WINDOW,
+    DISCORD_API,
+    DISCORD_CONNECT_TIMEOUT,
+    DISCORD_GLOBAL_RATE_LIMIT,
+    DISCORD_MAX_CONNECTIONS,
+    DISCORD_MAX_KEEPALIVE,
+    DISCORD_TIMEOUT,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_KEEPALIVE_INTERVAL,
+    RETRY_BACKOFF_BASE,
+    RETRY_BACKOFF_CAP,
+)
+from crunchy.tools import deadline, metrics
+from crunchy.tools.breaker import Backoff, CircuitBreaker
+from crunchy.tools.codec import DEFAULT_CODEC, JsonCodec
+from crunchy.tools.distributed import SharedRateLimiter
+from crunchy.tools.pool import KeepWarm, call_timeout, make_client
+from crunchy.tools.ratelimit import BucketMap
 
 
 _log = logging.getLogger("crunchy-http")
 
+# Fan-out deliveries fail for reasons of their own e.g. deleted webhooks,
+# so they're tracked and broken separately from responding to interactions.
+DISCORD = "discord"
+DISCORD_WEBHOOKS = "discord-webhooks"
+
 
 class HttpHandler:
-    def __init__(self, token: str):
-        self.lock = asyncio.Lock()
-        self.client = httpx.AsyncClient(http2=True)
+    def __init__(
+        self,
+        token: str,
+        codec: JsonCodec = DEFAULT_CODEC,
+        limiter: Optional[SharedRateLimiter] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.buckets = BucketMap()
+        self.breakers = {
+            upstream: CircuitBreaker(
+                upstream,
+                failure_rate=BREAKER_FAILURE_RATE,
+                min_calls=BREAKER_MIN_CALLS,
+                window=BREAKER_WINDOW,
+                slow_call=BREAKER_SLOW_CALL,
+                open_for=BREAKER_OPEN_FOR,
+                max_open_for=BREAKER_MAX_OPEN_FOR,
+            )
+            for upstream in (DISCORD, DISCORD_WEBHOOKS)
+        }
+        self.breaker = self.breakers[DISCORD]
+        self.client = make_client(
+            max_connections=DISCORD_MAX_CONNECTIONS,
+            max_keepalive=DISCORD_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            connect_timeout=DISCORD_CONNECT_TIMEOUT,
+            timeout=DISCORD_TIMEOUT,
+            transport=transport,
+        )
+        self.keep_warm = KeepWarm(
+            [self.client],
+            "GET",
+            f"{DISCORD_API}/gateway",
+            interval=HTTP_KEEPALIVE_INTERVAL,
+        )
+        self.codec = codec
+
+        self.limiter = limiter
+        if limiter is not None:
+            limiter.configure(
+                "discord:global",
+                rate=DISCORD_GLOBAL_RATE_LIMIT,
+                capacity=int(DISCORD_GLOBAL_RATE_LIMIT),
+            )
 
         self.user_agent = (
             f"DiscordBot (https://github.com/chillfish8/roid {__version__})"
@@ -24,53 +95,118 @@ class HttpHandler:
 
         self.__token = token
 
+    async def warm(self):
+        """Opens connections to Discord ahead of time and keeps them alive."""
+        await self.keep_warm.warm()
+        self.keep_warm.start()
+
     async def shutdown(self):
+        await self.keep_warm.shutdown()
         await self.client.aclose()
 
+    def stats(self) -> dict:
+        """The current rate limit bucket occupancy and time spent waiting."""
+        return self.buckets.stats()
+
     async def request(self, method: str, section: str, headers: dict = None, **extra):
         set_headers = {
             "User-Agent": self.user_agent,
         }
 
-        if extra.pop("pass_token", False):
+        pass_token = extra.pop("pass_token", False)
+        upstream = extra.pop("upstream", DISCORD)
+        # Callers with their own retries e.g. fan-out only want rate limits handled.
+        retry_errors = extra.pop("retry_errors", True)
+        breaker = self.breakers[upstream]
+        if pass_token:
             set_headers["Authorization"] = f"Bot {self.__token}"
 
         if headers is not None:
             set_headers = {**headers, **set_headers}
 
-        if not section.startswith(DISCORD_API):
+        if "json" in extra:
+            extra["content"] = self.codec.dumps(extra.pop("json"))
+            set_headers["Content-Type"] = self.codec.content_type
+
+        if section.startswith(DISCORD_API):
+            url = section
+        else:
             url = f"{DISCORD_API}{section}"
 
-        await self.lock.acquire()
-        with MaybeUnlock(self.lock) as lock:
+        bucket = self.buckets.get(method, url)
+        route = bucket.route
+
+        # Fails fast rather than queueing behind calls which will fail.
+        breaker.check()
+        backoff = Backoff(RETRY_BACKOFF_BASE, RETRY_BACKOFF_CAP)
+
+        queued_at = time.perf_counter()
+        with await bucket.acquire() as lock:
+            # Dropped if the interaction expired while we were queued.
+            deadline.check()
+
             r = None
             for tries in range(5):
                 try:
-                    r = await self.client.request(
-                        method, url, headers=set_headers, **extra
+                    if tries > 0:
+                        queued_at = time.perf_counter()
+
+                    await self.buckets.wait_global()
+
+                    # The global limit is per bot token, webhook executions
+                    # don't use it so only count towards their own bucket.
+                    if self.limiter is not None and pass_token:
+                        await self.limiter.acquire("discord:global")
+
+                    started_at = time.perf_counter()
+                    metrics.QUEUE_WAIT.labels(upstream, route).observe(
+                        started_at - queued_at
                     )
 
-                    data = await r.aread()
-                    try:
-                        data = json.loads(data)
-                    except json.JSONDecodeError:
-                        data = data.decode("utf-8")
+                    with breaker.attempt() as attempt:
+                        r = await self.client.request(
+                            method,
+                            url,
+                            headers=set_headers,
+                            timeout=call_timeout(self.client.timeout),
+                            **extra,
+                        )
+
+                        data = self.codec.loads(await r.aread())
+                        attempt.failed = r.status_code >= 500
+
+                    metrics.UPSTREAM_LATENCY.labels(upstream, route).observe(
+                        time.perf_counter() - started_at
+                    )
+                    metrics.UPSTREAM_REQUESTS.labels(
+                        upstream, route, r.status_code
+                    ).inc()
 
                     if r.status_code >= 500:
-                        raise DiscordServerError(r, data.decode("utf-8"))
+                        raise DiscordServerError(r, data)
+
+                    self.buckets.learn(bucket, r)
+                    bucket.update(r)
 
                     remaining = r.headers.get("X-Ratelimit-Remaining")
                     if remaining == "0" and r.status_code != 429:
                         # we've depleted our current bucket
                         delta = _parse_rate_limit_header(r)
                         _log.debug(
-                            f"we've emptied our rate limit bucket on endpoint: {url}, retry: {delta:.2}"
+                            "we've emptied our rate limit bucket %s, retry: %.2f",
+                            bucket.key,
+                            delta,
                         )
                         lock.defer()
-                        asyncio.get_running_loop().call_later(delta, self.lock.release)
+                        asyncio.get_running_loop().call_later(
+                            delta, bucket.lock.release
+                        )
 
                     if 300 > r.status_code >= 200:
-                        _log.debug(f"{method} {url} successful response: {data}")
+                        if _log.isEnabledFor(logging.DEBUG):
+                            _log.debug(
+                                "%s %s successful response: %s", method, url, data
+                            )
                         return data
 
                     if r.status_code == 429:
@@ -80,8 +216,16 @@ class HttpHandler:
 
                         # sleep a bit
                         retry_after: float = data["retry_after"]  # noqa
-                        message = f"We are being rate limited. Retrying in {retry_after:.2} seconds."
-                        _log.warning(message)
+                        _log.warning(
+                            "We are being rate limited. Retrying in %.2f seconds.",
+                            retry_after,
+                        )
+
+                        metrics.RATE_LIMITED.labels(upstream, route).inc()
+                        metrics.RATE_LIMIT_SLEEP.labels(upstream, route).inc(
+                            retry_after
+                        )
+                        metrics.UPSTREAM_RETRIES.labels(upstream, route, "429").inc()
 
                         is_global = data.get("global", False)
                         if is_global:
@@ -89,8 +233,16 @@ class HttpHandler:
                                 "Global rate limit has been hit. Retrying in %.2f seconds.",
                                 retry_after,
                             )
+                            self.buckets.set_global(retry_after)
+                            if self.limiter is not None:
+                                await self.limiter.drain("discord:global", retry_after)
+                            deadline.check(retry_after)
+                            continue
 
+                        # We still hold the bucket so only this route is held back.
+                        deadline.check(retry_after)
                         await asyncio.sleep(retry_after)
+                        bucket.wait_time += retry_after
                         _log.debug(
                             "Rate limit wait period has elapsed. Retrying request."
                         )
@@ -106,11 +258,17 @@ class HttpHandler:
 
                 # An exception has occurred at the transport layer e.g. socket interrupt.
                 except httpx.TransportError as e:
-                    if tries < 4:
+                    if retry_errors and tries < 4:
                         _log.warning(
-                            f"failed preparing to retry connection failure due to error {e!r}"
+                            "failed preparing to retry connection failure due to error %r",
+                            e,
                         )
-                        await asyncio.sleep(1 + tries * 2)
+                        delay = backoff.next()
+                        deadline.check(delay)
+                        metrics.UPSTREAM_RETRIES.labels(
+                            upstream, route, "transport"
+                        ).inc()
+                        await asyncio.sleep(delay)
                         continue
                     raise
                 finally:
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import os
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import orjson
+
+_log = logging.getLogger("crunchy-index")
+
+TITLE_FIELDS = ("title", "title_english", "title_japanese")
+
+
+def normalise(text: str) -> str:
+    """Normalises a title or query so they can be compared by prefix."""
+    return " ".join(text.casefold().split())
+
+
+def display_title(entity: dict) -> str:
+    """The title we show users for an entity."""
+    return entity.get("title_english") or entity["title"]
+
+
+class _Snapshot:
+    """
+    The entities of one catalogue snapshot and their sorted title keys,
+    this is never modified once built.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        names: List[str],
+        titles: List[Tuple[Optional[str], ...]],
+        keys: List[str],
+        refs: array,
+    ):
+        self.ids = ids
+        self.names = names
+        self.titles = titles
+        self.positions = {id_: position for position, id_ in enumerate(ids)}
+
+        # The sorted keys and the position of the entity each key refers to.
+        self.keys = keys
+        self.refs = refs
+
+
+class TitleIndex:
+    """
+    A prefix index over the titles of a catalogue of entities.
+
+    Titles are held in a sorted array of normalised keys which point into
+    a table of entity ids and display names, prefix lookups are then just
+    a binary search followed by a short scan.
+
+    Updates build a new snapshot of the index which is swapped in as one,
+    so lookups on the loop never see a half built index while an update
+    runs in another thread.
+    """
+
+    def __init__(self):
+        self._snapshot = _Snapshot([], [], [], [], array("l"))
+
+    def __len__(self) -> int:
+        return len(self._snapshot.ids)
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[str, str]]:
+        """
+        Finds the entities with a title starting with the given query.
+
+        Args:
+            query:
+                The raw text the user has typed.
+
+            limit:
+                The maximum number of entities to return.
+
+        Returns:
+            A list of `(id, display name)` pairs, this is empty if nothing
+            matches or the query is empty.
+        """
+        prefix = normalise(query)
+        if not prefix:
+            return []
+
+        snapshot = self._snapshot
+        keys, refs = snapshot.keys, snapshot.refs
+
+        found = []
+        seen = set()
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and len(found) < limit:
+            if not keys[i].startswith(prefix):
+                break
+
+            position = refs[i]
+            if position not in seen:
+                seen.add(position)
+                found.append((snapshot.ids[position], snapshot.names[position]))
+            i += 1
+
+        return found
+
+    def update(self, entities: Iterable[dict]) -> int:
+        """
+        Replaces the indexed entities with the given snapshot of the whole
+        catalogue, only re-indexing the entities whose titles have changed.
+        Entities missing from the snapshot are removed.
+
+        Returns:
+            The number of entities which were added, changed or removed.
+        """
+        previous = self._snapshot
+
+        ids: List[str] = []
+        names: List[str] = []
+        titles: List[Tuple[Optional[str], ...]] = []
+
+        # The new position of each entity carried over unchanged.
+        moved: Dict[int, int] = {}
+        changed = []
+        kept = 0
+        seen = set()
+        for entity in entities:
+            id_ = str(entity["id"])
+            if id_ in seen:
+                continue
+            seen.add(id_)
+
+            position = len(ids)
+            ids.append(id_)
+            names.append(display_title(entity))
+            titles.append(tuple(entity.get(field) for field in TITLE_FIELDS))
+
+            old = previous.positions.get(id_)
+            if old is not None:
+                kept += 1
+            if old is not None and previous.titles[old] == titles[position]:
+                moved[old] = position
+            else:
+                changed.append(position)
+
+        removed = len(previous.ids) - kept
+        if not changed and not removed:
+            # Display names can't change without a title changing too.
+            return 0
+
+        entries = [
+            (key, moved[ref])
+            for key, ref in zip(previous.keys, previous.refs)
+            if ref in moved
+        ]
+        for position in changed:
+            for title in set(titles[position]):
+                if title:
+                    entries.append((normalise(title), position))
+
+        # The carried over entries are already sorted so this is close to linear.
+        entries.sort()
+
+        self._snapshot = _Snapshot(
+            ids,
+            names,
+            titles,
+            [key for key, _ in entries],
+            array("l", (ref for _, ref in entries)),
+        )
+
+        return len(changed) + removed
+
+
+class CatalogueIndexer:
+    """
+    Keeps a `TitleIndex` per kind of entity up to date from the bulk
+    catalogue snapshots in a directory e.g. `anime.json` and `manga.json`.
+
+    The snapshots are checked in the background and only re-read when
+    they've been modified, with only the changed entities being re-indexed.
+    """
+
+    def __init__(self, directory: str, kinds: Iterable[str], interval: float):
+        self.directory = directory
+        self.interval = interval
+        self.indexes: Dict[str, TitleIndex] = {kind: TitleIndex() for kind in kinds}
+
+        self._modified: Dict[str, float] = {}
+        self._missing = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, kind: str) -> Optional[TitleIndex]:
+        return self.indexes.get(kind)
+
+    async def start(self):
+        """Loads the initial snapshots and starts refreshing in the background."""
+        await self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def refresh(self):
+        loop = asyncio.get_running_loop()
+
+        for kind, index in self.indexes.items():
+            path = os.path.join(self.directory, f"{kind}.json")
+            try:
+                modified = os.stat(path).st_mtime
+            except FileNotFoundError:
+                if kind not in self._missing:
+                    _log.warning("no catalogue snapshot found for %s at %s", kind, path)
+                    self._missing.add(kind)
+                continue
+
+            self._missing.discard(kind)
+
+            if self._modified.get(kind) == modified:
+                continue
+
+            entities = await loop.run_in_executor(None, _read_snapshot, path)
+            changed = await loop.run_in_executor(None, index.update, entities)
+            self._modified[kind] = modified
+
+            _log.info(
+                "refreshed %s title index, %d changed of %d",
+                kind,
+                changed,
+                len(index),
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.refresh()
+            except Exception as e:
+                _log.warning("failed to refresh the title indexes due to %r", e)
+
+
+def _read_snapshot(path: str) -> List[dict]:
+    with open(path, "rb") as file:
+        return orjson.loads(file.read())
@@ -0,0 +1,138 @@
+import atexit
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+import orjson
+
+from crunchy.tools import metrics
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line JSON object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+
+        return orjson.dumps(entry).decode()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops repeats of the same log line so an incident can't flood the log.
+
+    Records are grouped by their logger, level, unformatted message and
+    exception type, at most `burst` records of each group are let through
+    every `interval` seconds. The next record let through for a group says
+    how many were suppressed before it.
+
+    Debug records are also sampled, only `debug_sample_rate` of them are
+    kept at all.
+    """
+
+    def __init__(self, burst: int, interval: float, debug_sample_rate: float):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.debug_sample_rate = debug_sample_rate
+
+        # The window start, records let through and records suppressed.
+        self._windows: Dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG:
+            if random.random() >= self.debug_sample_rate:
+                metrics.LOGS_DROPPED.labels("sampled").inc()
+                return False
+
+        exc_type = record.exc_info[0] if record.exc_info else None
+        key = (record.name, record.levelno, str(record.msg), exc_type)
+
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            if len(self._windows) > 4096:
+                self._windows.clear()
+
+            suppressed = window[2] if window is not None else 0
+            self._windows[key] = [now, 1, 0]
+            record.suppressed = suppressed
+            return True
+
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+
+        window[2] += 1
+        metrics.LOGS_DROPPED.labels("rate_limited").inc()
+        return False
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records over to the listener thread without formatting them, so
+    formatting tracebacks and writing to the stream happens off the loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The arguments are merged now in case they're changed before the
+        # record is formatted, the traceback is formatted by the listener.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOGS_DROPPED.labels("queue_full").inc()
+
+
+def setup_logging(
+    level: str,
+    burst: int,
+    interval: float,
+    debug_sample_rate: float,
+    queue_size: int,
+) -> QueueListener:
+    """
+    Sends every log record through a bounded queue to a background thread
+    which writes them as JSON to stderr.
+
+    Logging never blocks the event loop, if the queue is full the record is
+    dropped rather than waiting for the writer to catch up.
+    """
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(queue_size)
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter())
+
+    handler = _NonBlockingQueueHandler(records)
+    handler.addFilter(RateLimitFilter(burst, interval, debug_sample_rate))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+    listener = QueueListener(records, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
@@ -0,0 +1,139 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, NamedTuple
+
+import aioredis
+import orjson
+from roid.command import Command
+
+from crunchy.tools.distributed import RedisLock
+
+# The scope of commands which aren't registered to specific guilds.
+GLOBAL = "global"
+
+# The payload of each command by scope (global or a guild id) and name.
+Commands = Dict[str, Dict[str, dict]]
+
+# The hash of each command's payload by scope and name.
+Manifest = Dict[str, Dict[str, str]]
+
+
+class ScopeChanges(NamedTuple):
+    changed: List[str]
+    removed: List[str]
+
+    # Nothing is known about what's registered for the scope.
+    unknown: bool
+
+
+def compile_commands(commands: Iterable[Command]) -> Commands:
+    """Produces the payload registered with Discord for each command."""
+    compiled: Commands = {}
+    for command in commands:
+        ctx = command.ctx
+        if command.guild_ids is None:
+            compiled.setdefault(GLOBAL, {})[ctx.name] = ctx.dict()
+            continue
+
+        # Copied per guild so the registered command itself isn't changed.
+        for guild_id in command.guild_ids:
+            payload = ctx.copy(update={"guild_id": guild_id}).dict()
+            compiled.setdefault(str(guild_id), {})[ctx.name] = payload
+
+    return compiled
+
+
+def make_manifest(compiled: Commands) -> Manifest:
+    return {
+        scope: {name: _hash(payload) for name, payload in commands.items()}
+        for scope, commands in compiled.items()
+    }
+
+
+def _hash(payload: dict) -> str:
+    return hashlib.sha256(
+        orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
+
+
+def diff(previous: Manifest, current: Manifest) -> Dict[str, ScopeChanges]:
+    """The commands of each scope which are new, changed or removed."""
+    changes = {}
+    for scope in previous.keys() | current.keys():
+        before = previous.get(scope, {})
+        after = current.get(scope, {})
+
+        changed = sorted(name for name, h in after.items() if before.get(name) != h)
+        removed = sorted(before.keys() - after.keys())
+        if changed or removed:
+            changes[scope] = ScopeChanges(changed, removed, scope not in previous)
+
+    return changes
+
+
+class FileManifestStore:
+    """
+    Keeps the manifest of the last sync in a file.
+
+    The lock is a `flock` on a file next to it so this only keeps processes
+    sharing the same disk from syncing at once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def load(self) -> Manifest:
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path, "rb") as file:
+            return orjson.loads(file.read())
+
+    async def save(self, manifest: Manifest):
+        with open(self.path, "wb") as file:
+            file.write(orjson.dumps(manifest))
+
+    @asynccontextmanager
+    async def lock(self):
+        loop = asyncio.get_running_loop()
+        with open(f"{self.path}.lock", "a") as file:
+            await loop.run_in_executor(None, fcntl.flock, file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    async def shutdown(self):
+        pass
+
+
+class RedisManifestStore:
+    """Keeps the manifest of the last sync in Redis, shared between replicas."""
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        lock_ttl: float,
+        key: str = "crunchy:commands:manifest",
+    ):
+        self.key = key
+        self.lock_ttl = lock_ttl
+        self._redis = redis
+
+    async def load(self) -> Manifest:
+        data = await self._redis.get(self.key)
+        if data is None:
+            return {}
+        return orjson.loads(data)
+
+    async def save(self, manifest: Manifest):
+        await self._redis.set(self.key, orjson.dumps(manifest))
+
+    def lock(self) -> RedisLock:
+        return RedisLock(self._redis, f"{self.key}:lock", ttl=self.lock_ttl)
+
+    async def shutdown(self):
+        await self._redis.close()
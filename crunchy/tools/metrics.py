@@ -0,0 +1,261 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Seconds, covering everything from a local cache hit to Discord's deadline.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+class Registry:
+    """
+    A set of metrics which can be rendered in the Prometheus text format.
+
+    Recording a metric is just a dict lookup and an addition, everything
+    else is left until the metrics are scraped.
+    """
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric"):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Registry = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+
+        registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        """Gets the child metric for the given label values."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, child in list(self._children.items()):
+            yield from self._render_child(values, child)
+
+    def _render_child(self, values: tuple, child) -> Iterable[str]:
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    """A value which only ever goes up, e.g. a count of requests."""
+
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def labels(self, *values) -> _CounterChild:
+        return super().labels(*values)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def total(self) -> float:
+        """The sum of the counter across every set of labels."""
+        return sum(child.value for child in list(self._children.values()))
+
+    def _render_child(self, values: tuple, child: _CounterChild) -> Iterable[str]:
+        yield f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+
+
+class Histogram(_Metric):
+    """Counts observations e.g. latencies into a set of buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Registry = REGISTRY,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def labels(self, *values) -> _HistogramChild:
+        return super().labels(*values)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values: tuple, child: _HistogramChild) -> Iterable[str]:
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            total += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _format_labels(self.labelnames, values, f'le="{le}"')
+            yield f"{self.name}_bucket{labels} {total}"
+
+        labels = _format_labels(self.labelnames, values)
+        yield f"{self.name}_sum{labels} {child.sum}"
+        yield f"{self.name}_count{labels} {total}"
+
+
+INTERACTION_LATENCY = Histogram(
+    "crunchy_interaction_seconds",
+    "Time taken to handle an interaction, including any deferred work.",
+    ("type", "name"),
+)
+INTERACTIONS_DEFERRED = Counter(
+    "crunchy_interactions_deferred_total",
+    "Interactions which were deferred and finished with a follow up.",
+    ("type", "name"),
+)
+
+UPSTREAM_LATENCY = Histogram(
+    "crunchy_upstream_request_seconds",
+    "Time taken by a single upstream request attempt.",
+    ("upstream", "route"),
+)
+UPSTREAM_REQUESTS = Counter(
+    "crunchy_upstream_requests_total",
+    "Upstream request attempts by response status.",
+    ("upstream", "route", "status"),
+)
+UPSTREAM_ABANDONED = Counter(
+    "crunchy_upstream_abandoned_total",
+    "Upstream requests cancelled as everyone waiting on them had gone away.",
+    ("upstream", "route"),
+)
+UPSTREAM_RETRIES = Counter(
+    "crunchy_upstream_retries_total",
+    "Upstream requests retried by the reason for the retry.",
+    ("upstream", "route", "reason"),
+)
+AUTOCOMPLETE_SUPERSEDED = Counter(
+    "crunchy_autocomplete_superseded_total",
+    "Autocomplete interactions cancelled as a newer one arrived for the option.",
+    ("name",),
+)
+INTERACTIONS_SHED = Counter(
+    "crunchy_interactions_shed_total",
+    "Interactions answered with a busy response as we were overloaded.",
+    ("type",),
+)
+SCHEDULER_EXPIRED = Counter(
+    "crunchy_scheduler_expired_total",
+    "Queued requests dropped as their interaction's deadline had passed.",
+    ("queue",),
+)
+
+QUEUE_WAIT = Histogram(
+    "crunchy_upstream_queue_wait_seconds",
+    "Time spent waiting for a concurrency slot or rate limit bucket.",
+    ("upstream", "route"),
+)
+RATE_LIMITED = Counter(
+    "crunchy_rate_limited_total",
+    "Responses with a 429 status.",
+    ("upstream", "route"),
+)
+RATE_LIMIT_SLEEP = Counter(
+    "crunchy_rate_limit_sleep_seconds_total",
+    "Seconds spent waiting for rate limits to reset after a 429.",
+    ("upstream", "route"),
+)
+
+HEDGED_REQUESTS = Counter(
+    "crunchy_hedged_requests_total",
+    "Slow requests which were hedged by whether the hedge won, or was throttled.",
+    ("upstream", "route", "outcome"),
+)
+
+BREAKER_TRANSITIONS = Counter(
+    "crunchy_circuit_breaker_transitions_total",
+    "Circuit breaker state changes by the state moved to.",
+    ("upstream", "state"),
+)
+BREAKER_REJECTED = Counter(
+    "crunchy_circuit_breaker_rejected_total",
+    "Calls rejected without being made as the circuit was open.",
+    ("upstream",),
+)
+
+HANDLED_ERRORS = Counter(
+    "crunchy_handled_errors_total",
+    "Errors handled by each global error handler.",
+    ("handler",),
+)
+
+LOGS_DROPPED = Counter(
+    "crunchy_logs_dropped_total",
+    "Log records dropped by sampling, rate limiting or a full queue.",
+    ("reason",),
+)
+
+WEBHOOK_DELIVERIES = Counter(
+    "crunchy_webhook_deliveries_total",
+    "Event deliveries to webhooks by whether they were delivered, failed or dead.",
+    ("event", "outcome"),
+)
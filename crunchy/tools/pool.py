@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+import httpx
+
+from crunchy.tools import deadline
+
+_log = logging.getLogger("crunchy-pool")
+
+
+def make_client(
+    max_connections: int,
+    max_keepalive: int,
+    keepalive_expiry: float,
+    connect_timeout: float,
+    timeout: float,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> httpx.AsyncClient:
+    """Makes a HTTP/2 client with the given pool limits and timeouts."""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        transport=transport,
+    )
+
+
+def call_timeout(timeout: httpx.Timeout) -> httpx.Timeout:
+    """
+    The timeout for a single call, this is the client's timeout capped to
+    the time left until the current deadline so a call never outlives it.
+    """
+    left = deadline.remaining()
+    if left is None:
+        return timeout
+
+    left = max(left, 0.001)
+    return httpx.Timeout(
+        connect=_cap(timeout.connect, left),
+        read=_cap(timeout.read, left),
+        write=_cap(timeout.write, left),
+        pool=_cap(timeout.pool, left),
+    )
+
+
+def _cap(value: Optional[float], cap: float) -> float:
+    return cap if value is None else min(value, cap)
+
+
+class KeepWarm:
+    """
+    Opens a connection to a host ahead of time and keeps it open by making
+    a cheap request every `interval` seconds, so interactions don't pay for
+    the TCP, TLS and HTTP/2 handshakes after a deploy or a quiet period.
+
+    This keeps one warm HTTP/2 connection per client, concurrent requests
+    are multiplexed over a single connection so pinging a client more than
+    once at a time wouldn't open any more of them.
+    """
+
+    def __init__(
+        self,
+        clients: List[httpx.AsyncClient],
+        method: str,
+        url: str,
+        interval: float,
+    ):
+        self.clients = clients
+        self.method = method
+        self.url = url
+        self.interval = interval
+
+        self._task: Optional[asyncio.Task] = None
+
+    async def warm(self):
+        """Opens the connections, failures are logged rather than raised."""
+        await asyncio.gather(*(self._ping(client) for client in self.clients))
+
+    def start(self):
+        """Starts keeping the connections alive in the background."""
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.warm()
+            except Exception:
+                # Keep going, a dropped loop would let every connection go cold.
+                _log.exception("failed to keep connections to %s warm", self.url)
+
+    async def _ping(self, client: httpx.AsyncClient):
+        try:
+            await client.request(self.method, self.url)
+        except httpx.HTTPError as e:
+            _log.warning("failed to open a connection to %s: %r", self.url, e)
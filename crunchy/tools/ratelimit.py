@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from roid.http import MaybeUnlock, _parse_rate_limit_header
+
+# Discord scopes rate limits on these top level resources by their id.
+MAJOR_PARAMETER = re.compile(r"/(channels|guilds|webhooks)/(\d+)")
+SNOWFLAKE = re.compile(r"/\d+")
+WEBHOOK_TOKEN = re.compile(r"(/webhooks/\{id}/)[^/?]+")
+
+# Webhooks, including interaction follow ups, are scoped by their id and token.
+WEBHOOK_MAJOR = re.compile(r"/webhooks/(\d+)/([^/?]+)")
+
+# The amount of buckets we keep around before pruning the idle ones.
+MAX_IDLE_BUCKETS = 2048
+
+
+def route_key(method: str, url: str) -> Tuple[str, str]:
+    """
+    Produces the route and major parameter for a given request.
+
+    The route has all of it's ids and tokens replaced with placeholders
+    e.g. `POST /channels/{id}/webhooks` which is combined with the major
+    parameter (channel id, guild id or webhook id) to identify the bucket.
+
+    Every interaction's follow ups share the application's id as their
+    webhook id, so webhook tokens are part of the major parameter too.
+    The token is hashed so it doesn't end up in the bucket stats.
+    """
+    path = httpx.URL(url).path
+
+    match = WEBHOOK_MAJOR.search(path)
+    if match is not None:
+        token = hashlib.sha256(match.group(2).encode()).hexdigest()[:16]
+        major = f"{match.group(1)}:{token}"
+    else:
+        match = MAJOR_PARAMETER.search(path)
+        major = match.group(2) if match is not None else ""
+
+    route = SNOWFLAKE.sub("/{id}", path)
+    route = WEBHOOK_TOKEN.sub(r"\1{token}", route)
+
+    return f"{method} {route}", major
+
+
+class Bucket:
+    """A single Discord rate limit bucket for a given major parameter."""
+
+    def __init__(self, bucket_id: str, route: str, major: str):
+        self.bucket_id = bucket_id
+        self.route = route
+        self.major = major
+        self.lock = asyncio.Lock()
+
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: float = 0.0
+
+        self.requests = 0
+        self.waiting = 0
+        self.wait_time = 0.0
+
+    @property
+    def key(self) -> str:
+        if self.major:
+            return f"{self.bucket_id}:{self.major}"
+        return self.bucket_id
+
+    @property
+    def idle(self) -> bool:
+        return (
+            not self.lock.locked()
+            and self.waiting == 0
+            and self.reset_at <= time.monotonic()
+        )
+
+    def update(self, r: httpx.Response):
+        """Updates the bucket from the response rate limit headers."""
+        limit = r.headers.get("X-Ratelimit-Limit")
+        if limit is not None:
+            self.limit = int(limit)
+
+        remaining = r.headers.get("X-Ratelimit-Remaining")
+        if remaining is not None:
+            self.remaining = int(remaining)
+
+        if "X-Ratelimit-Reset-After" in r.headers or "X-Ratelimit-Reset" in r.headers:
+            self.reset_at = time.monotonic() + _parse_rate_limit_header(r)
+
+    async def acquire(self) -> MaybeUnlock:
+        """
+        Waits for the bucket to become free, returning a `MaybeUnlock`
+        which releases the bucket on exit unless deferred.
+        """
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.lock.acquire()
+        finally:
+            self.waiting -= 1
+            self.wait_time += time.monotonic() - start
+
+        self.requests += 1
+        return MaybeUnlock(self.lock)
+
+    def stats(self) -> dict:
+        return {
+            "key": self.key,
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset_in": max(self.reset_at - time.monotonic(), 0.0),
+            "locked": self.lock.locked(),
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "wait_time": self.wait_time,
+        }
+
+
+class BucketMap:
+    """
+    Tracks Discord's rate limit buckets per route and major parameter,
+    alongside the global rate limit.
+
+    Discord only tells us which bucket a route belongs to once we've made
+    a request to it so routes are keyed by the route itself until the
+    `X-Ratelimit-Bucket` header is seen.
+    """
+
+    def __init__(self):
+        self._route_buckets: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[str, str], Bucket] = {}
+
+        # Grows with the buckets still in use after pruning, so many busy
+        # buckets e.g. during a fan-out don't cause a prune on every miss.
+        self._prune_at = MAX_IDLE_BUCKETS
+
+        self._global = asyncio.Event()
+        self._global.set()
+        self.global_wait_time = 0.0
+        self.global_limited_count = 0
+
+    def get(self, method: str, url: str) -> Bucket:
+        """Gets the bucket for the given request."""
+        route, major = route_key(method, url)
+        bucket_id = self._route_buckets.get(route, route)
+
+        key = (bucket_id, major)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune()
+                self._prune_at = max(MAX_IDLE_BUCKETS, len(self._buckets) * 2)
+
+            bucket = Bucket(bucket_id, route, major)
+            self._buckets[key] = bucket
+
+        return bucket
+
+    def learn(self, bucket: Bucket, r: httpx.Response):
+        """
+        Records which Discord bucket a route belongs to, moving the
+        given bucket over to it if it was only known by it's route.
+        """
+        bucket_id = r.headers.get("X-Ratelimit-Bucket")
+        if bucket_id is None or bucket_id == bucket.bucket_id:
+            return
+
+        self._route_buckets[bucket.route] = bucket_id
+
+        key = (bucket_id, bucket.major)
+        if key in self._buckets:
+            return
+
+        if self._buckets.get((bucket.bucket_id, bucket.major)) is bucket:
+            del self._buckets[(bucket.bucket_id, bucket.major)]
+
+        bucket.bucket_id = bucket_id
+        self._buckets[key] = bucket
+
+    def _prune(self):
+        for key, bucket in list(self._buckets.items()):
+            if bucket.idle:
+                del self._buckets[key]
+
+    async def wait_global(self):
+        """Waits for the global rate limit to be lifted if it has been hit."""
+        if self._global.is_set():
+            return
+
+        start = time.monotonic()
+        await self._global.wait()
+        self.global_wait_time += time.monotonic() - start
+
+    def set_global(self, retry_after: float):
+        """Holds back every request until the global rate limit is lifted."""
+        if not self._global.is_set():
+            return
+
+        self.global_limited_count += 1
+        self._global.clear()
+        asyncio.get_running_loop().call_later(retry_after, self._global.set)
+
+    def stats(self) -> dict:
+        """
+        A snapshot of the current buckets, how full they are and how long
+        requests have spent waiting on them.
+        """
+        buckets = [bucket.stats() for bucket in self._buckets.values()]
+        return {
+            "global_limited": not self._global.is_set(),
+            "global_limited_count": self.global_limited_count,
+            "global_wait_time": self.global_wait_time,
+            "bucket_count": len(buckets),
+            "bucket_wait_time": sum(b["wait_time"] for b in buckets),
+            "buckets": buckets,
+        }
@@ -0,0 +1,302 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from crunchy.tools import deadline, metrics
+
+_log = logging.getLogger("crunchy-scheduler")
+
+# The priority of requests made for each kind of work, lower goes first.
+AUTOCOMPLETE = 0
+INTERACTION = 1
+BACKGROUND = 2
+
+# Work started outside of an interaction e.g. refreshing caches is background.
+_priority: ContextVar[int] = ContextVar("crunchy_priority", default=BACKGROUND)
+
+# Set for work done on behalf of several callers, see `SharedPriority`.
+_shared: ContextVar[Optional["SharedPriority"]] = ContextVar(
+    "crunchy_shared_priority", default=None
+)
+
+# Ordered most specific first, the first matching prefix wins.
+ROUTE_FAMILIES = (
+    "data/anime/search",
+    "data/manga/search",
+    "data/anime",
+    "data/manga",
+    "tracking",
+    "events",
+)
+DEFAULT_FAMILY = "default"
+ALL_FAMILIES = ROUTE_FAMILIES + (DEFAULT_FAMILY,)
+
+
+def route_family(section: str) -> str:
+    """
+    Maps a API section e.g. `/data/anime/1234` to the family of routes
+    it belongs to e.g. `data/anime`.
+
+    Sections which don't belong to any known family are grouped under
+    `default`.
+    """
+    section = section.strip("/")
+    for family in ROUTE_FAMILIES:
+        if section == family or section.startswith(f"{family}/"):
+            return family
+    return DEFAULT_FAMILY
+
+
+@contextmanager
+def priority(level: int):
+    """
+    Sets the priority of any requests made within the context, including
+    any tasks created within it.
+    """
+    token = _priority.set(level)
+    shared_token = _shared.set(None)
+    try:
+        yield
+    finally:
+        _shared.reset(shared_token)
+        _priority.reset(token)
+
+
+@contextmanager
+def shared_priority() -> Iterator["SharedPriority"]:
+    """
+    Sets the priority of any requests made within the context, including
+    any tasks created within it, to a `SharedPriority` starting at the
+    current priority.
+    """
+    shared = SharedPriority(current_priority())
+    token = _shared.set(shared)
+    try:
+        yield shared
+    finally:
+        _shared.reset(token)
+
+
+def current_priority() -> int:
+    shared = _shared.get()
+    if shared is not None:
+        return shared.level
+    return _priority.get()
+
+
+class SharedPriority:
+    """
+    The priority of work done on behalf of several callers e.g. a coalesced
+    request, which is the most urgent of their priorities.
+
+    The priority is raised as more urgent callers join, including for any
+    request of the work which is already queued.
+    """
+
+    def __init__(self, level: int):
+        self.level = level
+        self._queued: List[Tuple["PrioritySemaphore", list]] = []
+
+    def join(self, level: int):
+        if level >= self.level:
+            return
+
+        self.level = level
+        for semaphore, entry in self._queued:
+            semaphore._reprioritise(entry, level)
+
+
+class PrioritySemaphore:
+    """
+    A semaphore which hands out free slots by priority and then by deadline
+    rather than in the order they were asked for.
+
+    Waiters whose deadline passes while they're queued give up their place
+    and raise `DeadlineExceeded`, as their response would be thrown away.
+    """
+
+    def __init__(self, value: int, name: str):
+        self.name = name
+        self._value = value
+        self._waiters: List[list] = []
+        self._counter = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+
+        left = deadline.remaining()
+        if left is not None and left <= 0:
+            metrics.SCHEDULER_EXPIRED.labels(self.name).inc()
+            raise deadline.DeadlineExceeded("the deadline passed before being queued")
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        at = math.inf if left is None else loop.time() + left
+        entry = [current_priority(), at, next(self._counter), waiter]
+        heapq.heappush(self._waiters, entry)
+
+        shared = _shared.get()
+        if shared is not None:
+            shared._queued.append((self, entry))
+
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), left)
+                    break
+                except asyncio.TimeoutError:
+                    # A shared deadline may have been pushed back meanwhile.
+                    left = deadline.remaining()
+                    if left is not None and left <= 0:
+                        raise
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed the slot just as we gave up on it.
+                self.release()
+            else:
+                waiter.cancel()
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.SCHEDULER_EXPIRED.labels(self.name).inc()
+                raise deadline.DeadlineExceeded(
+                    "the deadline passed while queued"
+                ) from None
+            raise
+        finally:
+            if shared is not None:
+                shared._queued.remove((self, entry))
+
+    def _reprioritise(self, entry: list, level: int):
+        if entry in self._waiters:
+            entry[0] = level
+            heapq.heapify(self._waiters)
+
+    def release(self):
+        while self._waiters:
+            *_, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self._value += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *_):
+        self.release()
+
+
+class RouteQueue:
+    """A concurrency limited queue for a single family of routes."""
+
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.semaphore = PrioritySemaphore(concurrency, name)
+        self.resume_at: float = 0.0
+
+    def pause(self, delay: float):
+        """Stops any new requests going out on this route for `delay` seconds."""
+        loop = asyncio.get_running_loop()
+        self.resume_at = max(self.resume_at, loop.time() + delay)
+
+    async def wait_until_resumed(self):
+        loop = asyncio.get_running_loop()
+        delta = self.resume_at - loop.time()
+        while delta > 0:
+            await asyncio.sleep(delta)
+            delta = self.resume_at - loop.time()
+
+
+class RequestScheduler:
+    """
+    Limits the amount of concurrent requests both overall and per family
+    of routes.
+
+    Unlike a single lock this lets independent requests run in parallel
+    and only pauses the family of routes which got rate limited. Queued
+    requests are let through most urgent first, see `PrioritySemaphore`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        route_concurrency: int,
+        max_queued: int = 0,
+    ):
+        """
+        Args:
+            max_concurrency:
+                The maximum amount of in flight requests across all routes.
+
+            route_concurrency:
+                The maximum amount of in flight requests for any one
+                family of routes.
+
+            max_queued:
+                The amount of queued requests past which we're overloaded,
+                0 means there's no limit.
+        """
+        self.max_queued = max_queued
+        self._global = PrioritySemaphore(max_concurrency, "global")
+        self._route_concurrency = route_concurrency
+        self._routes: Dict[str, RouteQueue] = {}
+
+    def route(self, family: str) -> RouteQueue:
+        route = self._routes.get(family)
+        if route is None:
+            route = RouteQueue(family, self._route_concurrency)
+            self._routes[family] = route
+        return route
+
+    def queued(self) -> int:
+        """The amount of requests waiting for a slot."""
+        return self._global.waiting + sum(
+            route.semaphore.waiting for route in self._routes.values()
+        )
+
+    def overloaded(self) -> bool:
+        """
+        If so many requests are queued that new interactions should be
+        turned away rather than adding to the queue.
+        """
+        return self.max_queued > 0 and self.queued() >= self.max_queued
+
+    @asynccontextmanager
+    async def slot(self, family: str):
+        """
+        Waits for a free slot on the given route family, holding it for
+        the lifetime of the context.
+        """
+        route = self.route(family)
+
+        await route.wait_until_resumed()
+        async with route.semaphore:
+            # We may have been paused while queued behind other requests.
+            await route.wait_until_resumed()
+            async with self._global:
+                yield
+
+    def pause(self, family: str, delay: float):
+        """Pauses a single family of routes for `delay` seconds."""
+        _log.debug("pausing route family %r for %.2f seconds", family, delay)
+        self.route(family).pause(delay)
+
+    def pause_all(self, delay: float):
+        """Pauses every family of routes for `delay` seconds."""
+        for family in ALL_FAMILIES:
+            self.pause(family, delay)
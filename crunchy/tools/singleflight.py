@@ -0,0 +1,108 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from crunchy.tools import deadline, scheduler
+
+
+class SingleFlight:
+    """
+    Merges concurrent calls for the same key into a single call.
+
+    The first caller for a key starts the call and every caller which comes
+    along before it completes waits on that call instead, all of them getting
+    the same result or the same error.
+
+    The call isn't made on behalf of any one caller, so it runs with the
+    latest deadline and the most urgent priority of the callers waiting on
+    it. Each caller only waits on it until their own deadline passes.
+
+    If every caller waiting on a call is cancelled or gives up the call is
+    cancelled too, as there's no one left to use the result, and
+    `on_abandoned` is called with its key.
+    """
+
+    def __init__(self, on_abandoned: Optional[Callable[[Hashable], None]] = None):
+        self.on_abandoned = on_abandoned
+
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._shared: Dict[
+            asyncio.Future,
+            Tuple[deadline.SharedDeadline, scheduler.SharedPriority],
+        ] = {}
+
+        self.calls = 0
+        self.saved = 0
+        self.abandoned = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Calls `func` unless a call for the key is already in flight,
+        in which case the result of that call is returned instead.
+
+        The call runs as it's own task so a caller being cancelled does not
+        cancel the call for everyone else waiting on it.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.saved += 1
+            shared_deadline, shared_priority = self._shared[task]
+            shared_deadline.join(deadline.current())
+            shared_priority.join(scheduler.current_priority())
+        else:
+            self.calls += 1
+            with deadline.shared() as shared_deadline:
+                with scheduler.shared_priority() as shared_priority:
+                    task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            self._shared[task] = (shared_deadline, shared_priority)
+            task.add_done_callback(lambda t: self._done(key, t))
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), deadline.remaining())
+        except BaseException as e:
+            timed_out = isinstance(e, asyncio.TimeoutError) and not task.done()
+
+            if not task.done() and self._waiters.get(task) == 1:
+                self.abandoned += 1
+                task.cancel()
+
+                # Later callers shouldn't wait on the cancelled call.
+                if self._calls.get(key) is task:
+                    del self._calls[key]
+                if self.on_abandoned is not None:
+                    self.on_abandoned(key)
+
+            if timed_out:
+                raise deadline.DeadlineExceeded(
+                    "the deadline passed while waiting on a shared call"
+                ) from None
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        self._waiters.pop(task, None)
+        self._shared.pop(task, None)
+
+        # Marks the error as retrieved in case every caller has gone away.
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "saved": self.saved,
+            "abandoned": self.abandoned,
+            "inflight": len(self._calls),
+        }
@@ -0,0 +1,257 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from crunchy import config
+from crunchy.tools import deadline, scheduler
+from crunchy.tools.api import CrunchyApi, CrunchyApiHTTPException
+from crunchy.tools.scheduler import RequestScheduler
+
+
+def make_api(handler) -> CrunchyApi:
+    api = CrunchyApi("token")
+    api.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return api
+
+
+def test_identical_gets_are_coalesced():
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(str(request.url))
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"data": {"id": 1}})
+
+    async def run():
+        api = make_api(handler)
+        results = await asyncio.gather(
+            *(api.request("GET", "data/anime/1") for _ in range(10)),
+            api.request("GET", "data/anime/2"),
+        )
+        await api.shutdown()
+        return api, results
+
+    api, results = asyncio.run(run())
+    assert len(calls) == 2
+    assert all(r == {"data": {"id": 1}} for r in results)
+    assert api.flights.saved == 9
+
+
+def test_errors_are_passed_to_every_waiter():
+    calls = 0
+
+    async def handler(request: httpx.Request):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return httpx.Response(404, json={"detail": "not found"})
+
+    async def run():
+        api = make_api(handler)
+        results = await asyncio.gather(
+            *(api.request("GET", "data/anime/1") for _ in range(5)),
+            return_exceptions=True,
+        )
+        await api.shutdown()
+        return results
+
+    results = asyncio.run(run())
+    assert calls == 1
+    assert len(results) == 5
+    assert all(isinstance(r, CrunchyApiHTTPException) for r in results)
+
+
+def test_rate_limited_requests_are_retried():
+    from bench.simulator import Faults, Simulator
+    from bench.stubs import CrunchyApiStub
+
+    simulator = Simulator(
+        CrunchyApiStub(catalogue_size=5),
+        Faults(rate_limit=2, rate_limit_window=0.05),
+    )
+
+    async def run():
+        api = make_api(simulator.handle)
+        results = await asyncio.gather(
+            *(api.request("GET", f"data/anime/anime-{i}") for i in range(5))
+        )
+        await api.shutdown()
+        return results
+
+    results = asyncio.run(run())
+    assert [r["data"]["id"] for r in results] == [f"anime-{i}" for i in range(5)]
+    assert simulator.outcomes["200"] == 5
+    assert simulator.outcomes["429"] > 0
+
+
+def test_slow_requests_are_hedged():
+    slow = {"data/anime/slow"}
+
+    async def handler(request: httpx.Request):
+        section = request.url.path.split("/", 2)[2]
+        if section in slow:
+            # Only the first attempt is slow, the hedge answers straight away.
+            slow.discard(section)
+            await asyncio.sleep(5)
+        return httpx.Response(200, json={"data": section})
+
+    async def run():
+        api = CrunchyApi("token", transport=httpx.MockTransport(handler))
+        for i in range(20):
+            await api.request("GET", f"data/anime/{i}", hedge=True)
+
+        started_at = time.perf_counter()
+        result = await api.request("GET", "data/anime/slow", hedge=True)
+        elapsed = time.perf_counter() - started_at
+
+        await api.shutdown()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(run())
+    assert result == {"data": "data/anime/slow"}
+    assert elapsed < 1
+
+
+def test_abandoned_gets_are_cancelled():
+    started = []
+    cancelled = []
+
+    async def handler(request: httpx.Request):
+        started.append(request.url.path)
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(request.url.path)
+            raise
+        return httpx.Response(200, json={"data": {}})
+
+    async def run():
+        api = make_api(handler)
+        api.scheduler = RequestScheduler(max_concurrency=1, route_concurrency=1)
+
+        alone = asyncio.ensure_future(api.request("GET", "data/anime/1"))
+        await asyncio.sleep(0.01)
+        alone.cancel()
+        await asyncio.sleep(0.01)
+
+        # The slot was freed so this isn't stuck behind the cancelled call.
+        shared = [
+            asyncio.ensure_future(api.request("GET", "data/anime/2")) for _ in range(2)
+        ]
+        await asyncio.sleep(0.01)
+        shared[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not shared[1].done()
+        shared[1].cancel()
+        await asyncio.sleep(0.01)
+
+        await api.shutdown()
+        return api
+
+    api = asyncio.run(run())
+    assert cancelled == ["/v0/data/anime/1", "/v0/data/anime/2"]
+    assert api.flights.abandoned == 2
+
+
+def test_coalesced_gets_use_the_loosest_deadline_and_most_urgent_priority():
+    order = []
+
+    def handler(request: httpx.Request):
+        order.append(request.url.path)
+        return httpx.Response(200, json={"data": request.url.path})
+
+    async def run():
+        api = make_api(handler)
+        api.scheduler = RequestScheduler(max_concurrency=1, route_concurrency=1)
+
+        async def get(section, level, timeout):
+            with scheduler.priority(level), deadline.deadline(timeout):
+                return await api.request("GET", section)
+
+        async with api.scheduler.slot("data/anime"):
+            background = asyncio.ensure_future(
+                get("data/anime/1", scheduler.BACKGROUND, 60)
+            )
+            other = asyncio.ensure_future(
+                get("data/anime/2", scheduler.INTERACTION, 60)
+            )
+            await asyncio.sleep(0.01)
+
+            # Joining the background call makes it the most urgent queued.
+            joined = asyncio.ensure_future(
+                get("data/anime/1", scheduler.AUTOCOMPLETE, 0.05)
+            )
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(background, other, joined)
+
+        # The first caller's deadline doesn't fail those who can wait longer.
+        async with api.scheduler.slot("data/anime"):
+            with deadline.deadline(0.02):
+                tight = asyncio.ensure_future(api.request("GET", "data/anime/3"))
+            await asyncio.sleep(0.01)
+
+            with deadline.deadline(60):
+                loose = asyncio.ensure_future(api.request("GET", "data/anime/3"))
+            await asyncio.sleep(0.05)
+
+        with pytest.raises(deadline.DeadlineExceeded):
+            await tight
+        assert await loose == {"data": "/v0/data/anime/3"}
+
+        await api.shutdown()
+
+    asyncio.run(run())
+    assert order[:2] == ["/v0/data/anime/1", "/v0/data/anime/2"]
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.configured = {}
+        self.acquired = []
+        self.drained = []
+
+    def configure(self, name: str, rate: float, capacity: int):
+        self.configured[name] = rate
+
+    async def acquire(self, name: str):
+        self.acquired.append(name)
+
+    async def drain(self, name: str, delay: float):
+        self.drained.append(name)
+
+
+def test_every_family_shares_the_global_bucket():
+    responses = [
+        httpx.Response(429, json={"retry_after": 0}, headers={"Via": "1.1 api"}),
+        httpx.Response(
+            429, json={"retry_after": 0, "global": True}, headers={"Via": "1.1 api"}
+        ),
+    ]
+
+    def handler(request: httpx.Request):
+        if responses:
+            return responses.pop(0)
+        return httpx.Response(200, json={"data": None})
+
+    limiter = RecordingLimiter()
+
+    async def run():
+        api = CrunchyApi(
+            "token", limiter=limiter, transport=httpx.MockTransport(handler)
+        )
+        await api.request("GET", "data/anime/1")
+        await api.request("GET", "tracking/1/watchlist")
+        await api.shutdown()
+
+    asyncio.run(run())
+    assert set(limiter.configured.values()) == {config.CRUNCHY_API_RATE_LIMIT}
+    assert "crunchy-api:global" in limiter.configured
+    assert limiter.acquired == [
+        "crunchy-api:data/anime",
+        "crunchy-api:global",
+    ] * 3 + ["crunchy-api:tracking", "crunchy-api:global"]
+    # A global limit only holds back the global bucket.
+    assert limiter.drained == ["crunchy-api:data/anime", "crunchy-api:global"]
@@ -0,0 +1,117 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+from roid.interactions import Interaction
+from roid.objects import ResponseType
+
+from bench.payloads import PayloadFactory
+from crunchy import app, config, global_error_handlers
+from crunchy.tools import cache
+from crunchy.tools.api import CrunchyApi
+from crunchy.tools.breaker import CircuitOpen
+from crunchy.tools.http import HttpHandler
+from crunchy.tools.metrics import HANDLED_ERRORS
+
+AUTOCOMPLETE_RESULT = 8
+
+
+def rate_limited(request: httpx.Request):
+    return httpx.Response(
+        429,
+        json={"retry_after": 5, "global": False},
+        headers={"Via": "1.1 google"},
+    )
+
+
+@pytest.mark.parametrize("upstream", ["rate_limited", "circuit_open"])
+@pytest.mark.parametrize("command,option", [("anime", "query"), ("my-list", "group")])
+def test_failed_autocomplete_has_no_choices(upstream, command, option):
+    payload = PayloadFactory().autocomplete(command, option, "att", user_id=1)
+    interaction = Interaction(**payload)
+
+    async def run():
+        app.client = CrunchyApi("token")
+        app.client.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(rate_limited)
+        )
+        if upstream == "circuit_open":
+            app.client.breaker._open()  # noqa
+        app.search_cache = cache.TTLCache(maxsize=16, ttl=60)
+        app.tracking_tags = cache.TTLCache(maxsize=16, ttl=60)
+
+        try:
+            return await app._invoke_with_handlers(  # noqa
+                app._commands[command],  # noqa
+                interaction,
+                ResponseType.CHANNEL_MESSAGE_WITH_SOURCE,
+                pass_parent=True,
+            )
+        finally:
+            await app.client.shutdown()
+            app.client = app.search_cache = app.tracking_tags = None
+
+    resp = asyncio.run(run())
+    assert resp.type == AUTOCOMPLETE_RESULT
+    assert resp.data.choices == []
+
+
+def test_deferred_errors_are_handled():
+    sent = []
+
+    def discord(request: httpx.Request):
+        sent.append((request.method, orjson.loads(request.content or b"null")))
+        return httpx.Response(200, json={})
+
+    async def fail():
+        raise KeyError("oops")
+
+    async def run():
+        app.http = HttpHandler("token", transport=httpx.MockTransport(discord))
+        task = asyncio.ensure_future(fail())
+        try:
+            await app._follow_up(interaction, task, is_component=False)  # noqa
+        finally:
+            await app.http.shutdown()
+            app.http = None
+
+    interaction = Interaction(
+        **PayloadFactory().slash_command("anime", {"query": "1"}, user_id=1)
+    )
+    handled = HANDLED_ERRORS.labels("on_unhandled_error").value
+    asyncio.run(run())
+
+    # The deferred message is public so the ephemeral error is sent separately.
+    assert [method for method, _ in sent] == ["DELETE", "POST"]
+    assert sent[1][1]["content"] == global_error_handlers.SOMETHING_WENT_WRONG
+    assert HANDLED_ERRORS.labels("on_unhandled_error").value == handled + 1
+
+
+@pytest.mark.parametrize(
+    "token,authorization,status",
+    [
+        (None, "Bearer ", 401),
+        ("secret", None, 401),
+        ("secret", "Bearer wrong", 401),
+        ("secret", "Bearer secret", 200),
+    ],
+)
+def test_metrics_need_the_token(monkeypatch, token, authorization, status):
+    monkeypatch.setattr(config, "METRICS_TOKEN", token)
+
+    resp = asyncio.run(app.render_metrics(authorization))
+    assert resp.status_code == status
+
+
+@pytest.mark.parametrize(
+    "upstream,content",
+    [
+        ("discord", global_error_handlers.DISCORD_ISSUES),
+        ("discord-webhooks", global_error_handlers.DISCORD_ISSUES),
+        ("crunchy", global_error_handlers.CRUNCHY_API_ISSUES),
+    ],
+)
+def test_open_circuits_blame_the_right_upstream(upstream, content):
+    resp = global_error_handlers.on_circuit_open(CircuitOpen(upstream, 1))
+    assert resp.data.content == content
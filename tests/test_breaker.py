@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+
+from crunchy.tools.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Backoff,
+    CircuitBreaker,
+    CircuitOpen,
+)
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "test",
+        failure_rate=0.5,
+        min_calls=4,
+        window=10,
+        slow_call=1,
+        open_for=0.01,
+        max_open_for=0.05,
+    )
+
+
+def call(breaker: CircuitBreaker, failed: bool):
+    with breaker.attempt() as attempt:
+        attempt.failed = failed
+
+
+def test_opens_once_enough_calls_fail():
+    breaker = make_breaker()
+
+    for failed in (False, True, False):
+        call(breaker, failed)
+    assert breaker.state == CLOSED
+
+    call(breaker, True)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpen):
+        call(breaker, False)
+    assert breaker.rejected == 1
+
+
+def test_exceptions_count_as_failures():
+    breaker = make_breaker()
+
+    for _ in range(4):
+        with pytest.raises(OSError):
+            with breaker.attempt():
+                raise OSError("connection reset")
+
+    assert breaker.state == OPEN
+
+
+def test_half_open_probe_decides_the_state():
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, True)
+
+    time.sleep(0.06)
+    with breaker.attempt():
+        assert breaker.state == HALF_OPEN
+
+        # Only the single probe is let through.
+        with pytest.raises(CircuitOpen):
+            breaker.check()
+
+    assert breaker.state == CLOSED
+
+    for _ in range(4):
+        call(breaker, True)
+    time.sleep(0.06)
+    call(breaker, True)
+    assert breaker.state == OPEN
+
+
+def test_cancelled_calls_are_not_counted():
+    breaker = make_breaker()
+    breaker.slow_call = 0
+
+    for _ in range(4):
+        with pytest.raises(asyncio.CancelledError):
+            with breaker.attempt():
+                raise asyncio.CancelledError()
+
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 0
+
+    for _ in range(4):
+        call(breaker, True)
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    breaker.check()
+    assert breaker.state == HALF_OPEN
+
+    # A cancelled probe says nothing either way, so the next call probes.
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.attempt():
+            raise asyncio.CancelledError()
+    assert breaker.state == HALF_OPEN
+
+    breaker.slow_call = 1
+    call(breaker, False)
+    assert breaker.state == CLOSED
+
+
+def test_backoff_stays_within_bounds():
+    backoff = Backoff(0.1, 2)
+    delays = [backoff.next() for _ in range(100)]
+    assert all(0.1 <= delay <= 2 for delay in delays)
+
+    backoff.reset()
+    assert backoff.next() <= 0.3
@@ -0,0 +1,91 @@
+import asyncio
+
+from crunchy.tools.cache import TTLCache
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_expiry():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0)
+    assert cache.get("a") is None
+    assert cache.misses == 1
+
+
+def test_concurrent_loads_are_coalesced():
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        cache = TTLCache(maxsize=8, ttl=60)
+        results = await asyncio.gather(
+            *(cache.get_or_load("key", load) for _ in range(10))
+        )
+        assert results == ["value"] * 10
+        assert await cache.get_or_load("key", load) == "value"
+        return cache
+
+    cache = asyncio.run(run())
+    assert calls == 1
+    assert cache.coalesced == 9
+    assert cache.hits == 1
+
+
+def test_invalidate_if():
+    cache = TTLCache(maxsize=8, ttl=60)
+    cache.set((1, "a"), 1)
+    cache.set((1, "b"), 2)
+    cache.set((2, "a"), 3)
+
+    cache.invalidate_if(lambda key: key[0] == 1)
+    assert len(cache) == 1
+    assert cache.get((2, "a")) == 3
+
+
+def test_loads_invalidated_midway_are_not_cached():
+    version = 0
+    started = None
+
+    async def load():
+        loaded = version
+        started.set()
+        await asyncio.sleep(0.01)
+        return loaded
+
+    async def run():
+        nonlocal version, started
+        cache = TTLCache(maxsize=8, ttl=60)
+        for invalidate in (
+            lambda: cache.invalidate((1, "tags")),
+            lambda: cache.invalidate_if(lambda key: key[0] == 1),
+            cache.clear,
+        ):
+            started = asyncio.Event()
+            loading = asyncio.ensure_future(cache.get_or_load((1, "tags"), load))
+            await started.wait()
+
+            # A write lands while the old value is being loaded.
+            version += 1
+            invalidate()
+
+            assert await loading == version - 1
+            assert await cache.get_or_load((1, "tags"), load) == version
+            cache.clear()
+
+    asyncio.run(run())
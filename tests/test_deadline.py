@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+
+from crunchy.tools import deadline
+
+
+def test_deadline_is_inherited_by_tasks():
+    async def work():
+        deadline.check(0.5)
+        deadline.check(5)
+
+    async def run():
+        assert deadline.remaining() is None
+        with deadline.deadline(1):
+            task = asyncio.ensure_future(work())
+        assert deadline.remaining() is None
+        await task
+
+    with pytest.raises(deadline.DeadlineExceeded):
+        asyncio.run(run())
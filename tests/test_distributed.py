@@ -0,0 +1,216 @@
+import asyncio
+import time
+import uuid
+
+import aioredis
+import pytest
+
+from crunchy import config
+from crunchy.tools.distributed import RedisLock, SharedRateLimiter
+
+
+@pytest.fixture
+def redis_options():
+    """Connects to the configured Redis, skipping the test if there isn't one."""
+    options = {
+        "host": config.REDIS_HOST,
+        "port": config.REDIS_PORT,
+        "db": config.REDIS_DB,
+    }
+
+    async def ping():
+        redis = aioredis.Redis(**options)
+        try:
+            await redis.ping()
+        finally:
+            await redis.close()
+
+    try:
+        asyncio.run(ping())
+    except (aioredis.RedisError, OSError):
+        pytest.skip("no redis server available")
+
+    return options
+
+
+@pytest.fixture
+def prefix(redis_options):
+    """A prefix only used by this test, every key under it is removed after."""
+    prefix = f"crunchy-test:{uuid.uuid4().hex}"
+    yield prefix
+
+    async def cleanup():
+        redis = aioredis.Redis(**redis_options)
+        try:
+            keys = await redis.keys(f"{prefix}*")
+            if keys:
+                await redis.delete(*keys)
+        finally:
+            await redis.close()
+
+    asyncio.run(cleanup())
+
+
+def make_limiter(redis_options, prefix, **extra) -> SharedRateLimiter:
+    limiter = SharedRateLimiter(aioredis.Redis(**redis_options), prefix, **extra)
+    limiter.configure("global", rate=20, capacity=5)
+    return limiter
+
+
+def test_tokens_are_leased_and_spent_locally(redis_options, prefix):
+    async def run():
+        limiter = make_limiter(redis_options, prefix, lease_size=5)
+        try:
+            for _ in range(5):
+                await limiter.acquire("global")
+            assert (limiter.redis_calls, limiter.local_hits) == (1, 5)
+
+            # The bucket is empty so the next token is waited for.
+            start = time.monotonic()
+            await limiter.acquire("global")
+            waited = time.monotonic() - start
+        finally:
+            await limiter.shutdown()
+
+        return limiter, waited
+
+    limiter, waited = asyncio.run(run())
+    assert 0.03 <= waited < 0.5
+    assert limiter.wait_time > 0
+
+
+def test_buckets_are_shared_between_processes(redis_options, prefix):
+    async def run():
+        first = make_limiter(redis_options, prefix, lease_size=5)
+        second = make_limiter(redis_options, prefix, lease_size=5)
+        try:
+            await first.acquire("global")
+
+            # The first process leased the whole capacity.
+            start = time.monotonic()
+            await second.acquire("global")
+            return time.monotonic() - start
+        finally:
+            await first.shutdown()
+            await second.shutdown()
+
+    assert asyncio.run(run()) >= 0.03
+
+
+def test_expired_leases_are_thrown_away(redis_options, prefix):
+    async def run():
+        limiter = make_limiter(redis_options, prefix, lease_size=5, lease_ttl=0.01)
+        try:
+            await limiter.acquire("global")
+            await asyncio.sleep(0.02)
+            await limiter.acquire("global")
+        finally:
+            await limiter.shutdown()
+        return limiter
+
+    # The second token came from Redis rather than the expired lease, which
+    # had to wait for the bucket to refill as the lease took all of it.
+    limiter = asyncio.run(run())
+    assert limiter.redis_calls == 3
+    assert limiter.wait_time > 0
+
+
+def test_drained_buckets_hold_back_every_process(redis_options, prefix):
+    async def run():
+        first = make_limiter(redis_options, prefix, lease_size=5)
+        second = make_limiter(redis_options, prefix, lease_size=5)
+        try:
+            await second.acquire("global")
+            await first.drain("global", 0.2)
+
+            start = time.monotonic()
+            await second.acquire("global")
+            return time.monotonic() - start
+        finally:
+            await first.shutdown()
+            await second.shutdown()
+
+    # The leased tokens are kept by the other process until they expire.
+    assert asyncio.run(run()) < 0.05
+
+    async def run_after_lease():
+        limiter = make_limiter(redis_options, prefix, lease_size=1)
+        try:
+            await limiter.drain("global", 0.2)
+
+            start = time.monotonic()
+            await limiter.acquire("global")
+            return time.monotonic() - start
+        finally:
+            await limiter.shutdown()
+
+    assert asyncio.run(run_after_lease()) >= 0.15
+
+
+def test_unconfigured_and_unreachable_buckets_are_not_limited():
+    async def run():
+        limiter = SharedRateLimiter(aioredis.Redis(port=1))
+        await limiter.acquire("unknown")
+        assert limiter.redis_calls == 0
+
+        limiter.configure("global", rate=1, capacity=1)
+        await limiter.acquire("global")
+        await limiter.drain("global", 1)
+        assert limiter.redis_calls == 1
+        await limiter.shutdown()
+
+    asyncio.run(run())
+
+
+def test_lock_is_exclusive(redis_options, prefix):
+    async def run():
+        first = RedisLock(aioredis.Redis(**redis_options), f"{prefix}:lock", ttl=5)
+        second = RedisLock(
+            aioredis.Redis(**redis_options),
+            f"{prefix}:lock",
+            ttl=5,
+            poll_interval=0.01,
+        )
+
+        await first.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await second.acquire(timeout=0.05)
+
+        # Only whoever holds the lock can release it.
+        await second.release()
+        with pytest.raises(asyncio.TimeoutError):
+            await second.acquire(timeout=0.05)
+
+        await first.release()
+        async with second:
+            with pytest.raises(asyncio.TimeoutError):
+                await first.acquire(timeout=0)
+
+        await first._redis.close()  # noqa
+        await second._redis.close()  # noqa
+
+    asyncio.run(run())
+
+
+def test_lock_expires_if_never_released(redis_options, prefix):
+    async def run():
+        dead = RedisLock(aioredis.Redis(**redis_options), f"{prefix}:lock", ttl=0.05)
+        lock = RedisLock(
+            aioredis.Redis(**redis_options),
+            f"{prefix}:lock",
+            ttl=5,
+            poll_interval=0.01,
+        )
+
+        await dead.acquire()
+        await lock.acquire(timeout=1)
+
+        # The expired holder can't release the new holder's lock.
+        await dead.release()
+        assert await lock._redis.get(f"{prefix}:lock") is not None  # noqa
+
+        await lock.release()
+        await dead._redis.close()  # noqa
+        await lock._redis.close()  # noqa
+
+    asyncio.run(run())
@@ -0,0 +1,121 @@
+import asyncio
+
+import httpx
+
+from crunchy.tools.api import CrunchyApi
+from crunchy.tools.entities import EntityCache
+
+
+def make_cache(handler, ttl: float = 60, **extra) -> EntityCache:
+    client = CrunchyApi("token")
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return EntityCache(
+        client,
+        maxsize=8,
+        ttls={"anime": ttl, "manga": ttl},
+        stale_ttl=60,
+        negative_ttl=60,
+        **extra,
+    )
+
+
+def test_repeat_and_missing_lookups_are_cached():
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        if request.url.path.endswith("/1"):
+            return httpx.Response(200, json={"data": {"id": 1}})
+        return httpx.Response(404, json={"detail": "not found"})
+
+    async def run():
+        cache = make_cache(handler)
+        for _ in range(3):
+            assert await cache.get("anime", "1") == {"id": 1}
+            assert await cache.get("anime", "2") is None
+        await cache.client.shutdown()
+        return cache
+
+    cache = asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.negative_hits == 3
+
+
+def test_stale_entities_are_served_while_refreshing():
+    version = 0
+
+    def handler(request: httpx.Request):
+        nonlocal version
+        version += 1
+        return httpx.Response(200, json={"data": {"id": 1, "version": version}})
+
+    async def run():
+        cache = make_cache(handler, ttl=0)
+        assert (await cache.get("anime", "1"))["version"] == 1
+        assert (await cache.get("anime", "1"))["version"] == 1
+        await asyncio.sleep(0.05)
+        assert (await cache.get("anime", "1"))["version"] == 2
+        await cache.client.shutdown()
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.refreshes >= 1
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, px=None):
+        self.values[key] = value
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+
+def test_primed_entities_are_shared():
+    def handler(request: httpx.Request):
+        raise AssertionError("primed entities shouldn't be loaded")
+
+    async def run():
+        redis = FakeRedis()
+        cache = make_cache(handler, redis=redis)
+        cache.prime("anime", {"id": 1})
+        await asyncio.sleep(0)
+
+        # Another worker with nothing cached locally.
+        other = make_cache(handler, redis=redis)
+        assert await other.get("anime", "1") == {"id": 1}
+        assert other.redis_hits == 1
+
+        await cache.client.shutdown()
+        await other.client.shutdown()
+
+    asyncio.run(run())
+
+
+def test_corrupt_shared_entities_are_reloaded():
+    def handler(request: httpx.Request):
+        return httpx.Response(200, json={"data": {"id": 1}})
+
+    async def run():
+        redis = FakeRedis()
+        cache = make_cache(handler, redis=redis)
+        results = []
+        for raw in (b"not json", b'"ab"', b"[1, 2, 3]", b'["soon", null]'):
+            redis.values = {f"{cache.prefix}:anime:1": raw}
+            cache.invalidate("anime", "1")
+            results.append(await cache.get("anime", "1"))
+            # The corrupt value was replaced by the loaded one.
+            assert await cache._get_shared("anime", "1") is not None  # noqa
+
+        await cache.client.shutdown()
+        return cache, results
+
+    cache, results = asyncio.run(run())
+    assert results == [{"id": 1}] * 4
+    assert cache.loads == 4
+    assert cache.redis_hits == 0
@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+import orjson
+
+from crunchy import app
+from crunchy.commands import events
+from crunchy.commands.events import EventDelivery, EventType
+from crunchy.config import DISCORD_API
+from crunchy.tools.fanout import WebhookDispatcher
+from crunchy.tools.http import HttpHandler
+
+
+def test_dead_webhooks_are_left_out_of_later_deliveries(monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_TOKEN", "secret")
+    monkeypatch.setattr(app, "dead_webhooks", set())
+    delivered = []
+
+    def handler(request: httpx.Request):
+        delivered.append(request.url.path)
+        if request.url.path.endswith("/dead"):
+            return httpx.Response(404, json={"message": "Unknown Webhook"})
+        return httpx.Response(200, json={})
+
+    live = f"{DISCORD_API}/webhooks/1/live"
+    dead = f"{DISCORD_API}/webhooks/2/dead"
+    delivery = EventDelivery(payload={"content": "hello"}, webhooks=[live, dead])
+
+    async def run():
+        http = HttpHandler("token", transport=httpx.MockTransport(handler))
+        app.webhooks = WebhookDispatcher(
+            http, concurrency=2, max_attempts=1, progress_interval=60
+        )
+
+        try:
+            refused = await events.receive_event(
+                app, EventType.News, delivery, "Bearer wrong"
+            )
+            assert refused.status_code == 401
+
+            first = await events.deliver_event(
+                app, EventType.News, delivery.payload, delivery.webhooks
+            )
+            assert first.dead == [dead]
+
+            resp = await events.receive_event(
+                app, EventType.News, delivery, "Bearer secret"
+            )
+            await asyncio.gather(*app._background)  # noqa
+            return resp
+        finally:
+            await http.shutdown()
+            app.webhooks = None
+
+    resp = asyncio.run(run())
+    assert resp.status_code == 202
+    assert orjson.loads(resp.body) == {"event": "news", "webhooks": 1, "dead": [dead]}
+    # The dead webhook was only tried by the first delivery.
+    assert [path.rsplit("/", 1)[-1] for path in delivered].count("dead") == 1
+    assert [path.rsplit("/", 1)[-1] for path in delivered].count("live") == 2
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+
+from crunchy.config import DISCORD_API
+from crunchy.tools import fanout
+from crunchy.tools.fanout import WebhookDispatcher
+from crunchy.tools.breaker import CLOSED, OPEN
+from crunchy.tools.http import DISCORD_WEBHOOKS, HttpHandler
+
+
+def test_events_are_delivered_to_every_webhook():
+    attempts = {}
+
+    def handler(request: httpx.Request):
+        token = request.url.path.rsplit("/", 1)[-1]
+        attempts[token] = attempts.get(token, 0) + 1
+
+        if token == "dead":
+            return httpx.Response(404, json={"message": "Unknown Webhook"})
+        if token == "flaky" and attempts[token] == 1:
+            return httpx.Response(502, json={"message": "Bad Gateway"})
+        assert request.content == b'{"content":"hello"}'
+        return httpx.Response(200, json={})
+
+    webhooks = [
+        f"{DISCORD_API}/webhooks/{i}/{token}"
+        for i, token in enumerate(["live", "flaky", "dead", "other"])
+    ]
+    removed = []
+
+    async def on_dead(url: str):
+        removed.append(url)
+
+    async def run():
+        http = HttpHandler("token", transport=httpx.MockTransport(handler))
+        dispatcher = WebhookDispatcher(
+            http, concurrency=2, max_attempts=3, progress_interval=60
+        )
+        progress = await dispatcher.dispatch(
+            "news", {"content": "hello"}, webhooks, on_dead=on_dead
+        )
+        await http.shutdown()
+        return progress
+
+    progress = asyncio.run(run())
+    assert progress.delivered == 3
+    assert progress.retries == 1
+    assert progress.dead == removed == [webhooks[2]]
+    assert attempts == {"live": 1, "flaky": 2, "dead": 1, "other": 1}
+
+
+def test_failing_fan_out_does_not_open_the_interaction_circuit():
+    def handler(request: httpx.Request):
+        return httpx.Response(502, json={"message": "Bad Gateway"})
+
+    webhooks = [f"{DISCORD_API}/webhooks/{i}/token" for i in range(40)]
+
+    async def run():
+        http = HttpHandler("token", transport=httpx.MockTransport(handler))
+        dispatcher = WebhookDispatcher(
+            http, concurrency=8, max_attempts=1, progress_interval=60
+        )
+        progress = await dispatcher.dispatch("news", {"content": "hello"}, webhooks)
+        await http.shutdown()
+        return http, progress
+
+    http, progress = asyncio.run(run())
+    assert progress.failed == len(webhooks)
+    assert http.breakers[DISCORD_WEBHOOKS].state == OPEN
+    assert http.breaker.state == CLOSED
+
+
+def test_connection_failures_are_retried_once_per_attempt(monkeypatch):
+    monkeypatch.setattr(fanout, "RETRY_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(fanout, "RETRY_BACKOFF_CAP", 0.001)
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def run():
+        http = HttpHandler("token", transport=httpx.MockTransport(handler))
+        dispatcher = WebhookDispatcher(
+            http, concurrency=1, max_attempts=3, progress_interval=60
+        )
+        progress = await dispatcher.dispatch(
+            "news", {"content": "hello"}, [f"{DISCORD_API}/webhooks/1/token"]
+        )
+        await http.shutdown()
+        return progress
+
+    progress = asyncio.run(run())
+    assert progress.failed == 1
+    assert len(calls) == 3
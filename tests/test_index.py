@@ -0,0 +1,76 @@
+from crunchy.tools.index import TitleIndex
+
+
+def make_entity(id_, title, title_english=None, title_japanese=None):
+    return {
+        "id": id_,
+        "title": title,
+        "title_english": title_english,
+        "title_japanese": title_japanese,
+    }
+
+
+def test_prefix_search_over_all_titles():
+    index = TitleIndex()
+    index.update(
+        [
+            make_entity(1, "Shingeki no Kyojin", "Attack on Titan", "進撃の巨人"),
+            make_entity(2, "One Piece", None, "ワンピース"),
+            make_entity(3, "One Punch Man"),
+        ]
+    )
+
+    assert index.search("attack ON") == [("1", "Attack on Titan")]
+    assert index.search("shingeki") == [("1", "Attack on Titan")]
+    assert index.search("進撃") == [("1", "Attack on Titan")]
+    assert index.search("one p") == [("2", "One Piece"), ("3", "One Punch Man")]
+    assert index.search("one p", limit=1) == [("2", "One Piece")]
+    assert index.search("naruto") == []
+    assert index.search("  ") == []
+
+
+def test_incremental_update():
+    index = TitleIndex()
+    index.update([make_entity(1, "Boku no Hero Academia")])
+
+    assert index.update([make_entity(1, "Boku no Hero Academia")]) == 0
+    assert index.update([make_entity(1, "Boku no Hero", "My Hero Academia")]) == 1
+
+    assert index.search("my hero") == [("1", "My Hero Academia")]
+    assert index.search("boku no hero a") == []
+    assert len(index) == 1
+
+
+def test_update_removes_missing_entities():
+    index = TitleIndex()
+    index.update(
+        [
+            make_entity(1, "One Piece"),
+            make_entity(2, "One Punch Man"),
+            make_entity(3, "Naruto"),
+        ]
+    )
+
+    assert (
+        index.update([make_entity(3, "Naruto"), make_entity(2, "One Punch Man")]) == 1
+    )
+    assert index.search("one p") == [("2", "One Punch Man")]
+    assert index.search("naruto") == [("3", "Naruto")]
+    assert len(index) == 2
+
+    assert index.update([]) == 2
+    assert index.search("naruto") == []
+    assert len(index) == 0
+
+
+def test_searches_keep_the_index_they_started_with():
+    index = TitleIndex()
+    index.update([make_entity(1, "One Piece")])
+
+    snapshot = index._snapshot
+    index.update([make_entity(2, "One Punch Man")])
+
+    # The old snapshot is never modified, only replaced.
+    assert snapshot.keys == ["one piece"]
+    assert snapshot.ids == ["1"]
+    assert index.search("one") == [("2", "One Punch Man")]
@@ -0,0 +1,42 @@
+import logging
+import sys
+
+import orjson
+
+from crunchy.tools.logs import JsonFormatter, RateLimitFilter
+
+
+def _record(msg: str, *args, exc_info=None) -> logging.LogRecord:
+    return logging.LogRecord(
+        "crunchy-test", logging.WARNING, __file__, 1, msg, args, exc_info
+    )
+
+
+def test_repeated_records_are_rate_limited():
+    limiter = RateLimitFilter(burst=2, interval=60, debug_sample_rate=1)
+
+    template = "Retrying in %.2f seconds."
+    passed = [limiter.filter(_record(template, i)) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+
+    # Different lines are limited separately.
+    assert limiter.filter(_record("something else"))
+
+    limiter.interval = 0
+    record = _record(template, 1.0)
+    assert limiter.filter(record)
+    assert record.suppressed == 3
+
+
+def test_records_are_formatted_as_json():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = _record("failed after %d tries", 4, exc_info=sys.exc_info())
+    record.suppressed = 2
+
+    entry = orjson.loads(JsonFormatter().format(record))
+    assert entry["level"] == "WARNING"
+    assert entry["message"] == "failed after 4 tries"
+    assert entry["suppressed"] == 2
+    assert "ValueError: boom" in entry["exc_info"]
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+from roid.command import CommandContext, CommandType
+
+from crunchy.tools.manifest import (
+    GLOBAL,
+    ScopeChanges,
+    compile_commands,
+    diff,
+    make_manifest,
+)
+
+
+def test_only_changed_commands_are_synced():
+    compiled = {
+        GLOBAL: {"anime": {"name": "anime"}, "manga": {"name": "manga"}},
+        "1234": {"my-list": {"name": "my-list"}},
+    }
+    previous = make_manifest(compiled)
+    assert diff(previous, make_manifest(compiled)) == {}
+
+    compiled[GLOBAL]["anime"] = {"name": "anime", "description": "changed"}
+    del compiled["1234"]
+    compiled["5678"] = {"my-list": {"name": "my-list"}}
+
+    assert diff(previous, make_manifest(compiled)) == {
+        GLOBAL: ScopeChanges(changed=["anime"], removed=[], unknown=False),
+        "1234": ScopeChanges(changed=[], removed=["my-list"], unknown=False),
+        "5678": ScopeChanges(changed=["my-list"], removed=[], unknown=True),
+    }
+
+
+def test_compiling_leaves_the_commands_untouched():
+    ctx = CommandContext(
+        type=CommandType.CHAT_INPUT,
+        name="my-list",
+        description="Your tracking list.",
+        application_id="1",
+        default_permission=True,
+    )
+    command = SimpleNamespace(ctx=ctx, guild_ids=[1234, 5678])
+
+    compiled = compile_commands([command])
+
+    assert compiled["1234"]["my-list"]["guild_id"] == 1234
+    assert compiled["5678"]["my-list"]["guild_id"] == 5678
+    assert ctx.guild_id is None
@@ -0,0 +1,21 @@
+from crunchy.tools.metrics import Counter, Histogram, Registry
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests.", ("route",), registry=registry)
+    latency = Histogram(
+        "latency_seconds", "Latency.", ("route",), buckets=(0.1, 1), registry=registry
+    )
+
+    requests.labels('say "hi"').inc()
+    latency.labels("a").observe(0.05)
+    latency.labels("a").observe(0.5)
+    latency.labels("a").observe(5)
+
+    text = registry.render()
+    assert 'requests_total{route="say \\"hi\\""} 1.0' in text
+    assert 'latency_seconds_bucket{route="a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="a",le="1"} 2' in text
+    assert 'latency_seconds_bucket{route="a",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="a"} 3' in text
@@ -0,0 +1,79 @@
+import asyncio
+
+import httpx
+
+from crunchy.tools import deadline
+from crunchy.tools.pool import KeepWarm, call_timeout
+
+
+def test_call_timeout_is_capped_by_the_deadline():
+    timeout = httpx.Timeout(5, connect=1)
+
+    async def run():
+        assert call_timeout(timeout) is timeout
+        with deadline.deadline(2):
+            return call_timeout(timeout)
+
+    capped = asyncio.run(run())
+    assert capped.connect == 1
+    assert 1.9 < capped.read <= 2
+
+
+def test_keep_warm_pings_every_client():
+    pings = []
+
+    def handler(request: httpx.Request):
+        pings.append(request.method)
+        return httpx.Response(200)
+
+    async def run():
+        clients = [
+            httpx.AsyncClient(transport=httpx.MockTransport(handler)) for _ in range(2)
+        ]
+        keep_warm = KeepWarm(clients, "HEAD", "https://api.example.com/", interval=0.01)
+        await keep_warm.warm()
+        assert len(pings) == 2
+
+        keep_warm.start()
+        await asyncio.sleep(0.05)
+        await keep_warm.shutdown()
+
+        for client in clients:
+            await client.aclose()
+
+    asyncio.run(run())
+    assert len(pings) > 2
+    assert set(pings) == {"HEAD"}
+
+
+def test_keep_warm_survives_unexpected_errors(monkeypatch):
+    pings = []
+
+    def handler(request: httpx.Request):
+        pings.append(request.method)
+        return httpx.Response(200)
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        keep_warm = KeepWarm(
+            [client], "HEAD", "https://api.example.com/", interval=0.01
+        )
+
+        failures = 0
+        ping = keep_warm._ping  # noqa
+
+        async def flaky_ping(client):
+            nonlocal failures
+            if failures < 2:
+                failures += 1
+                raise RuntimeError("boom")
+            await ping(client)
+
+        monkeypatch.setattr(keep_warm, "_ping", flaky_ping)
+        keep_warm.start()
+        await asyncio.sleep(0.1)
+        await keep_warm.shutdown()
+        await client.aclose()
+
+    asyncio.run(run())
+    assert pings
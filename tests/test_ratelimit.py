@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import httpx
+
+from crunchy.tools import ratelimit
+from crunchy.tools.ratelimit import BucketMap, route_key
+
+API = "https://discord.com/api/v8"
+
+
+def test_route_key():
+    route, major = route_key("POST", f"{API}/channels/1234/messages")
+    assert (route, major) == ("POST /api/v8/channels/{id}/messages", "1234")
+
+    route, major = route_key("GET", f"{API}/guilds/99/commands")
+    assert (route, major) == ("GET /api/v8/guilds/{id}/commands", "99")
+
+    assert route_key("GET", f"{API}/gateway") == ("GET /api/v8/gateway", "")
+
+
+def test_follow_ups_have_a_bucket_per_token():
+    first = route_key("POST", f"{API}/webhooks/1/token-a")
+    second = route_key("POST", f"{API}/webhooks/1/token-b")
+    original = route_key("PATCH", f"{API}/webhooks/1/token-a/messages/@original")
+
+    assert first[0] == second[0] == "POST /api/v8/webhooks/{id}/{token}"
+    assert first[1] != second[1]
+    assert first[1].startswith("1:")
+    assert original[1] == first[1]
+
+    # The token isn't exposed through the bucket key.
+    assert "token-a" not in first[1]
+
+
+def test_buckets_are_shared_once_learnt():
+    async def run():
+        buckets = BucketMap()
+
+        bucket = buckets.get("POST", f"{API}/channels/1/messages")
+        assert buckets.get("POST", f"{API}/channels/1/messages") is bucket
+        assert buckets.get("POST", f"{API}/channels/2/messages") is not bucket
+
+        r = httpx.Response(
+            200,
+            headers={
+                "X-Ratelimit-Bucket": "abc",
+                "X-Ratelimit-Limit": "5",
+                "X-Ratelimit-Remaining": "4",
+                "X-Ratelimit-Reset-After": "1",
+            },
+        )
+        buckets.learn(bucket, r)
+        bucket.update(r)
+
+        assert bucket.key == "abc:1"
+        assert (bucket.limit, bucket.remaining) == (5, 4)
+        assert buckets.get("POST", f"{API}/channels/1/messages") is bucket
+
+    asyncio.run(run())
+
+
+def test_idle_buckets_are_pruned(monkeypatch):
+    monkeypatch.setattr(ratelimit, "MAX_IDLE_BUCKETS", 4)
+
+    async def run():
+        buckets = BucketMap()
+        busy = buckets.get("POST", f"{API}/channels/0/messages")
+        await busy.lock.acquire()
+
+        for i in range(1, 5):
+            buckets.get("POST", f"{API}/channels/{i}/messages")
+
+        # Only the busy bucket survives pruning along with the newest one.
+        assert buckets.stats()["bucket_count"] == 2
+        assert buckets.get("POST", f"{API}/channels/0/messages") is busy
+
+    asyncio.run(run())
+
+
+def test_pruning_many_busy_buckets_is_amortised(monkeypatch):
+    monkeypatch.setattr(ratelimit, "MAX_IDLE_BUCKETS", 2048)
+
+    async def run():
+        buckets = BucketMap()
+
+        pruned = 0
+        prune = buckets._prune  # noqa
+
+        def counted():
+            nonlocal pruned
+            pruned += 1
+            prune()
+
+        buckets._prune = counted  # noqa
+
+        # Every webhook of a fan-out is busy until it's bucket resets.
+        webhooks = []
+        for i in range(10_000):
+            bucket = buckets.get("POST", f"{API}/webhooks/{i}/token")
+            bucket.reset_at = time.monotonic() + 60
+            webhooks.append(bucket)
+
+        assert pruned <= 3
+        assert buckets.stats()["bucket_count"] == 10_000
+
+        # Once they reset they're pruned as more buckets are needed.
+        for bucket in webhooks:
+            bucket.reset_at = 0.0
+        for i in range(10_000):
+            buckets.get("POST", f"{API}/channels/{i}/messages")
+
+        assert buckets.stats()["bucket_count"] < 10_000
+        assert pruned <= 6
+
+    asyncio.run(run())
+
+
+def test_global_rate_limit_holds_back_requests():
+    async def run():
+        buckets = BucketMap()
+        buckets.set_global(0.05)
+
+        start = time.monotonic()
+        await buckets.wait_global()
+        return time.monotonic() - start, buckets.stats()
+
+    waited, stats = asyncio.run(run())
+    assert waited >= 0.04
+    assert stats["global_limited_count"] == 1
+    assert not stats["global_limited"]
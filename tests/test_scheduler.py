@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from crunchy.tools import deadline, scheduler
+from crunchy.tools.scheduler import RequestScheduler, route_family
+
+
+def test_route_family():
+    assert route_family("data/anime/search") == "data/anime/search"
+    assert route_family("/data/anime/1234") == "data/anime"
+    assert route_family("/data/manga/search") == "data/manga/search"
+    assert route_family("/tracking/1234/tags") == "tracking"
+    assert route_family("/events/news/update") == "events"
+    assert route_family("/something/else") == "default"
+
+
+def test_paused_family_does_not_block_others():
+    async def run():
+        scheduler = RequestScheduler(max_concurrency=4, route_concurrency=2)
+        scheduler.pause("tracking", 5)
+
+        async def use(family):
+            async with scheduler.slot(family):
+                return family
+
+        done = await asyncio.wait_for(use("data/anime/search"), timeout=1)
+        assert done == "data/anime/search"
+
+        paused = asyncio.ensure_future(use("tracking"))
+        await asyncio.sleep(0.05)
+        assert not paused.done()
+        paused.cancel()
+
+    asyncio.run(run())
+
+
+def test_queued_requests_are_let_through_most_urgent_first():
+    order = []
+
+    async def run():
+        requests = RequestScheduler(max_concurrency=1, route_concurrency=1)
+
+        async def use(name, level, timeout):
+            with scheduler.priority(level), deadline.deadline(timeout):
+                async with requests.slot("tracking"):
+                    order.append(name)
+                    await asyncio.sleep(0.01)
+
+        async with requests.slot("tracking"):
+            tasks = [
+                asyncio.ensure_future(use("background", scheduler.BACKGROUND, 60)),
+                asyncio.ensure_future(use("later", scheduler.INTERACTION, 60)),
+                asyncio.ensure_future(use("sooner", scheduler.INTERACTION, 30)),
+                asyncio.ensure_future(use("autocomplete", scheduler.AUTOCOMPLETE, 3)),
+            ]
+            await asyncio.sleep(0.01)
+            assert requests.queued() == 4
+
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["autocomplete", "sooner", "later", "background"]
+
+
+def test_expired_requests_are_dropped_from_the_queue():
+    async def run():
+        requests = RequestScheduler(
+            max_concurrency=1, route_concurrency=1, max_queued=1
+        )
+
+        async def use():
+            with deadline.deadline(0.05):
+                async with requests.slot("tracking"):
+                    pass
+
+        async with requests.slot("tracking"):
+            waiting = asyncio.ensure_future(use())
+            await asyncio.sleep(0.01)
+            assert requests.overloaded()
+
+            with pytest.raises(deadline.DeadlineExceeded):
+                await waiting
+
+        assert requests.queued() == 0
+        assert not requests.overloaded()
+
+        # The slot was handed back rather than lost to the expired request.
+        await asyncio.wait_for(use(), timeout=1)
+
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+from crunchy.commands import tracking
+from crunchy.config import TRACKING_PAGE_SIZE
+from crunchy.tools.cache import TTLCache
+
+
+class TrackingApi:
+    def __init__(self, size: int):
+        self.size = size
+        self.requests = []
+
+    async def request(self, method: str, section: str, **extra):
+        self.requests.append((method, section, extra))
+        entries = [{"id": i, "title": f"Entry {i + 1}"} for i in range(self.size)]
+        return {"data": entries}
+
+
+def make_app(size: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        client=TrackingApi(size),
+        tracking_pages=TTLCache(maxsize=16, ttl=60),
+    )
+
+
+def describe(resp) -> tuple:
+    """The numbers of the entries shown and which buttons are enabled."""
+    payload = resp._payload  # noqa
+    lines = payload.embeds[0].description.split("\n")
+    numbers = [int(line.split("`")[1].rstrip(".")) for line in lines]
+    enabled = [getattr(c, "disabled", False) is not True for c in payload.components[0]]
+    return numbers[0], numbers[-1], enabled, payload.component_context["offset"]
+
+
+def test_pages_are_sliced_from_one_request():
+    app = make_app(TRACKING_PAGE_SIZE * 2 + 5)
+
+    async def run():
+        first = await tracking.make_page_response(app, 1, "watchlist", offset=0)
+        ctx = {"user_id": 1, "group": "watchlist", "offset": 0}
+
+        pages = [first]
+        for delta in (1, 1, -1, -1, -1):
+            pages.append(await tracking.move_page(app, ctx, delta * TRACKING_PAGE_SIZE))
+        return pages, ctx
+
+    pages, ctx = asyncio.run(run())
+    size = TRACKING_PAGE_SIZE
+
+    assert [describe(page) for page in pages] == [
+        (1, size, [False, True], 0),
+        (size + 1, size * 2, [True, True], size),
+        (size * 2 + 1, size * 2 + 5, [True, False], size * 2),
+        (size + 1, size * 2, [True, True], size),
+        (1, size, [False, True], 0),
+        # Moving back from the first page stays on it.
+        (1, size, [False, True], 0),
+    ]
+    assert ctx["offset"] == 0
+
+    # The whole list is fetched once, without any paging params.
+    assert app.client.requests == [("GET", "tracking/1/watchlist", {})]
+
+
+def test_empty_list():
+    app = make_app(0)
+    resp = asyncio.run(tracking.make_page_response(app, 1, "watchlist", offset=0))
+    assert "empty" in resp._payload.content  # noqa
+
+
+def test_long_lists_are_fetched_once():
+    app = make_app(TRACKING_PAGE_SIZE * 50 + 3)
+    last = TRACKING_PAGE_SIZE * 50
+
+    async def run():
+        ctx = {"user_id": 1, "group": "watchlist", "offset": last - TRACKING_PAGE_SIZE}
+        before = await tracking.move_page(app, ctx, 0)
+        end = await tracking.move_page(app, ctx, TRACKING_PAGE_SIZE)
+        return before, end
+
+    before, end = asyncio.run(run())
+
+    assert describe(before) == (
+        last - TRACKING_PAGE_SIZE + 1,
+        last,
+        [True, True],
+        last - TRACKING_PAGE_SIZE,
+    )
+    assert describe(end) == (last + 1, last + 3, [True, False], last)
+    assert len(app.client.requests) == 1